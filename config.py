@@ -1,4 +1,4 @@
-from utils.files import find_txt_files, is_valid_path
+from utils.files import has_txt_files, is_valid_path
 
 
 SYSTEM_PROMPT = "You are a helpful assistant"
@@ -6,6 +6,14 @@ SYSTEM_PROMPT = "You are a helpful assistant"
 # If specified, the app will read the .txt files in the dir and always use them as context.
 # Useful for stuff like providing the AI with documentation for your project etc.
 CONTEXT_TEXTS_DIR_PATH = None
+# If enabled, the context texts aren't all added to the first message. Instead, each message gets
+# only the parts of them relevant to it, found with a local search index (saved to CONTEXT_INDEX_FILE_PATH).
+# Saves a lot of tokens with large docs.
+RETRIEVE_CONTEXT7 = False
+CONTEXT_INDEX_FILE_PATH = "context_index.json"
+RETRIEVAL_CHUNK_TOKENS = 300  # The approximate size of the indexed parts
+RETRIEVAL_TOP_K = 8  # How many parts are added to a message at most
+RETRIEVAL_TOKEN_BUDGET = 2000  # The approximate max tokens of the parts added to a message
 
 
 core_font = "assets/fonts/EBGaramond"  # a hyperlegible font that supports both Latin and Cyrillic
@@ -25,11 +33,65 @@ MARKDOWN_HIGHLIGHTING7 = True
 COLLAPSE_USER_MESSAGES = True # Set true to avoid seeing massive context texts etc
 DARK_THEME7 = True # Note: the light theme doesn't support code highlighting
 
+STREAM_RESPONSES7 = True  # Show the assistant's reply as it's being generated
+MOCK_AI_RESPONSES7 = False  # Set true to get fake replies without calling the API (for offline testing)
+MOCK_STREAM_DELAY_SECONDS = 0.05  # Delay between the fake streamed words
+
+# Only the messages near the visible part of the chat are kept as GUI elements,
+# the rest are replaced with empty spacers. Keeps long conversations fast.
+VIRTUALIZE_CHAT_HISTORY7 = True
+VIRTUALIZATION_MARGIN_PX = 1500  # How far above and below the visible part the messages are kept
+VIRTUALIZATION_MAX_BUILDS_PER_FRAME = 3
+
+# Parse and wrap the markdown in a background thread. Only the GUI elements are created in the main one.
+LAYOUT_IN_BACKGROUND7 = True
+
+# Time per frame for the GUI updates queued by other threads (e.g. when a reply arrives).
+# The updates left when it's spent are run in the next frames.
+GUI_UPDATE_BUDGET_MS = 8
+
+# Mark the system prompt, the first message (with the context texts) and the latest message as cacheable.
+# The API then reuses the already processed beginning of the conversation: it's cheaper and the reply starts sooner.
+PROMPT_CACHING7 = True
+
+# The approximate max input tokens of a request. Longer conversations are shortened before sending:
+# the images of the older messages are omitted, then the oldest turns, down to the target ratio of the budget.
+# The first message (with the context texts) and the recent messages are always sent.
+CONTEXT_WINDOW_TOKEN_BUDGET = 150000
+CONTEXT_WINDOW_TARGET_RATIO = 0.75
+CONTEXT_WINDOW_KEEP_RECENT_MESSAGES = 6
+
+# When the older messages of a conversation (all but the first and the recent ones) are over the threshold,
+# they are summarized in a background request, and the next requests send the summary instead of them.
+# The GUI and the saved logs keep the full conversation.
+COMPACT_CONVERSATIONS7 = True
+COMPACTION_THRESHOLD_TOKENS = 40000
+COMPACTION_KEEP_RECENT_MESSAGES = 6
+COMPACTION_PROMPT = (
+    "Summarize the conversation below for your own future reference, as it will replace it. "
+    "Keep the facts, decisions, code, names and numbers that may matter later, and the open questions. "
+    "Be concise. Reply with the summary only."
+)
+SUMMARY_MESSAGE_PREFIX = "[The summary of the earlier part of our conversation]\n\n"
+
+# Conversations are saved to an SQLite database (conversations/conversations.db) after each change.
+# To import the old logs: python -m utils.conversation_store conversations
+# If disabled, they are saved to append-only journals (conversations/*.jsonl) instead.
+# The .txt logs are written in both cases, on exit and on reset.
+STORE_CONVERSATIONS_IN_DB7 = True
+CONVERSATIONS_DB_FILENAME = "conversations.db"
+# The journals are fsynced after this many saves (and on exit)
+JOURNAL_FSYNC_BATCH = 4
+
 
 # Default window dimensions
 DEFAULT_WIDTH = 800
 DEFAULT_HEIGHT = 600
 
+# While the window is being resized, the messages are only clipped.
+# They are re-wrapped once no resize events came for this long.
+RESIZE_SETTLE_SECONDS = 0.2
+
 # UI Element dimensions
 INPUT_HEIGHT = 50
 BUTTON_HEIGHT = INPUT_HEIGHT
@@ -38,6 +100,10 @@ PADDING = 20
 FONT_BUTTON_WIDTH = 30
 
 IMG_THUMB_MAX_SIZE = 100
+# The attached images are stored here once (named by the SHA-256 of the encoded JPEG),
+# and the conversations only refer to them
+IMAGE_STORE_DIR_PATH = "conversations/images"
+IMAGE_BASE64_CACHE_SIZE = 8  # How many images are kept encoded in memory between the requests
 
 MESSAGE_POPUP_WIDTH = DEFAULT_WIDTH
 MESSAGE_POPUP_HEIGHT = DEFAULT_HEIGHT
@@ -53,6 +119,10 @@ THINKING_PLACEHOLDER = "[Thinking...]"
 INPUT_HINT = "Type your message here or paste an image path..."
 TOTAL_COST_TEXT = "Spent this month: $"
 SHORTENED_MESSAGE_PLACEHOLDER = "... [click for full message]"
+IMAGE_OMITTED_PLACEHOLDER = "[An image was here. It was omitted to keep the conversation within the token budget]"
+IMAGE_MISSING_PLACEHOLDER = "[An image was here. It was omitted, as its file is missing]"
+SEARCH_HINT = "Search chats..."
+SEARCH_RESULTS_LIMIT = 30
 
 # API costs
 """
@@ -64,6 +134,9 @@ Claude 3.5 Sonnet:
 input_text_cost_mtok_usd = 3
 output_text_cost_mtok_usd = 15
 image_cost_denominator = 750  # e.g. tokens = (width px * height px)/750
+# https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+cache_write_cost_multiplier = 1.25  # of the input price, for the tokens written to the prompt cache
+cache_read_cost_multiplier = 0.1  # of the input price, for the tokens read from it
 
 ######################### INCOMPATIBILITY FIXES #########################
 
@@ -115,8 +188,7 @@ if number_of_sizes > 10:
 # Sanity checks for context texts dir
 if CONTEXT_TEXTS_DIR_PATH is not None:
     if is_valid_path(CONTEXT_TEXTS_DIR_PATH):
-        txt_files_list = find_txt_files(CONTEXT_TEXTS_DIR_PATH)
-        if len(txt_files_list) == 0:
+        if not has_txt_files(CONTEXT_TEXTS_DIR_PATH):
             raise ValueError(f"No .txt files found in the dir path {CONTEXT_TEXTS_DIR_PATH}")
     else:
         raise ValueError(f"Can't access the dir path {CONTEXT_TEXTS_DIR_PATH}")
@@ -1,16 +1,96 @@
 import dearpygui.dearpygui as dpg
 
+from config import (
+    VIRTUALIZE_CHAT_HISTORY7,
+    VIRTUALIZATION_MARGIN_PX,
+    VIRTUALIZATION_MAX_BUILDS_PER_FRAME,
+)
 from gui.extended_markdown import ExtendedMarkdownText
 from gui.message_gui import MessageGUI
+from gui.update_scheduler import PRIORITY_LOW
 from utils.markdown import CallInNextFrame
+from utils.messages import extract_message_text
+
+
+class MessageSlot:
+    """
+    The place of one message in the chat history.
+
+    Holds either the MessageGUI of the message, or, when the message is far from the viewport,
+    a spacer with the last measured height of the message, so the scrolling stays the same.
+    """
+
+    def __init__(self, message, parent):
+        self.message = message
+        # The displayed text, to detect messages modified in place
+        self.text = extract_message_text(message["content"])
+        self.container_id = dpg.add_group(parent=parent)
+        self.separator_id = dpg.add_separator(parent=parent)
+        self.message_gui = None
+        self.placeholder_id = None
+        self.height = None  # The last measured height of the message
+
+    @property
+    def materialised7(self):
+        return self.message_gui is not None
+
+    def is_outdated(self):
+        return extract_message_text(self.message["content"]) != self.text
+
+    def materialise(self, wrap_value, app):
+        """Builds the widgets of the message in place of the placeholder."""
+        if self.placeholder_id is not None and dpg.does_item_exist(self.placeholder_id):
+            dpg.delete_item(self.placeholder_id)
+        self.placeholder_id = None
+        self.text = extract_message_text(self.message["content"])
+        self.message_gui = MessageGUI(
+            message=self.message,
+            parent=self.container_id,
+            wrap_value=wrap_value,
+            app=app,
+        )
+        return self.message_gui
+
+    def evict(self):
+        """Replaces the widgets of the message with a spacer of the same height."""
+        height = dpg.get_item_rect_size(self.container_id)[1]
+        if height > 0:
+            self.height = height
+        self.message_gui.delete()
+        self.message_gui = None
+        self.placeholder_id = dpg.add_spacer(height=max(int(self.height or 1), 1), parent=self.container_id)
+
+    def get_bounds(self):
+        """Returns the top and the height of the message in the scrolled content (0 height if not laid out yet)."""
+        y = dpg.get_item_pos(self.container_id)[1]
+        height = dpg.get_item_rect_size(self.container_id)[1]
+        return y, height
+
+    def delete(self):
+        if self.message_gui is not None:
+            self.message_gui.delete()
+            self.message_gui = None
+        for item in [self.container_id, self.separator_id]:
+            if dpg.does_item_exist(item):
+                dpg.delete_item(item)
 
 
 class ChatHistory:
     def __init__(self, app):
         self.app = app
-        self.message_widgets = []  # Store instances of MessageGUI
+        self.slots = []  # One MessageSlot per displayed message
         self.chat_history_id = None  # Will be initialized in create_chat_history()
         self.chat_history_markdown = None
+        self.wrap_value = app.chat_history_wrap  # The wrap value the messages are built with
+
+        # What the last virtualization pass has seen, to skip the passes when nothing has changed
+        self.virtualization_state = None
+        self.layout_version = 0
+        self.pending_builds7 = False
+
+        # The message that is being streamed, and whether its GUI update is already queued
+        self.streamed_message = None
+        self.streamed_update_pending7 = False
 
     def create_chat_history(self, parent):
         # Create an ExtendedMarkdownText instance for chat history
@@ -22,7 +102,15 @@ class ChatHistory:
         )
 
     def update_chat_history(self):
-        wrap_value = self.app.chat_history_wrap
+        """
+        Brings the display in sync with the conversation.
+
+        Only the messages that changed since the last update are re-created:
+        the widgets are matched to the messages by identity, the unchanged prefix is kept,
+        and only the rest (usually the thinking placeholder and the new messages) is rebuilt.
+        So the cost of a turn doesn't grow with the length of the conversation.
+        """
+        wrap_value = self.wrap_value
 
         # Safely get the conversation from ConversationManager
         with self.app.conversation_manager.conversation_lock:
@@ -33,32 +121,95 @@ class ChatHistory:
         if conversation and conversation[-1]['role'] == 'assistant':
             scroll_to_bottom_needed = True
 
-        # Clear previous chat history display
-        self.clear_chat_history_display()
+        kept_count = self.count_unchanged_messages(conversation)
+
+        # Remove the widgets of the messages that are gone or changed
+        if kept_count == 0:
+            self.clear_chat_history_display()
+        else:
+            for slot in self.slots[kept_count:]:
+                slot.delete()
+            del self.slots[kept_count:]
 
         # Ensure texture registry exists
         self.ensure_texture_registry()
 
-        # Iterate over messages and display them
-        for idx, message in enumerate(conversation):
-            self.display_message(message, wrap_value)
+        # Display only the new messages, with the current font size
+        new_messages = conversation[kept_count:]
+        for i, message in enumerate(new_messages):
+            message_gui = self.display_message(message, wrap_value)
+            # Already rendered with the current wrap value, so only bind the font
+            message_gui.apply_font_size(rerender7=False)
+            if i + 1 < len(new_messages) and self.app.update_queue.out_of_budget7():
+                # Rebuilding a long history: the rest is displayed in the next frames
+                # (the messages displayed so far are kept by the next call)
+                self.layout_version += 1
+                self.app.update_queue.put(self.update_chat_history, priority=PRIORITY_LOW)
+                return
 
-        # Apply the current font size to all messages
-        self.apply_font_size()
+        self.layout_version += 1
 
         # Scroll to the bottom if needed
         if scroll_to_bottom_needed:
-            def scroll_to_bottom():
-                max_scroll = dpg.get_y_scroll_max("chat_history_child_window")
-                dpg.set_y_scroll("chat_history_child_window", max_scroll)
+            self.scroll_to_bottom()
+
+    def scroll_to_bottom(self):
+        def scroll_to_bottom():
+            max_scroll = dpg.get_y_scroll_max("chat_history_child_window")
+            dpg.set_y_scroll("chat_history_child_window", max_scroll)
+
+        # Use CallInNextFrame to ensure scrolling occurs after GUI updates
+        CallInNextFrame.append(scroll_to_bottom)
+
+    def schedule_streamed_message_update(self, message):
+        """
+        Called from the response thread after each streamed delta.
+        Queues at most one GUI update at a time, so fast deltas are coalesced into one re-render per frame.
+        """
+        self.streamed_message = message
+        if not self.streamed_update_pending7:
+            self.streamed_update_pending7 = True
+            self.app.update_queue.put(self.update_streamed_message)
+
+    def update_streamed_message(self):
+        """Grows the streamed message in place (runs in the main thread)."""
+        # Reset the flag before reading the text, so no delta is left unrendered
+        self.streamed_update_pending7 = False
+        message = self.streamed_message
+        if message is None:
+            return
+
+        last_slot = self.slots[-1] if self.slots else None
+        if last_slot is not None and last_slot.message is message:
+            last_slot.text = extract_message_text(message["content"])
+            # If the message is virtualized away, it will be built with the new text when scrolled to
+            if last_slot.materialised7:
+                last_slot.message_gui.update_content()
+        else:
+            # The streamed message is not displayed yet (e.g. the thinking placeholder is still shown)
+            self.update_chat_history()
+        self.scroll_to_bottom()
+
+    def count_unchanged_messages(self, conversation):
+        """Returns the number of leading messages whose widgets can be kept as is."""
+        kept_count = 0
+        for slot, message in zip(self.slots, conversation):
+            if slot.message is not message:
+                break
+            kept_count += 1
 
-            # Use CallInNextFrame to ensure scrolling occurs after GUI updates
-            CallInNextFrame.append(scroll_to_bottom)
+        # Only the last displayed message can be modified in place (e.g. a streamed reply)
+        if kept_count > 0 and self.slots[kept_count - 1].is_outdated():
+            kept_count -= 1
+        return kept_count
 
     def clear_chat_history_display(self):
         if self.chat_history_id and dpg.does_item_exist(self.chat_history_id):
             dpg.delete_item(self.chat_history_id, children_only=True)
-        self.message_widgets.clear()
+        # Also deletes the handler registries, which are not children of the history
+        for slot in self.slots:
+            slot.delete()
+        self.slots.clear()
 
     def ensure_texture_registry(self):
         if not dpg.does_item_exist("texture_registry"):
@@ -66,25 +217,73 @@ class ChatHistory:
                 pass  # Empty registry
 
     def display_message(self, message, wrap_value):
-        # Create a MessageGUI instance for this message
-        message_gui = MessageGUI(
-            message=message,
-            parent=self.chat_history_id,
-            wrap_value=wrap_value,
-            app=self.app,
-        )
-        self.message_widgets.append(message_gui)
+        # Create the slot of the message (with its separator), and the MessageGUI in it
+        slot = MessageSlot(message, parent=self.chat_history_id)
+        self.slots.append(slot)
+        return slot.materialise(wrap_value, self.app)
 
-        # Add a separator after the message
-        dpg.add_separator(parent=self.chat_history_id)
+    def get_message_widgets(self):
+        """Returns the MessageGUI instances that currently exist (not virtualized away)."""
+        return [slot.message_gui for slot in self.slots if slot.materialised7]
 
     def apply_font_size(self):
         """Applies the current font size to the message widgets."""
-        for message_gui in self.message_widgets:
-            message_gui.apply_font_size()
+        self.relayout()
 
     def update_wrap_value(self, wrap_value):
         """Updates the wrap value and applies it to all message widgets."""
-        for message_gui in self.message_widgets:
-            message_gui.wrap_value = wrap_value
-            message_gui.update()
\ No newline at end of file
+        self.relayout(wrap_value)
+
+    def relayout(self, wrap_value=None):
+        """
+        Applies the current font size and the wrap value (if given) to the message widgets in one pass.
+        Each message is re-rendered at most once, and only if its wrap value or font size changed.
+        """
+        if wrap_value is not None:
+            self.wrap_value = wrap_value
+        for message_gui in self.get_message_widgets():
+            message_gui.wrap_value = self.wrap_value
+            message_gui.apply_font_size(rerender7=False)
+            message_gui.update()
+        self.layout_version += 1
+
+    def update_virtualization(self):
+        """
+        Called every frame. Builds the widgets of the messages near the viewport,
+        and replaces the ones far from it with spacers of the same height.
+
+        Scrolling is what drives it: nothing is done while the scroll position,
+        the window height and the messages stay the same.
+        """
+        if not VIRTUALIZE_CHAT_HISTORY7 or not self.slots:
+            return
+        window = "chat_history_child_window"
+        if not dpg.does_item_exist(window):
+            return
+
+        scroll_y = dpg.get_y_scroll(window)
+        view_height = dpg.get_item_rect_size(window)[1]
+        state = (scroll_y, view_height, len(self.slots), self.layout_version)
+        if state == self.virtualization_state and not self.pending_builds7:
+            return
+        self.virtualization_state = state
+
+        top = scroll_y - VIRTUALIZATION_MARGIN_PX
+        bottom = scroll_y + view_height + VIRTUALIZATION_MARGIN_PX
+        builds_count = 0
+        self.pending_builds7 = False
+        for slot in self.slots:
+            y, height = slot.get_bounds()
+            if height == 0:
+                continue  # Not laid out yet, check again in the next frame
+            near7 = y + height >= top and y <= bottom
+            if near7 and not slot.materialised7:
+                # Limit the builds per frame, so a big jump doesn't freeze the UI
+                if builds_count >= VIRTUALIZATION_MAX_BUILDS_PER_FRAME:
+                    self.pending_builds7 = True
+                    continue
+                message_gui = slot.materialise(self.wrap_value, self.app)
+                message_gui.apply_font_size(rerender7=False)
+                builds_count += 1
+            elif not near7 and slot.materialised7:
+                slot.evict()
\ No newline at end of file
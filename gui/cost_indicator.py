@@ -1,5 +1,5 @@
 import dearpygui.dearpygui as dpg
-from utils.cost_manager import CostManager
+from utils.cost_manager import get_cost_manager
 from config import TOTAL_COST_TEXT
 
 class CostIndicator:
@@ -7,14 +7,15 @@ class CostIndicator:
         self.app = app
         self.parent = parent
         self.tag = "cost_indicator"
-        self.cost_manager = CostManager()
+        self.cost_manager = get_cost_manager()  # Shared with the AI provider, which logs the calls
         self.total_cost = 0.0
+        self.cost_manager.subscribe(self.on_total_cost_changed)
 
     def get_total_cost_text(self):
         return f"{TOTAL_COST_TEXT}{self.total_cost:.5f}"
 
     def create(self):
-        self.total_cost = self.cost_manager.get_monthly_cost()
+        self.total_cost = self.cost_manager.get_total_cost()
         with dpg.group(horizontal=True, tag=self.tag, parent=self.parent):
             dpg.add_text(self.get_total_cost_text(), tag="cost_indicator_text")
             
@@ -25,7 +26,12 @@ class CostIndicator:
             # Bind the theme to the text item
             dpg.bind_item_theme("cost_indicator_text", grey_text_theme)
 
+    def on_total_cost_changed(self, total_cost):
+        """Called from the response thread after each logged call. The GUI is updated in the main thread."""
+        self.app.update_queue.put(self.update)
+
     def update(self):
-        # Update the cost and refresh the displayed value
-        self.total_cost = self.cost_manager.get_monthly_cost()
-        dpg.set_value("cost_indicator_text", self.get_total_cost_text())
+        # Refresh the displayed value (the total is kept in memory by the cost manager)
+        self.total_cost = self.cost_manager.get_total_cost()
+        if dpg.does_item_exist("cost_indicator_text"):
+            dpg.set_value("cost_indicator_text", self.get_total_cost_text())
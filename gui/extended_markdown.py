@@ -1,6 +1,7 @@
 import dearpygui.dearpygui as dpg
 import utils.markdown as dpg_markdown
-from config import MARKDOWN_HIGHLIGHTING7
+from config import MARKDOWN_HIGHLIGHTING7, LAYOUT_IN_BACKGROUND7
+from gui.layout_worker import LAYOUT_WORKER
 
 class ExtendedMarkdownText:
     def __init__(self, markdown_text: str):
@@ -8,6 +9,7 @@ class ExtendedMarkdownText:
         self.group_id = None
         self.widget_id = None
         self.wrap = -1  # Initialize wrap value
+        self.layout_generation = 0  # Incremented on each re-render, to drop the outdated background layouts
 
     def add(self, wrap: int | float = -1, parent=0):
         self.wrap = wrap  # Store the wrap value
@@ -26,6 +28,13 @@ class ExtendedMarkdownText:
         return self.group_id
 
     def update(self, markdown_text=None):
+        if self.background_layout7():
+            # The previous markdown group is kept until the new layout is ready, to avoid flicker
+            if markdown_text is not None:
+                self.markdown_text = markdown_text
+            self.render_markdown(self.group_id, self.wrap)
+            return
+
         # Delete previous markdown group
         if self.widget_id and dpg.does_item_exist(self.widget_id):
             dpg.delete_item(self.widget_id)
@@ -44,12 +53,62 @@ class ExtendedMarkdownText:
         self.wrap = wrap_value
         self.update()
 
+    def background_layout7(self):
+        return MARKDOWN_HIGHLIGHTING7 and LAYOUT_IN_BACKGROUND7
+
+    def request_layout(self, parent_id, wrap):
+        """Parses and wraps the text in the layout worker. The DPG items are created in on_layout_ready."""
+        self.layout_generation += 1
+        generation = self.layout_generation
+
+        def on_done(layout):
+            self.on_layout_ready(generation, parent_id, wrap, layout)
+
+        LAYOUT_WORKER.submit(
+            self.markdown_text,
+            wrap,
+            on_done=on_done,
+            is_current=lambda: generation == self.layout_generation,
+        )
+
+    def on_layout_ready(self, generation, parent_id, wrap, layout):
+        """Replaces the displayed markdown with the finished layout (runs in the main thread)."""
+        if generation != self.layout_generation:
+            return  # A newer text or wrap value is being laid out
+        if not dpg.does_item_exist(parent_id):
+            return  # The message was deleted in the meantime
+
+        if self.widget_id and dpg.does_item_exist(self.widget_id):
+            dpg.delete_item(self.widget_id)
+        markdown_group = dpg.add_group(parent=parent_id)
+        self.widget_id = markdown_group
+
+        try:
+            if layout is None:
+                raise RuntimeError("the layout worker failed")
+            dpg_markdown.add_layout(layout, parent=markdown_group)
+        except Exception as e:
+            print(f"DearPyGui_Markdown encountered an exception: {e}")
+            print("Falling back to standard DearPyGui text rendering.")
+            dpg.delete_item(markdown_group, children_only=True)
+            dpg.add_text(
+                self.markdown_text,
+                parent=markdown_group,
+                wrap=wrap
+            )
+        # Apply the text theme to the markdown group
+        dpg.bind_item_theme(markdown_group, "text_theme")
+
     def render_markdown(self, parent_id, wrap=-1):
         # Ensure parent_id is valid
         if not dpg.does_item_exist(parent_id):
             print(f"Parent item {parent_id} does not exist.")
             return
 
+        if self.background_layout7():
+            self.request_layout(parent_id, wrap)
+            return
+
         # Create a new group to hold the markdown content
         markdown_group = dpg.add_group(parent=parent_id)
         # Update widget_id to the new group
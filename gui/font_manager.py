@@ -1,4 +1,5 @@
 import dearpygui.dearpygui as dpg
+import utils.markdown as dpg_markdown
 
 from config import (
     DEFAULT_WIDTH,
@@ -102,6 +103,8 @@ class FontManager:
         if dpg.does_item_exist(font_tag):
             # Bind the font globally
             dpg.bind_font(font_tag)
+            # The markdown text is measured with this font (the messages don't have their own font)
+            dpg_markdown.glyph_widths.set_default_font(font_tag)
             # Update the font size message
             if self.font_size_message_id and dpg.does_item_exist(self.font_size_message_id):
                 dpg.bind_item_font(self.font_size_message_id, font_tag)
@@ -114,10 +117,9 @@ class FontManager:
             for item_tag in item_tags:
                 if dpg.does_item_exist(item_tag):
                     dpg.bind_item_font(item_tag, font_tag)
-            # Apply font size to message widgets
-            self.app.chat_history.apply_font_size()
-
-            # Recalculate wrap value based on new font size using WrapManager
-            self.wrap_manager.update_wrap_value(self.current_font_size)
+            # Recalculate wrap value based on new font size using WrapManager,
+            # and apply both to the message widgets in a single re-layout
+            wrap_value = self.wrap_manager.calculate_wrap_value(self.current_font_size)
+            self.app.chat_history.relayout(wrap_value)
         else:
             print(f"Font size {self.current_font_size} not found.")
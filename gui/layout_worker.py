@@ -0,0 +1,73 @@
+import queue
+import threading
+import time
+import traceback
+
+import utils.markdown as dpg_markdown
+
+
+class LayoutWorker:
+    """
+    Parses and wraps markdown in a background thread, so long replies don't drop frames.
+
+    The worker only produces the wrapped lines (plain data).
+    The DPG items are created from them in the render thread, in process_finished().
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.finished = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def submit(self, markdown_text, wrap, on_done, is_current=None):
+        """
+        Queues the layout of the text. Called from the render thread.
+        :param on_done: called in the render thread with the layout, or with None if the layout failed
+        :param is_current: if given and it returns False, the job is outdated and is dropped
+        """
+        # Created through the DPG container stack, which is not safe to use from the worker
+        dpg_markdown.text_entities.AttributeController.create_theme()
+        self.start()
+        self.jobs.put((markdown_text, wrap, on_done, is_current))
+
+    def _run(self):
+        while True:
+            markdown_text, wrap, on_done, is_current = self.jobs.get()
+            if is_current is not None and not is_current():
+                continue  # A newer text or wrap value was submitted in the meantime
+            try:
+                layout = dpg_markdown.layout_text(markdown_text, wrap=wrap)
+            except Exception:
+                print("Exception in LayoutWorker when laying out markdown")
+                traceback.print_exc()
+                layout = None
+            self.finished.put((on_done, layout))
+
+    def process_finished(self, budget_seconds=None):
+        """
+        Hands the finished layouts to their callbacks. Called every frame from the render thread.
+        :param budget_seconds: if given, the layouts left when it is spent wait for the next frame
+        (at least one is handed per frame)
+        """
+        start = time.perf_counter()
+        handed_count = 0
+        while not self.finished.empty():
+            if budget_seconds is not None and handed_count > 0 and time.perf_counter() - start >= budget_seconds:
+                break
+            on_done, layout = self.finished.get()
+            handed_count += 1
+            try:
+                on_done(layout)
+            except Exception:
+                print(f"Exception in LayoutWorker.process_finished when calling {on_done.__name__}")
+                traceback.print_exc()
+
+
+LAYOUT_WORKER = LayoutWorker()
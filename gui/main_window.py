@@ -1,3 +1,5 @@
+import time
+
 import dearpygui.dearpygui as dpg
 
 from gui.chat_control_elements import ChatControlElements
@@ -8,6 +10,7 @@ from config import (
     DEFAULT_HEIGHT,
     DEFAULT_WIDTH,
     PADDING,
+    RESIZE_SETTLE_SECONDS,
     calculate_input_field_width,
 )
 
@@ -28,6 +31,10 @@ class MainWindow:
         # Initialize chat control elements
         self.chat_control_elements = None  # Will be created in create()
 
+        # The re-wrap waits until the resizing settles
+        self.pending_wrap_value = None
+        self.last_resize_time = 0.0
+
     def create(self):
         # Create the main window
         with dpg.window(
@@ -60,6 +67,13 @@ class MainWindow:
             )
 
     def resize_callback(self, sender, app_data):
+        """
+        Called on every viewport resize event (dozens of times per second while dragging the window edge).
+
+        Only resizes the containers, which is cheap: meanwhile the messages are clipped, not re-wrapped.
+        The expensive re-wrap of the messages is done by process_pending_resize,
+        once, with the final width, after the resizing has settled.
+        """
         width = dpg.get_viewport_client_width()
         height = dpg.get_viewport_client_height()
 
@@ -95,8 +109,19 @@ class MainWindow:
         # Set the height of the chat history child window
         dpg.set_item_height("chat_history_child_window", chat_history_height)
 
-        # Calculate wrap width for chat history and update it
-        chat_history_wrap = width - (PADDING * 4)
+        # Calculate wrap width for chat history, and schedule the update
+        self.pending_wrap_value = width - (PADDING * 4)
+        self.last_resize_time = time.monotonic()
+
+    def process_pending_resize(self):
+        """Called every frame. Re-wraps the chat history once no resize events came for a while."""
+        if self.pending_wrap_value is None:
+            return
+        if time.monotonic() - self.last_resize_time < RESIZE_SETTLE_SECONDS:
+            return
+
+        chat_history_wrap = self.pending_wrap_value
+        self.pending_wrap_value = None
         self.app.chat_history_wrap = chat_history_wrap
         self.chat_history.update_wrap_value(chat_history_wrap)
 
@@ -5,6 +5,7 @@ from config import IMG_THUMB_MAX_SIZE, COLLAPSE_USER_MESSAGES
 from gui.extended_markdown import ExtendedMarkdownText
 from utils.messages import extract_message_text
 from utils.images import load_image_for_gui, get_thumb_size, open_image_external
+from utils.image_store import get_image_store
 
 class MessageGUI:
     def __init__(self, message, parent, wrap_value, app):
@@ -16,15 +17,18 @@ class MessageGUI:
         self.role = self.message["role"].capitalize()  # Capitalize role for label
         self.content = self.message["content"]
 
-        shorten7 = False
+        self.shorten7 = False
         if self.role == "User" and COLLAPSE_USER_MESSAGES:
-            shorten7 = True
-        self.markdown_text = extract_message_text(self.content, shorten7=shorten7)
+            self.shorten7 = True
+        self.markdown_text = extract_message_text(self.content, shorten7=self.shorten7)
         self.popup_text = extract_message_text(self.content, shorten7=False)
 
         self.group_id = None     # Will store the group ID for this message
         self.md_text = None      # Will store the ExtendedMarkdownText object
         self.text_item_id = None  # Will store the item ID of the markdown text
+        self.click_handler_id = None  # Will store the item ID of the click handler
+        self.handler_registries = []  # Not children of the group, so must be deleted separately
+        self.layout_key = None  # (wrap value, font size) the markdown was last rendered with
 
         # Create the GUI elements for this message
         self.create_message_gui()
@@ -75,7 +79,11 @@ class MessageGUI:
         role_label = f"{self.role} says:"
         dpg.add_text(role_label, parent=self.group_id)
 
+    def get_layout_key(self):
+        return self.wrap_value, self.app.font_manager.current_font_size
+
     def add_message_content(self):
+        self.layout_key = self.get_layout_key()
         self.md_text = ExtendedMarkdownText(self.markdown_text)
         # Store the item ID of the markdown text
         self.text_item_id = self.md_text.add(parent=self.group_id, wrap=self.wrap_value)
@@ -84,14 +92,29 @@ class MessageGUI:
         for element in self.content:
             if element.get("type") == "image":
                 image_path = element.get("path", "")
-                self.display_image_thumbnail(image_path)
+                self.display_image_thumbnail(image_path, digest=element.get("sha256"))
 
-    def display_image_thumbnail(self, image_path):
+    def display_image_thumbnail(self, image_path, digest=None):
+        """
+        Args:
+            digest (str, optional): The SHA-256 of the image in the image store.
+                The thumbnail is made from the stored copy, so it's shown even if the original file is gone.
+        """
+        thumb_source_path = image_path
+        if digest is not None:
+            image_store = get_image_store()
+            if image_store.has_image(digest):
+                thumb_source_path = image_store.get_path(digest)
+                if not os.path.exists(image_path):
+                    image_path = thumb_source_path
         # Load and display the image thumbnail using the utility function
         try:
-            width, height, img_data = load_image_for_gui(image_path)
-            # Create a unique texture tag
-            texture_tag = f"texture_{os.path.basename(image_path)}"
+            width, height, img_data = load_image_for_gui(thumb_source_path)
+            # Create a unique texture tag (the same image shares one texture)
+            if digest is not None:
+                texture_tag = f"texture_{digest}"
+            else:
+                texture_tag = f"texture_{os.path.basename(image_path)}"
             # Check if the texture already exists
             if not dpg.does_item_exist(texture_tag):
                 # Add the dynamic texture
@@ -110,6 +133,7 @@ class MessageGUI:
                 open_image_external(user_data["image_path"])
 
             handler = dpg.add_item_handler_registry()
+            self.handler_registries.append(handler)
             dpg.add_item_clicked_handler(
                 button=dpg.mvMouseButton_Left,
                 callback=open_image_callback,
@@ -126,11 +150,12 @@ class MessageGUI:
     def add_click_handler(self):
         user_data = {"message_content": self.popup_text, "role": self.role.lower()}
         handler = dpg.add_item_handler_registry()
+        self.handler_registries.append(handler)
 
         def message_click_handler(sender, app_data, user_data):
             self.app.event_handler.message_popup.show_message_popup(sender, app_data, user_data)
 
-        dpg.add_item_clicked_handler(
+        self.click_handler_id = dpg.add_item_clicked_handler(
             button=dpg.mvMouseButton_Left,
             callback=message_click_handler,
             user_data=user_data,
@@ -139,18 +164,44 @@ class MessageGUI:
         # Bind the handler to the markdown text item instead of the group
         dpg.bind_item_handler_registry(self.text_item_id, handler)
 
-    def apply_font_size(self):
+    def apply_font_size(self, rerender7=True):
         """Applies the current font size to the message content and re-renders if necessary."""
         font_tag = f"font_{self.app.font_manager.current_font_size}"
         if dpg.does_item_exist(font_tag):
             if dpg.does_item_exist(self.group_id):
                 dpg.bind_item_font(self.group_id, font_tag)
-            # Force re-rendering of the message to adjust wrapping
-            self.update()
+            if rerender7:
+                # Force re-rendering of the message to adjust wrapping
+                self.update()
         else:
             print(f"Font size {self.app.font_manager.current_font_size} not found.")
 
-    def update(self):
-        """Updates the message display, particularly the wrap value."""
+    def delete(self):
+        """Deletes all the GUI elements of this message."""
+        for item in [self.group_id, *self.handler_registries]:
+            if item is not None and dpg.does_item_exist(item):
+                dpg.delete_item(item)
+        self.handler_registries.clear()
+        self.md_text = None
+
+    def update_content(self):
+        """Re-renders the message after its content has changed in place (e.g. while streaming)."""
+        self.markdown_text = extract_message_text(self.content, shorten7=self.shorten7)
+        self.popup_text = extract_message_text(self.content, shorten7=False)
+        if self.click_handler_id and dpg.does_item_exist(self.click_handler_id):
+            user_data = {"message_content": self.popup_text, "role": self.role.lower()}
+            dpg.set_item_user_data(self.click_handler_id, user_data)
         if self.md_text:
+            self.layout_key = self.get_layout_key()
+            self.md_text.wrap = self.wrap_value
+            self.md_text.update(markdown_text=self.markdown_text)
+
+    def update(self):
+        """
+        Updates the message display, particularly the wrap value.
+        Does nothing if the message is already rendered with the current wrap value and font size.
+        """
+        layout_key = self.get_layout_key()
+        if self.md_text and layout_key != self.layout_key:
+            self.layout_key = layout_key
             self.md_text.update_wrap(self.wrap_value)
\ No newline at end of file
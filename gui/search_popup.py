@@ -0,0 +1,62 @@
+import dearpygui.dearpygui as dpg
+from datetime import datetime
+
+from config import MESSAGE_POPUP_WIDTH, MESSAGE_POPUP_HEIGHT, PADDING, SEARCH_RESULTS_LIMIT
+
+
+class SearchPopup:
+    """Shows the results of a search over the saved conversations. Clicking a result opens its conversation."""
+
+    def __init__(self, app):
+        self.app = app
+        self.popup_id = "search_popup"
+        self.results_group_id = "search_results_group"
+
+    def search(self, query):
+        results = self.app.conversation_manager.search_conversations(query, limit=SEARCH_RESULTS_LIMIT)
+        self.show_results(query, results)
+
+    def show_results(self, query, results):
+        if not dpg.does_item_exist(self.popup_id):
+            with dpg.window(
+                tag=self.popup_id,
+                modal=True,
+                width=MESSAGE_POPUP_WIDTH,
+                height=MESSAGE_POPUP_HEIGHT,
+            ):
+                dpg.add_group(tag=self.results_group_id)
+                dpg.add_button(
+                    label="Close",
+                    callback=lambda: dpg.hide_item(self.popup_id),
+                    width=75,
+                )
+        else:
+            dpg.delete_item(self.results_group_id, children_only=True)
+            dpg.show_item(self.popup_id)
+        dpg.configure_item(self.popup_id, label=f"Search: {query}")
+
+        if not results:
+            dpg.add_text("Nothing found.", parent=self.results_group_id)
+            return
+
+        wrap = MESSAGE_POPUP_WIDTH - PADDING * 4
+        for result in results:
+            date = datetime.fromtimestamp(result["timestamp"]).strftime("%Y-%m-%d %H:%M")
+            title = result["title"].replace("\n", " ") or result["name"]
+            dpg.add_button(
+                label=f"{date}  {title}",
+                callback=self.open_result_callback,
+                user_data=result["name"],
+                parent=self.results_group_id,
+            )
+            snippet = result["snippet"].replace("\n", " ")
+            dpg.add_text(f"{result['role'].capitalize()}: {snippet}", wrap=wrap, parent=self.results_group_id)
+            dpg.add_separator(parent=self.results_group_id)
+
+    def open_result_callback(self, sender, app_data, user_data):
+        if dpg.is_item_shown("thinking_text"):
+            print("Can't open a conversation while waiting for the reply")
+            return
+        if self.app.conversation_manager.open_conversation(user_data):
+            dpg.hide_item(self.popup_id)
+            self.app.chat_history.update_chat_history()
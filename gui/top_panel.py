@@ -1,7 +1,8 @@
 import dearpygui.dearpygui as dpg
-from config import DEFAULT_WIDTH
+from config import DEFAULT_WIDTH, SEARCH_HINT
 from gui.font_manager import FontManager
 from gui.cost_indicator import CostIndicator
+from gui.search_popup import SearchPopup
 
 
 class TopPanel:
@@ -10,6 +11,7 @@ class TopPanel:
         self.font_manager = app.font_manager
         self.tag = "top_panel"
         self.cost_indicator = CostIndicator(self.app, parent=self.tag)
+        self.search_popup = SearchPopup(self.app)
 
     def create(self):
         with dpg.group(horizontal=True, tag=self.tag, parent="main_window"):
@@ -23,10 +25,24 @@ class TopPanel:
             # Add the "New chat" button after the cost indicator
             dpg.add_button(label="Creat new chat", callback=self.new_chat_callback)
 
+            # Search over the saved conversations, on Enter
+            dpg.add_input_text(
+                tag="search_input",
+                hint=SEARCH_HINT,
+                width=200,
+                on_enter=True,
+                callback=self.search_callback,
+            )
+
     def update(self):
         # Update the cost indicator when needed
         self.cost_indicator.update()
 
+    def search_callback(self, sender, app_data, user_data):
+        query = dpg.get_value("search_input").strip()
+        if query:
+            self.search_popup.search(query)
+
     def new_chat_callback(self, sender, app_data, user_data):
         # Reset the conversation
         self.app.conversation_manager.reset_conversation()
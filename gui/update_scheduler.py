@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+# The lower the number, the sooner the update runs
+PRIORITY_HIGH = 0  # Cheap and visible at once, e.g. re-enabling the input, scrolling
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # Bulk re-renders, e.g. rebuilding the chat history
+
+
+class UpdateScheduler:
+    """
+    The queue of the GUI updates requested by other threads, run in the main thread.
+
+    Each frame, the updates are run by priority (and in order within a priority)
+    until the frame budget is spent. The rest is carried over to the next frames,
+    so a burst of heavy updates doesn't freeze the UI.
+    At least one update is run per frame, so the queue always moves.
+    """
+
+    def __init__(self, budget_ms):
+        self.budget_seconds = budget_ms / 1000
+        self.heap = []
+        self.counter = itertools.count()  # Keeps the order of the updates with the same priority
+        self.lock = threading.Lock()
+        self.frame_start = None  # Set while the updates of a frame are running
+
+        # Per-frame stats (see get_stats)
+        self.frames_count = 0
+        self.over_budget_frames_count = 0
+        self.max_frame_ms = 0.0
+        self.last_frame = {"ran": 0, "carried_over": 0, "elapsed_ms": 0.0}
+
+    def put(self, func, priority=PRIORITY_NORMAL):
+        """Queues the callable. Can be called from any thread."""
+        with self.lock:
+            heapq.heappush(self.heap, (priority, next(self.counter), func))
+
+    def empty(self):
+        with self.lock:
+            return len(self.heap) == 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.heap)
+
+    def elapsed(self):
+        """Returns the time spent on the updates of the current frame, in seconds."""
+        if self.frame_start is None:
+            return 0.0
+        return time.perf_counter() - self.frame_start
+
+    def remaining_budget(self):
+        return max(self.budget_seconds - self.elapsed(), 0.0)
+
+    def out_of_budget7(self):
+        """True if called from an update that has used up the budget of the frame."""
+        return self.frame_start is not None and self.elapsed() >= self.budget_seconds
+
+    def begin_frame(self):
+        """Starts counting the budget of the frame, for the work done before run()."""
+        self.frame_start = time.perf_counter()
+
+    def run(self):
+        """Runs the queued updates until the frame budget is spent. Called once per frame."""
+        if self.frame_start is None:
+            self.begin_frame()
+        # The updates queued by the running ones wait for the next frame
+        last_index = next(self.counter)
+        deferred = []
+        ran_count = 0
+        try:
+            while True:
+                with self.lock:
+                    if not self.heap:
+                        break
+                    if ran_count > 0 and self.elapsed() >= self.budget_seconds:
+                        break
+                    item = heapq.heappop(self.heap)
+                if item[1] > last_index:
+                    deferred.append(item)
+                    continue
+                try:
+                    item[2]()
+                except Exception:
+                    print(f"Exception in UpdateScheduler.run when calling {getattr(item[2], '__name__', item[2])}")
+                    traceback.print_exc()
+                ran_count += 1
+        finally:
+            with self.lock:
+                for item in deferred:
+                    heapq.heappush(self.heap, item)
+                carried_over = len(self.heap)
+            self.record_frame(ran_count, carried_over, self.elapsed())
+            self.frame_start = None
+
+    def record_frame(self, ran_count, carried_over, elapsed):
+        if ran_count == 0:
+            return  # Idle frames would only dilute the stats
+        elapsed_ms = elapsed * 1000
+        self.frames_count += 1
+        if elapsed > self.budget_seconds:
+            self.over_budget_frames_count += 1
+        self.max_frame_ms = max(self.max_frame_ms, elapsed_ms)
+        self.last_frame = {"ran": ran_count, "carried_over": carried_over, "elapsed_ms": elapsed_ms}
+
+    def get_stats(self):
+        """Returns the stats of the last busy frame and the totals since the start."""
+        return {
+            "budget_ms": self.budget_seconds * 1000,
+            "last_frame": dict(self.last_frame),
+            "busy_frames": self.frames_count,
+            "over_budget_frames": self.over_budget_frames_count,
+            "max_frame_ms": self.max_frame_ms,
+            "pending": len(self),
+        }
@@ -8,8 +8,8 @@ class WrapManager:
         self.app = app
         self.wrap_value = None
 
-    def update_wrap_value(self, font_size):
-        """Recalculates wrap value based on font size and updates chat history."""
+    def calculate_wrap_value(self, font_size):
+        """Recalculates wrap value based on font size, without updating the chat history."""
         # Get the current window width
         window_width = dpg.get_viewport_client_width()
         
@@ -28,6 +28,4 @@ class WrapManager:
         #print(f"Current font size: {font_size}")
         
         self.wrap_value = wrap_value
-        
-        # Update wrap value in chat history
-        self.app.chat_history.update_wrap_value(wrap_value)
\ No newline at end of file
+        return wrap_value
\ No newline at end of file
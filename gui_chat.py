@@ -2,7 +2,6 @@ import dearpygui.dearpygui as dpg
 import threading
 
 from utils.markdown import CallInNextFrame
-import queue
 
 from config import (
     DEFAULT_HEIGHT,
@@ -10,15 +9,20 @@ from config import (
     PADDING,
     INPUT_HINT,
     DARK_THEME7,
+    STREAM_RESPONSES7,
+    MOCK_AI_RESPONSES7,
+    GUI_UPDATE_BUDGET_MS,
 )
 from gui.call_when_started import CallWhenDPGStartedCustom
 
 from gui.chat_history import ChatHistory
+from gui.layout_worker import LAYOUT_WORKER
 from gui.main_window import MainWindow
 from gui.message_popup import MessagePopup
 from utils.conversation_manager import ConversationManager
 from gui.font_manager import FontManager
 from gui.themes import create_themes
+from gui.update_scheduler import UpdateScheduler, PRIORITY_HIGH, PRIORITY_LOW
 
 """
 
@@ -70,16 +74,20 @@ class EventHandler:
     def get_assistant_response(self):
         """Get the assistant's response in a separate thread."""
         # Process the assistant's response
-        self.conversation_manager.process_assistant_response()
+        if STREAM_RESPONSES7:
+            # The last message grows in place as the deltas arrive
+            self.conversation_manager.process_assistant_response(
+                on_text_delta=self.app.chat_history.schedule_streamed_message_update
+            )
+        else:
+            self.conversation_manager.process_assistant_response()
 
         # Enqueue GUI updates to be executed in the main thread
-        self.app.update_queue.put(self.app.chat_history.update_chat_history)
-        self.app.update_queue.put(
-            self.app.gui_manager.main_window.top_panel.cost_indicator.update
-        )
+        # (the cost indicator is notified by the cost manager when the call is logged)
+        self.app.update_queue.put(self.app.chat_history.update_chat_history, priority=PRIORITY_LOW)
 
-        # Enqueue re-enabling the controls
-        self.app.update_queue.put(self.reenable_controls)
+        # Enqueue re-enabling the controls (before the re-renders, so the input is usable at once)
+        self.app.update_queue.put(self.reenable_controls, priority=PRIORITY_HIGH)
 
     def reenable_controls(self):
         """Re-enable the input field and send button."""
@@ -134,9 +142,11 @@ class ChatApp:
     def __init__(self):
         # Initialize the conversation manager with save directory
         self.conversation_manager = ConversationManager(
-            save_directory="conversations"
+            save_directory="conversations",
+            mock7=MOCK_AI_RESPONSES7,
         )
-        self.update_queue = queue.Queue()
+        # GUI updates requested by other threads, run by priority within a per-frame time budget
+        self.update_queue = UpdateScheduler(budget_ms=GUI_UPDATE_BUDGET_MS)
         self.chat_history_wrap = DEFAULT_WIDTH - (PADDING * 2)  # Initialize wrap value
 
         # Initialize the chat history handler
@@ -162,9 +172,12 @@ class ChatApp:
         self.current_theme = None
 
     def process_pending_gui_updates(self):
-        while not self.update_queue.empty():
-            func = self.update_queue.get()
-            func()
+        """Runs the queued GUI updates until the frame budget is spent. The rest wait for the next frames."""
+        self.update_queue.run()
+
+    def get_frame_stats(self):
+        """Returns the stats of the GUI update queue (see UpdateScheduler.get_stats)."""
+        return self.update_queue.get_stats()
 
     def check_items_ready(self):
         font_adjustment_height = dpg.get_item_rect_size("font_size_adjustment_section")[1]
@@ -200,11 +213,18 @@ class ChatApp:
         while dpg.is_dearpygui_running():
             if not self.initial_resize_done:
                 self.check_items_ready()
+            self.update_queue.begin_frame()
+            # The calls queued in the previous frame (scrolling, focus) go before the queued updates
+            CallInNextFrame.execute(budget_seconds=self.update_queue.budget_seconds)
+            # Creating the items of the finished layouts is heavy: they only get what's left of the budget
+            LAYOUT_WORKER.process_finished(budget_seconds=self.update_queue.remaining_budget())
             self.process_pending_gui_updates()
+            self.gui_manager.main_window.process_pending_resize()
+            self.chat_history.update_virtualization()
             CallWhenDPGStartedCustom.execute()
-            CallInNextFrame.execute()
             dpg.render_dearpygui_frame()
 
+        self.conversation_manager.close()
         dpg.destroy_context()
 
     def set_initial_focus(self):
@@ -1,7 +1,8 @@
 """PLUGIN DESCRIPTION:
 
 This plugin allows the user to send images to the chat.
-The images are encoded in base64 and sent as image/jpeg.
+The images are encoded as JPEG and stored in the image store (see utils/image_store.py).
+The messages keep only a reference, the base64 is made when the request is sent.
 """
 
 ################################################################################
@@ -26,7 +27,8 @@ def augment_message_content(message_content):
 # THE LOGIC THAT IS SPECIFIC TO THIS PLUGIN:
 ################################################################################
 
-from utils.images import encode_image, is_image_path
+from utils.images import encode_image_to_jpeg, is_image_path
+from utils.image_store import get_image_store, make_image_element
 
 
 def plugin_specific_applicability_checker(user_input):
@@ -40,23 +42,12 @@ def plugin_specific_content_augmenter(message_content):
 
     image_path = text_input
     
-    base64_image, new_size = encode_image(image_path)
+    jpeg_bytes, new_size = encode_image_to_jpeg(image_path)
+    digest = get_image_store().put(jpeg_bytes)
 
     width, height = new_size
 
-    content = [
-        {
-            "type": "image",
-            "path": image_path,
-            "width": width,
-            "height": height,
-            "source": {
-                "type": "base64",
-                "media_type": "image/jpeg",
-                "data": base64_image,
-            },
-        }
-    ]
+    content = [make_image_element(digest, image_path, width, height)]
 
     if text_input:
         content.append({"type": "text", "text": text_input})
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The plugins are loaded from a path relative to the app dir
+os.chdir(ROOT)
+# The client is created on import. No request is sent by the tests
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+import utils.cost_manager as cost_manager
+
+# The shared cost manager is created on import (see ai_provider). Its ledger must not go to the app dir
+cost_manager.CostManager.LOG_FILE_PATH = os.path.join(tempfile.mkdtemp(), "api_costs.log")
+
+
+class FakeTokenizer:
+    """One token per word, so the tests don't download the encoding."""
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def fake_tokenizer(monkeypatch):
+    monkeypatch.setattr(cost_manager, "_tokenizer", FakeTokenizer())
+
+
+@pytest.fixture
+def offline_tokenizer(monkeypatch):
+    """The real tokenizer path, with an encoding that can't be downloaded. Returns the list of the load attempts."""
+    loads = []
+
+    def get_encoding(name):
+        loads.append(name)
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(cost_manager, "_tokenizer", None)
+    monkeypatch.setattr(cost_manager.tiktoken, "get_encoding", get_encoding)
+    return loads
+
+
+def make_message(role, words=0, images=0, text=None):
+    """Returns a message with the text of so many words (or the given text), and so many 750x1000 images."""
+    content = [{"type": "text", "text": text if text is not None else " ".join(["word"] * words)}]
+    for _ in range(images):
+        content.append({
+            "type": "image", "path": "image.jpg", "width": 750, "height": 1000,
+            "source": {"type": "base64", "media_type": "image/jpeg", "data": "AAAA"},
+        })
+    return {"role": role, "content": content}
+
+
+def make_conversation(turns, words=10):
+    """Returns the first user message and then so many (assistant, user) turns."""
+    conversation = [make_message("user", words, text="message 0 " + " ".join(["word"] * words))]
+    for i in range(1, turns + 1):
+        conversation.append(make_message("assistant", text=f"reply {i} " + " ".join(["word"] * words)))
+        conversation.append(make_message("user", text=f"message {i} " + " ".join(["word"] * words)))
+    return conversation
@@ -0,0 +1,54 @@
+import json
+
+from utils.chat_logs import ConversationJournal, read_journal
+
+
+def message(role, text):
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+def test_read_journal_applies_puts_and_truncates(tmp_path):
+    path = tmp_path / "c.jsonl"
+    records = [
+        {"op": "put", "index": 0, "message": message("user", "a")},
+        {"op": "put", "index": 1, "message": message("assistant", "b")},
+        {"op": "put", "index": 1, "message": message("assistant", "b2")},  # Replaced in place
+        {"op": "put", "index": 2, "message": message("user", "c")},
+        {"op": "truncate", "length": 2},
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    assert read_journal(path) == [message("user", "a"), message("assistant", "b2")]
+
+
+def test_read_journal_skips_a_partly_written_line(tmp_path):
+    path = tmp_path / "c.jsonl"
+    path.write_text(json.dumps({"op": "put", "index": 0, "message": message("user", "a")}) + '\n{"op": "pu')
+    assert read_journal(path) == [message("user", "a")]
+
+
+def test_journal_round_trip(tmp_path):
+    journal = ConversationJournal(str(tmp_path), "c.jsonl", compact_ratio=100)
+    conversation = [message("user", "a")]
+    journal.sync(conversation)
+    reply = message("assistant", "b")
+    conversation.append(reply)
+    journal.sync(conversation)
+    reply["content"][0]["text"] += "c"  # A streamed reply grows in place
+    reply["_token_count"] = (0, 1)  # Runtime-only keys aren't saved
+    journal.sync(conversation)
+    conversation.pop()
+    conversation.append(message("assistant", "d"))
+    journal.sync(conversation)
+    journal.close()
+    assert read_journal(tmp_path / "c.jsonl") == [message("user", "a"), message("assistant", "d")]
+
+
+def test_compacted_journal_reads_the_same(tmp_path):
+    journal = ConversationJournal(str(tmp_path), "c.jsonl", compact_ratio=100)
+    conversation = [message("user", str(i)) for i in range(3)]
+    for i in range(1, 4):
+        journal.sync(conversation[:i])
+    journal.compact()
+    path = tmp_path / "c.jsonl"
+    assert len(path.read_text().splitlines()) == 3
+    assert read_journal(path) == conversation
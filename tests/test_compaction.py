@@ -0,0 +1,120 @@
+from conftest import make_conversation, make_message
+
+from config import SUMMARY_MESSAGE_PREFIX
+from utils.compaction import ConversationCompactor, build_summary_request
+from utils.conversation_manager import ConversationManager
+from utils.messages import apply_summary
+
+
+def make_compactor(threshold_tokens=20, keep_recent=2):
+    return ConversationCompactor(threshold_tokens=threshold_tokens, keep_recent=keep_recent, mock7=True)
+
+
+def test_not_started_under_threshold():
+    compactor = make_compactor(threshold_tokens=1000)
+    assert not compactor.maybe_start(make_conversation(5))
+    assert compactor.get_summary() is None
+
+
+def test_not_started_when_only_recent_messages():
+    compactor = make_compactor(threshold_tokens=1, keep_recent=6)
+    # The first message and 6 recent ones: nothing to summarize
+    assert not compactor.maybe_start(make_conversation(3))
+
+
+def test_summarizes_up_to_a_user_message():
+    compactor = make_compactor(keep_recent=2)
+    conversation = make_conversation(5)  # 11 messages
+    assert compactor.maybe_start(conversation)
+    compactor.wait()
+    summary = compactor.get_summary()
+    # 11 - 2 = 9 is odd, so it's rounded down: the messages after the summary start with a user one
+    assert summary["upto"] == 8
+    assert conversation[summary["upto"]]["role"] == "user"
+    assert "reply 1" in summary["text"] and "message 0" not in summary["text"]
+    assert "reply 4" in summary["text"] and "message 4" not in summary["text"]
+
+
+def test_next_summary_starts_after_the_previous_one():
+    compactor = make_compactor(threshold_tokens=30, keep_recent=2)
+    conversation = make_conversation(5)
+    compactor.maybe_start(conversation)
+    compactor.wait()
+    first_upto = compactor.get_summary()["upto"]
+
+    # Too little new since the summary
+    assert not compactor.maybe_start(conversation + make_conversation(1)[1:])
+
+    conversation += make_conversation(6)[1:]
+    assert compactor.maybe_start(conversation)
+    compactor.wait()
+    summary = compactor.get_summary()
+    assert summary["upto"] > first_upto
+    assert summary["upto"] % 2 == 0
+    # The previous summary is part of the request, and the summarized messages aren't sent again
+    assert "summary_so_far" in summary["text"]
+
+
+def test_late_summary_of_a_reset_conversation_is_dropped():
+    compactor = make_compactor()
+    compactor.maybe_start(make_conversation(5))
+    compactor.reset()
+    compactor.wait()
+    assert compactor.get_summary() is None
+
+
+def test_build_summary_request():
+    request = build_summary_request([make_message("user", text="hi"), make_message("assistant", text="hello")], "before")
+    assert len(request) == 1 and request[0]["role"] == "user"
+    text = request[0]["content"][0]["text"]
+    assert "User: hi" in text and "Assistant: hello" in text and "before" in text
+
+
+def test_apply_summary_without_summary():
+    conversation = make_conversation(2)
+    assert apply_summary(conversation, None) is conversation
+
+
+def test_apply_summary():
+    conversation = make_conversation(3)
+    sent = apply_summary(conversation, {"upto": 4, "text": "summary"})
+    assert sent[0] is conversation[0]
+    assert sent[1]["role"] == "assistant"
+    assert sent[1]["content"][0]["text"] == SUMMARY_MESSAGE_PREFIX + "summary"
+    assert sent[2:] == conversation[4:]
+    assert [message["role"] for message in sent] == ["user", "assistant", "user", "assistant", "user"]
+
+
+def test_apply_summary_boundaries():
+    conversation = make_conversation(2)
+    # Everything after the first message is summarized
+    assert len(apply_summary(conversation, {"upto": len(conversation), "text": "s"})) == 2
+    # A summary of a longer conversation (e.g. the previous one) isn't applied
+    assert apply_summary(conversation, {"upto": len(conversation) + 1, "text": "s"}) is conversation
+
+
+def test_tokenizer_failure_skips_compaction(offline_tokenizer):
+    compactor = make_compactor()
+    assert not compactor.maybe_start(make_conversation(5))
+    assert offline_tokenizer  # It was tokenizing
+    assert compactor.get_summary() is None
+
+
+def test_short_conversation_isnt_tokenized(offline_tokenizer):
+    compactor = make_compactor(threshold_tokens=1000)
+    assert not compactor.maybe_start(make_conversation(5))
+    assert not offline_tokenizer
+
+
+def test_mock_conversation_goes_on_without_the_tokenizer(offline_tokenizer, tmp_path):
+    manager = ConversationManager(save_directory=str(tmp_path), mock7=True)
+    # Low enough for the compaction and the context window to weigh the messages
+    manager.compactor.threshold_tokens = 20
+    manager.compactor.keep_recent = 2
+    manager.context_window.token_budget = 100
+    for i in range(6):
+        manager.add_user_message(f"message {i} " + " ".join(["word"] * 20))
+        manager.process_assistant_response()
+        assert manager.conversation[-1]["content"][0]["text"].startswith(f"User said: message {i}")
+    assert manager.compactor.get_summary() is None
+    manager.close()
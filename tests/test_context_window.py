@@ -0,0 +1,101 @@
+from conftest import make_conversation, make_message
+
+from config import IMAGE_OMITTED_PLACEHOLDER
+from utils.context_window import ContextWindowManager
+from utils.messages import sanitize_conversation
+
+
+def fit(manager, conversation):
+    return manager.fit(conversation, sanitize_conversation(conversation))
+
+
+def roles(window):
+    return [message["role"] for message in window]
+
+
+def test_under_budget_is_sent_whole():
+    conversation = make_conversation(3)
+    window, report = fit(ContextWindowManager(token_budget=10000, keep_recent=2), conversation)
+    assert report is None
+    assert len(window) == len(conversation)
+
+
+def test_short_conversation_is_not_tokenized(monkeypatch):
+    import utils.context_window as context_window
+
+    def fail(message):
+        raise AssertionError("tokenized")
+    monkeypatch.setattr(context_window, "count_message_tokens", fail)
+    window, report = fit(ContextWindowManager(token_budget=10000), make_conversation(3))
+    assert report is None
+
+
+def test_tokenizer_failure_falls_back_to_estimates(monkeypatch):
+    import utils.cost_manager as cost_manager
+
+    loads = []
+
+    def get_encoding(name):
+        loads.append(name)
+        raise ConnectionError("offline")
+    monkeypatch.setattr(cost_manager, "_tokenizer", None)
+    monkeypatch.setattr(cost_manager.tiktoken, "get_encoding", get_encoding)
+
+    conversation = make_conversation(10, words=10)
+    conversation[2] = make_message("user", words=5, images=1)
+    manager = ContextWindowManager(token_budget=150, keep_recent=4, target_ratio=0.75)
+    window, report = fit(manager, conversation)
+    assert report["dropped_messages"] > 0
+    assert report["estimated_tokens"] <= 150 * 0.75
+    assert roles(window) == ["user", "assistant"] * (len(window) // 2) + ["user"]
+    # The download isn't tried again for each message
+    assert len(loads) == 1
+
+
+def test_old_images_are_elided_first():
+    conversation = make_conversation(3)
+    conversation[2] = make_message("user", words=5, images=1)  # 1000 image tokens
+    manager = ContextWindowManager(token_budget=500, keep_recent=2)
+    window, report = fit(manager, conversation)
+    assert report["elided_images"] == 1
+    assert report["dropped_messages"] == 0
+    assert window[2]["content"][1] == {"type": "text", "text": IMAGE_OMITTED_PLACEHOLDER}
+    # The conversation itself keeps the image
+    assert conversation[2]["content"][1]["type"] == "image"
+
+
+def test_oldest_turns_are_dropped_in_pairs():
+    conversation = make_conversation(10, words=10)  # 21 messages of 12 tokens
+    manager = ContextWindowManager(token_budget=150, keep_recent=4, target_ratio=0.75)
+    window, report = fit(manager, conversation)
+    assert report["dropped_messages"] % 2 == 0
+    assert report["estimated_tokens"] <= 150 * 0.75
+    assert window[0]["content"] == conversation[0]["content"]
+    assert window[-4:] == sanitize_conversation(conversation)[-4:]
+    assert roles(window) == ["user", "assistant"] * (len(window) // 2) + ["user"]
+
+
+def test_dropped_turns_stay_dropped():
+    conversation = make_conversation(10)
+    manager = ContextWindowManager(token_budget=150, keep_recent=4)
+    _, report = fit(manager, conversation)
+    dropped = report["dropped_messages"]
+    conversation += make_conversation(1)[1:]
+    window, report = fit(manager, conversation)
+    # Still under the budget: the same messages are dropped, so the start of the request doesn't change
+    assert report["dropped_messages"] == dropped
+
+
+def test_recent_messages_are_always_sent():
+    conversation = make_conversation(2, words=100)
+    manager = ContextWindowManager(token_budget=10, keep_recent=4)
+    window, report = fit(manager, conversation)
+    assert len(window) == len(conversation)
+
+
+def test_shorter_conversation_resets():
+    manager = ContextWindowManager(token_budget=150, keep_recent=4)
+    fit(manager, make_conversation(10))
+    assert manager.start > 1
+    window, report = fit(manager, make_conversation(1))
+    assert report is None and len(window) == 3
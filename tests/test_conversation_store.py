@@ -0,0 +1,134 @@
+import sqlite3
+
+from conftest import make_message
+
+import utils.messages as messages
+from utils.conversation_store import ConversationStore, SEARCH_SCHEMA_VERSION, build_fts_query, get_message_usage
+
+
+def test_words_are_quoted():
+    assert build_fts_query("dear pygui") == '"dear" "pygui"*'
+
+
+def test_short_last_word_is_not_a_prefix():
+    assert build_fts_query("add the") == '"add" "the"'
+
+
+def test_trailing_space_ends_the_prefix():
+    assert build_fts_query("texture ") == '"texture"'
+
+
+def test_phrases_are_kept_and_not_prefixed():
+    assert build_fts_query('"render loop" frame') == '"render loop" "frame"*'
+    assert build_fts_query('font "render loop"') == '"font" "render loop"'
+
+
+def test_operators_and_quotes_are_literal():
+    assert build_fts_query('NOT a"b OR') == '"NOT" "ab" "OR"'
+
+
+def test_empty_query():
+    assert build_fts_query("") == ""
+    assert build_fts_query('  ""  ') == ""
+
+
+def test_usage_includes_the_cached_tokens():
+    cost_info = {
+        "input_text_tokens": 100, "input_image_tokens": 0, "output_text_tokens": 20,
+        "cache_write_tokens": 1000, "cache_read_tokens": 4000, "total_cost_usd": 0.01,
+    }
+    assert get_message_usage({"role": "assistant", "content": [], "cost_info": cost_info}) == (5100, 20, 0.01)
+    assert get_message_usage({"role": "user", "content": []}) == (None, None, None)
+
+
+def test_conversation_totals_include_the_cached_tokens(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    cost_info = {"input_text_tokens": 100, "output_text_tokens": 20, "cache_read_tokens": 4000, "total_cost_usd": 0.01}
+    store.save_messages("c", 0, [
+        make_message("user", text="hello"),
+        {**make_message("assistant", text="hi"), "cost_info": cost_info},
+    ])
+    conversation = store.list_conversations()[0]
+    assert conversation["total_tokens"] == 4120
+    assert conversation["total_cost_usd"] == 0.01
+    store.close()
+
+
+def test_search_finds_the_saved_messages(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    store.save_messages("c", 0, [make_message("user", text="how do textures work"), make_message("assistant", text="ok")])
+    store.save_messages("c", 1, [make_message("assistant", text="textures are uploaded once")])
+    results = store.search("textures")
+    assert sorted((result["name"], result["position"]) for result in results) == [("c", 0), ("c", 1)]
+    assert all("[textures]" in result["snippet"] for result in results)
+    # The replaced message is no longer found
+    assert store.search("ok") == []
+    store.close()
+
+
+def test_store_without_message_ids_is_migrated(tmp_path):
+    db_path = str(tmp_path / "conversations.db")
+    # A store created before the messages had an id, with a message indexed by its rowid
+    connection = sqlite3.connect(db_path)
+    connection.executescript(OLD_SCHEMA)
+    connection.execute("INSERT INTO conversations (name, created_at, updated_at) VALUES ('c', 1, 1)")
+    connection.execute(
+        "INSERT INTO messages (conversation_id, position, role, content, text, timestamp)"
+        " VALUES (1, 0, 'user', '[]', 'an old message about shaders', 1)"
+    )
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+    connection.close()
+
+    store = ConversationStore(db_path)
+    columns = [row["name"] for row in store.connection.execute("PRAGMA table_info(messages)")]
+    assert columns[0] == "id"
+    assert store.connection.execute("PRAGMA user_version").fetchone()[0] == SEARCH_SCHEMA_VERSION
+    assert [result["position"] for result in store.search("shaders")] == [0]
+    # The new messages are indexed by their id
+    store.save_messages("c", 1, [make_message("assistant", text="shaders run on the GPU")])
+    store.connection.execute("VACUUM")
+    assert sorted(result["position"] for result in store.search("shaders")) == [0, 1]
+    store.close()
+
+
+OLD_SCHEMA = """
+CREATE TABLE conversations (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, title TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL, updated_at REAL NOT NULL, message_count INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0, total_cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE messages (
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, metadata TEXT, text TEXT NOT NULL,
+    timestamp REAL NOT NULL, input_tokens INTEGER, output_tokens INTEGER, cost_usd REAL,
+    PRIMARY KEY (conversation_id, position)
+);
+CREATE INDEX idx_messages_timestamp ON messages (timestamp);
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    text, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='4'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+"""
+
+
+def test_only_the_typed_text_is_indexed(tmp_path, monkeypatch):
+    monkeypatch.setattr(messages, "build_context_data", lambda query=None: "<notes.txt>\nabout shaders\n</notes.txt>")
+    user_message = messages.prepare_user_message("how do textures work", include_additional_context7=True)
+    # The context is sent in its own element, and shown after the typed text
+    assert user_message["content"][0]["text"] == "how do textures work"
+    assert messages.extract_message_text(user_message["content"]).endswith("about shaders\n</notes.txt>")
+
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    store.save_messages("c", 0, [user_message])
+    assert [result["position"] for result in store.search("textures")] == [0]
+    assert store.search("shaders") == []
+    assert store.list_conversations()[0]["title"] == "how do textures work"
+    # The message is loaded as it was sent
+    assert store.load_conversation("c") == [user_message]
+    store.close()
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+from conftest import make_message
+
+from utils.cost_manager import CostManager, calculate_api_call_cost, count_message_images_tokens
+
+
+def test_first_logged_call_is_counted_once(tmp_path):
+    manager = CostManager(str(tmp_path / "api_costs.log"))
+    manager.log_call(0.25, {"input_text_tokens": 100, "output_text_tokens": 10})
+    assert manager.get_total_cost() == 0.25
+
+
+def test_subscribers_get_the_new_total(tmp_path):
+    manager = CostManager(str(tmp_path / "api_costs.log"))
+    totals = []
+    manager.subscribe(totals.append)
+    manager.log_call(0.25)
+    manager.log_call(0.5)
+    assert totals == [0.25, 0.75]
+    # A new manager reads the same total from the ledger
+    assert CostManager(str(tmp_path / "api_costs.log")).get_total_cost() == 0.75
+
+
+def test_reported_input_isnt_split_into_images():
+    # The conversation has an image the request may not have carried (e.g. elided by the context window)
+    conversation = [make_message("user", words=5, images=1)]
+    cost_info = calculate_api_call_cost(conversation, "reply", usage={"input_tokens": 300, "output_tokens": 20})
+    assert cost_info["reported7"]
+    assert cost_info["input_text_tokens"] == 300
+    assert cost_info["input_image_tokens"] == 0
+    assert cost_info["output_text_tokens"] == 20
+
+
+def test_estimated_cost_counts_the_images():
+    conversation = [make_message("user", words=5, images=1)]
+    cost_info = calculate_api_call_cost(conversation, "a short reply")
+    assert not cost_info["reported7"]
+    assert cost_info["input_text_tokens"] == 5
+    assert cost_info["input_image_tokens"] == count_message_images_tokens(conversation[0]) > 0
+    assert cost_info["output_text_tokens"] == 3
+
+
+def test_calls_are_still_logged_with_their_monthly_aggregate(tmp_path):
+    log_path = tmp_path / "api_costs.log"
+    manager = CostManager(str(log_path))
+    manager.log_call(0.25)
+    manager.log_call(0.5)
+    assert len(log_path.read_text().splitlines()) == 2
+    assert manager.get_monthly_cost() == 0.75
+    # The aggregate is saved with the offset, so a new manager doesn't parse the log again
+    assert CostManager(str(log_path)).offset == log_path.stat().st_size
+
+
+def test_aggregate_parses_only_the_complete_new_lines(tmp_path):
+    log_path = tmp_path / "api_costs.log"
+    manager = CostManager(str(log_path))
+    manager.log_call(0.25)
+    manager.get_monthly_cost()
+    month = datetime.utcnow().strftime("%Y-%m")
+    with open(log_path, 'a') as f:
+        f.write(f"{month}-01T00:00:00,1.0\nnot a line\n{month}-01T00:00:01,2")
+    assert manager.get_monthly_cost() == 1.25
+    with open(log_path, 'a') as f:
+        f.write(".0\n")
+    assert manager.get_monthly_cost() == 3.25
+
+
+def test_rebuild_recounts_the_edited_log(tmp_path):
+    log_path = tmp_path / "api_costs.log"
+    manager = CostManager(str(log_path))
+    manager.log_call(0.25)
+    manager.log_call(0.5)
+    manager.get_monthly_cost()
+    first_line = log_path.read_text().splitlines()[0]
+    log_path.write_text(first_line.replace("0.25", "0.75") + "\n" + first_line + "\n")
+    manager.rebuild_aggregate()
+    assert manager.get_monthly_cost() == 1.0
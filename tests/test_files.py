@@ -0,0 +1,37 @@
+import os
+
+from utils.files import find_txt_files, scan_txt_files
+
+
+def write(path, text="text"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_scan_lists_the_txt_files_like_find(tmp_path):
+    write(str(tmp_path / "a.txt"))
+    write(str(tmp_path / "b.md"))
+    write(str(tmp_path / "sub" / "c.txt"), "longer text")
+    stats = scan_txt_files(str(tmp_path))
+    assert sorted(stats) == sorted(find_txt_files(str(tmp_path)))
+    assert stats[str(tmp_path / "sub" / "c.txt")][1] == len("longer text")
+
+
+def test_symlinks_to_dirs_are_not_followed(tmp_path):
+    write(str(tmp_path / "sub" / "c.txt"))
+    os.symlink(str(tmp_path), str(tmp_path / "sub" / "loop"))
+    os.symlink(str(tmp_path / "sub"), str(tmp_path / "link"))
+    assert list(scan_txt_files(str(tmp_path))) == [str(tmp_path / "sub" / "c.txt")]
+
+
+def test_unreadable_entries_are_skipped(tmp_path):
+    # Broken symlinks and files, mixed in the listing order of the dir
+    expected = []
+    for i in range(10):
+        os.symlink(str(tmp_path / f"missing{i}.txt"), str(tmp_path / f"a{i}.txt"))
+        write(str(tmp_path / f"b{i}.txt"))
+        expected.append(str(tmp_path / f"b{i}.txt"))
+    write(str(tmp_path / "sub" / "c.txt"))
+    expected.append(str(tmp_path / "sub" / "c.txt"))
+    assert sorted(scan_txt_files(str(tmp_path))) == sorted(expected)
@@ -0,0 +1,47 @@
+import base64
+
+import utils.image_store as image_store
+from config import IMAGE_MISSING_PLACEHOLDER
+from utils.image_store import ImageStore, make_image_element
+from utils.messages import get_wire_form
+
+
+def use_store(monkeypatch, tmp_path):
+    store = ImageStore(str(tmp_path))
+    monkeypatch.setattr(image_store, "_image_store", store)
+    return store
+
+
+def make_image_message(digest):
+    element = make_image_element(digest, "image.jpg", 750, 1000)
+    return {"role": "user", "content": [{"type": "text", "text": "look"}, element]}
+
+
+def test_same_image_is_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path))
+    digest = store.put(b"jpeg bytes")
+    assert store.put(b"jpeg bytes") == digest
+    assert store.has_image(digest)
+    assert store.get_base64(digest) == base64.standard_b64encode(b"jpeg bytes").decode('ascii')
+
+
+def test_stored_image_is_sent_as_base64(monkeypatch, tmp_path):
+    store = use_store(monkeypatch, tmp_path)
+    digest = store.put(b"jpeg bytes")
+    wire_image = get_wire_form(make_image_message(digest))["content"][1]
+    assert wire_image == {
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/jpeg", "data": store.get_base64(digest)},
+    }
+
+
+def test_missing_image_is_sent_as_placeholder(monkeypatch, tmp_path):
+    use_store(monkeypatch, tmp_path)
+    message = make_image_message("0" * 64)  # Not in the store, e.g. its file was deleted
+    wire_form = get_wire_form(message)
+    assert wire_form["content"] == [
+        {"type": "text", "text": "look"},
+        {"type": "text", "text": IMAGE_MISSING_PLACEHOLDER},
+    ]
+    # The message itself keeps the reference
+    assert message["content"][1]["sha256"] == "0" * 64
@@ -0,0 +1,23 @@
+import time
+
+from gui.layout_worker import LayoutWorker
+
+
+def test_finished_layouts_are_handed_within_the_budget():
+    worker = LayoutWorker()
+    handed = []
+
+    def on_done(layout):
+        handed.append(layout)
+        time.sleep(0.01)
+
+    for i in range(5):
+        worker.finished.put((on_done, i))
+
+    # At least one per frame, even without budget left
+    worker.process_finished(budget_seconds=0)
+    assert handed == [0]
+    worker.process_finished(budget_seconds=0.015)
+    assert handed == [0, 1, 2]
+    worker.process_finished()
+    assert handed == [0, 1, 2, 3, 4]
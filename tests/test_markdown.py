@@ -0,0 +1,113 @@
+import threading
+
+import dearpygui.dearpygui as dpg
+import pytest
+
+import utils.markdown as dpg_markdown
+from utils.markdown import benchmark_wrap, glyph_widths, text_attributes, text_entities
+from utils.markdown import _ParseCache
+
+
+@pytest.fixture(autouse=True)
+def fake_measure(monkeypatch):
+    """A DPG context, with text measuring emulated (there is no display) and no tables or parses left over."""
+    dpg.create_context()
+    for module in [dpg_markdown, glyph_widths, text_entities]:
+        monkeypatch.setattr(module, "get_text_size", benchmark_wrap._fake_get_text_size)
+    glyph_widths.clear()
+    dpg_markdown.parse_cache.clear()
+    yield
+    glyph_widths.clear()
+    dpg_markdown.parse_cache.clear()
+    dpg.destroy_context()
+
+
+def get_pieces(entity):
+    return dpg_markdown._flatten_entity(entity)
+
+
+def describe(attribute):
+    # Each line gets copies of the attribute instances (see recreate_attributes), so they are compared by value
+    if isinstance(attribute, type):
+        return attribute.__name__
+    return type(attribute).__name__, getattr(attribute, "depth", None), getattr(attribute, "index", None)
+
+
+def get_chars(line):
+    """The chars of the line with their attributes, whatever the pieces it's made of."""
+    return [
+        (char, [describe(attribute) for attribute in piece.attributes])
+        for piece in get_pieces(line)
+        for char in str(piece)
+    ]
+
+
+def get_pre_attributes(markdown_text):
+    return [
+        attribute
+        for piece in get_pieces(markdown_text.text_entity)
+        for attribute in piece.attributes
+        if isinstance(attribute, text_attributes.Pre)
+    ]
+
+
+@pytest.mark.parametrize("width", [100, 300, 600, 1200])
+def test_wrap_matches_the_legacy_breaker(width):
+    answer = benchmark_wrap.build_answer(4096)
+    # Each breaker gets its own text, as wrapping fills the attribute connectors
+    lines = dpg_markdown.wrap_text_entity(dpg_markdown.MarkdownText(answer).text_entity, width=width)
+    legacy_lines = benchmark_wrap.legacy_wrap_text_entity(dpg_markdown.MarkdownText(answer).text_entity, width=width)
+    assert [str(line) for line in lines] == [str(line) for line in legacy_lines]
+    assert [get_chars(line) for line in lines] == [get_chars(line) for line in legacy_lines]
+
+
+def test_parse_cache_hits_and_evicts_the_least_recent():
+    cache = _ParseCache(max_size=2)
+    keys = [cache.make_key(text) for text in ["a", "b", "c"]]
+    cache.put(keys[0], "parsed a")
+    cache.put(keys[1], "parsed b")
+    assert cache.get(keys[0]) == "parsed a"  # Now b is the least recent
+    cache.put(keys[2], "parsed c")
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "parsed a" and cache.get(keys[2]) == "parsed c"
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2, "max_size": 2}
+
+
+def test_same_text_is_parsed_once():
+    markdown = "Some **bold** and `code`\n\n- a list item\n"
+    first = dpg_markdown.MarkdownText(markdown)
+    second = dpg_markdown.MarkdownText(markdown)
+    assert dpg_markdown.parse_cache.stats()["misses"] == 1
+    assert dpg_markdown.parse_cache.stats()["hits"] == 1
+    assert get_chars(first.text_entity) == get_chars(second.text_entity)
+
+
+def test_cached_parse_gets_fresh_attribute_connectors():
+    markdown = "Some code:\n\n```python\nx = 1\ny = 2\n```\n"
+    first = get_pre_attributes(dpg_markdown.MarkdownText(markdown))
+    second = get_pre_attributes(dpg_markdown.MarkdownText(markdown))
+    assert first and second
+    # The pieces of one code block share a connector, but two texts never do (it's filled while rendering)
+    assert all(attribute.attribute_connector is first[0].attribute_connector for attribute in first)
+    assert first[0].attribute_connector is not second[0].attribute_connector
+
+
+def test_glyph_table_is_sampled_outside_the_lock(monkeypatch):
+    locked_while_sampling = []
+
+    def get_text_size(text, **kwargs):
+        locked_while_sampling.append(glyph_widths._lock.locked())
+        return benchmark_wrap._fake_get_text_size(text, **kwargs)
+
+    monkeypatch.setattr(glyph_widths, "get_text_size", get_text_size)
+
+    tables = []
+    threads = [threading.Thread(target=lambda: tables.append(glyph_widths.get_table("font"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert locked_while_sampling and not any(locked_while_sampling)
+    # Only one table is kept per font
+    assert all(table is tables[0] for table in tables)
+    assert glyph_widths.get_table("font") is tables[0]
@@ -0,0 +1,45 @@
+from conftest import make_conversation, make_message
+
+import utils.image_store as image_store
+from utils.chat_logs import get_persistent_form, serialize_message
+from utils.cost_manager import count_message_tokens
+from utils.image_store import ImageStore, make_image_element
+from utils.messages import WIRE_FORM_KEY, get_wire_form, sanitize_conversation
+
+
+def test_all_but_the_last_message_are_memoized():
+    conversation = make_conversation(2)
+    sanitized = sanitize_conversation(conversation)
+    assert sanitized == [get_wire_form(message) for message in conversation]
+    assert all(WIRE_FORM_KEY in message for message in conversation[:-1])
+    # The last message may still change (e.g. the streamed reply)
+    assert WIRE_FORM_KEY not in conversation[-1]
+
+    conversation[-1]["content"][0]["text"] += " more"
+    assert sanitize_conversation(conversation)[-1]["content"][0]["text"].endswith(" more")
+    # The memoized forms are reused as is
+    assert all(a is b for a, b in zip(sanitize_conversation(conversation)[:-1], sanitized[:-1]))
+
+
+def test_messages_with_stored_images_are_not_memoized(monkeypatch, tmp_path):
+    store = ImageStore(str(tmp_path))
+    monkeypatch.setattr(image_store, "_image_store", store)
+    image_message = make_message("user", text="look")
+    image_message["content"].append(make_image_element(store.put(b"jpeg bytes"), "image.jpg", 750, 1000))
+    conversation = [image_message, make_message("assistant", text="nice")]
+
+    sanitized = sanitize_conversation(conversation)
+    assert sanitized[0]["content"][1]["source"]["data"] == store.get_base64(image_message["content"][1]["sha256"])
+    assert WIRE_FORM_KEY not in image_message
+
+
+def test_memoized_keys_are_never_saved():
+    conversation = make_conversation(2)
+    sanitize_conversation(conversation)
+    for message in conversation:
+        count_message_tokens(message)
+    assert WIRE_FORM_KEY in conversation[0] and "_token_count" in conversation[0]
+    for message in conversation:
+        persistent_form = get_persistent_form(message)
+        assert not any(key.startswith("_") for key in persistent_form)
+        assert "_wire_form" not in serialize_message(message) and "_token_count" not in serialize_message(message)
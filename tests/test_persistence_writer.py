@@ -0,0 +1,73 @@
+import threading
+
+from conftest import make_conversation
+
+from utils.persistence_writer import PersistenceWriter
+
+
+class FakeJournal:
+    """Records the snapshots it's synced with. The first sync can be held, so the next saves pile up."""
+
+    def __init__(self, hold7=False):
+        self.synced = []
+        self.compacted_count = 0
+        self.released = threading.Event()
+        if not hold7:
+            self.released.set()
+
+    def sync(self, snapshot):
+        self.released.wait(5)
+        self.synced.append(snapshot)
+
+    def compact(self):
+        self.compacted_count += 1
+
+
+def test_burst_of_saves_writes_only_the_last_snapshot():
+    writer = PersistenceWriter()
+    journal = FakeJournal(hold7=True)
+    snapshots = [make_conversation(i) for i in range(4)]
+    writer.save(journal, snapshots[0])
+    # While the first save is being written, the others pile up
+    for snapshot in snapshots[1:]:
+        writer.save(journal, snapshot)
+    journal.released.set()
+    assert writer.flush(5)
+    assert journal.synced[-1] is snapshots[-1]
+    assert len(journal.synced) < len(snapshots)
+    writer.close(5)
+
+
+def test_saves_of_different_journals_are_all_written():
+    writer = PersistenceWriter()
+    holder = FakeJournal(hold7=True)
+    journals = [FakeJournal() for _ in range(3)]
+    writer.save(holder, [])
+    for journal in journals:
+        writer.save(journal, make_conversation(1))
+    holder.released.set()
+    assert writer.flush(5)
+    assert all(len(journal.synced) == 1 for journal in journals)
+    writer.close(5)
+
+
+def test_close_writes_everything_queued(tmp_path):
+    writer = PersistenceWriter()
+    journal = FakeJournal(hold7=True)
+    first, last = make_conversation(1), make_conversation(2)
+    writer.save(journal, first)
+    writer.finish(journal, last, str(tmp_path), "conversation.txt")
+    journal.released.set()
+    writer.close(5)
+    assert writer.thread is None
+    # The save before the finish is superseded by it
+    assert journal.synced[-1] is last
+    assert journal.compacted_count == 1
+    assert "message 2" in (tmp_path / "conversation.txt").read_text(encoding="utf-8")
+
+
+def test_flush_and_close_without_saves():
+    writer = PersistenceWriter()
+    assert writer.flush(1)
+    writer.close(1)
+    assert writer.thread is None
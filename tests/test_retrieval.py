@@ -0,0 +1,82 @@
+import os
+
+from utils.retrieval import ContextIndex, get_terms, split_into_chunks
+
+
+def test_get_terms():
+    assert get_terms("Add_Font size") == ["add_font", "add", "font", "size"]
+
+
+def test_chunks_are_whole_paragraphs():
+    text = "\n\n".join(["a" * 30, "b" * 30, "c" * 30])
+    chunks = split_into_chunks(text, 70)
+    assert chunks == ["a" * 30 + "\n\n" + "b" * 30, "c" * 30]
+
+
+def test_long_paragraph_is_cut_at_spaces():
+    words = " ".join(["word"] * 50)  # 249 chars
+    chunks = split_into_chunks("intro\n\n" + words, 60)
+    assert chunks[0] == "intro"
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert " ".join(chunks[1:]).split() == words.split()
+
+
+def test_empty_text():
+    assert split_into_chunks("\n\n  \n\n", 100) == []
+
+
+def write_docs(directory, files):
+    for name, text in files.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def make_index(tmp_path, chunk_tokens=20):
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    return docs, lambda: ContextIndex(str(docs), str(tmp_path / "index.json"), chunk_tokens=chunk_tokens)
+
+
+DOCS = {
+    "fonts.txt": "add_font loads a font file.\n\nbind_font sets the font of an item.",
+    "plots.txt": "add_plot creates a plot.\n\nadd_line_series adds a line to a plot.",
+}
+
+
+def test_bm25_ranks_the_relevant_chunk_first(tmp_path):
+    docs, create = make_index(tmp_path)
+    write_docs(docs, DOCS)
+    index = create()
+    ranked = index.search("how to bind a font to an item")
+    assert "bind_font" in index.chunks[ranked[0]][2]
+    assert index.search("nothing matches this") == []
+
+
+def test_context_format_and_budget(tmp_path):
+    docs, create = make_index(tmp_path)
+    write_docs(docs, DOCS)
+    index = create()
+    context = index.get_context("plot line", top_k=4, token_budget=1000)
+    assert context.startswith("<plots.txt>\n")
+    assert "add_line_series" in context
+    # The first chunk is always sent, even over the budget
+    assert index.get_context("plot line", token_budget=0).count("<plots.txt>") == 1
+    assert index.get_context("unrelated") is None
+
+
+def test_index_is_persisted_and_refreshed(tmp_path):
+    docs, create = make_index(tmp_path)
+    write_docs(docs, DOCS)
+    index = create()
+    assert index.refresh()
+    assert not index.refresh()
+    assert create().files == index.files  # Loaded from the file
+
+    write_docs(docs, {"plots.txt": "add_bar_series adds bars to a plot, of a longer text."})
+    assert index.refresh()
+    assert index.get_context("bars") is not None
+    assert index.get_context("line") is None
+
+    os.remove(docs / "fonts.txt")
+    assert index.refresh()
+    assert index.get_context("font") is None
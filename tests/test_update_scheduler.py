@@ -0,0 +1,65 @@
+import time
+
+from gui.update_scheduler import UpdateScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def test_updates_run_by_priority_then_in_order():
+    scheduler = UpdateScheduler(budget_ms=1000)
+    ran = []
+    scheduler.put(lambda: ran.append("low"), PRIORITY_LOW)
+    scheduler.put(lambda: ran.append("normal 1"))
+    scheduler.put(lambda: ran.append("high"), PRIORITY_HIGH)
+    scheduler.put(lambda: ran.append("normal 2"), PRIORITY_NORMAL)
+    scheduler.run()
+    assert ran == ["high", "normal 1", "normal 2", "low"]
+    assert scheduler.empty()
+
+
+def test_rest_is_carried_over_when_the_budget_is_spent():
+    scheduler = UpdateScheduler(budget_ms=15)
+    ran = []
+
+    def update(i):
+        ran.append(i)
+        time.sleep(0.01)
+
+    for i in range(5):
+        scheduler.put(lambda i=i: update(i))
+
+    scheduler.run()
+    assert ran == [0, 1]
+    assert scheduler.get_stats()["last_frame"]["carried_over"] == 3
+    scheduler.run()
+    assert ran == [0, 1, 2, 3]
+
+
+def test_at_least_one_update_runs_per_frame():
+    scheduler = UpdateScheduler(budget_ms=0)
+    ran = []
+    scheduler.put(lambda: ran.append(1))
+    scheduler.put(lambda: ran.append(2))
+    scheduler.begin_frame()
+    time.sleep(0.001)
+    scheduler.run()
+    assert ran == [1]
+    assert len(scheduler) == 1
+
+
+def test_updates_queued_by_updates_wait_for_the_next_frame():
+    scheduler = UpdateScheduler(budget_ms=1000)
+    ran = []
+    scheduler.put(lambda: scheduler.put(lambda: ran.append("queued"), PRIORITY_HIGH))
+    scheduler.put(lambda: ran.append("first"), PRIORITY_LOW)
+    scheduler.run()
+    assert ran == ["first"]
+    scheduler.run()
+    assert ran == ["first", "queued"]
+
+
+def test_failing_update_doesnt_stop_the_others():
+    scheduler = UpdateScheduler(budget_ms=1000)
+    ran = []
+    scheduler.put(lambda: 1 / 0)
+    scheduler.put(lambda: ran.append("after"))
+    scheduler.run()
+    assert ran == ["after"]
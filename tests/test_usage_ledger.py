@@ -0,0 +1,107 @@
+import json
+import os
+from datetime import datetime
+
+from utils.usage_ledger import UsageLedger, FIELDS
+
+
+def make_ledger(tmp_path, legacy_lines=None):
+    legacy_path = tmp_path / "api_costs.log"
+    if legacy_lines is not None:
+        legacy_path.write_text("".join(line + "\n" for line in legacy_lines))
+    return UsageLedger(str(tmp_path / "api_usage.csv"), legacy_log_file_path=str(legacy_path))
+
+
+def this_month():
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+def test_record_and_rollups(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0, conversation_id="a", model="m", input_tokens=10, output_tokens=5, cache_read_tokens=3)
+    ledger.record(0.5, conversation_id="b", model="m", input_tokens=1)
+    totals = ledger.get_totals("month", this_month())
+    assert totals["calls"] == 2
+    assert totals["cost_usd"] == 1.5
+    assert totals["input_tokens"] == 11
+    assert totals["cache_read_tokens"] == 3
+    assert ledger.get_totals("conversation", "a")["cost_usd"] == 1.0
+    assert [conversation_id for conversation_id, _ in ledger.get_top_conversations()] == ["a", "b"]
+
+
+def test_only_new_rows_are_counted(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0)
+    assert ledger.get_monthly_cost() == 1.0
+    offset = ledger.offset
+    assert offset == os.path.getsize(ledger.LEDGER_FILE_PATH)
+    ledger.record(2.0)
+    assert ledger.get_monthly_cost() == 3.0
+    assert ledger.offset > offset
+
+
+def test_partial_row_is_left_for_the_next_update(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0)
+    ledger.update_rollups()
+    offset = ledger.offset
+    timestamp = datetime.utcnow().isoformat()
+    with open(ledger.LEDGER_FILE_PATH, "a") as f:
+        f.write(f"{timestamp},c,m,0,0,0,")
+    assert ledger.get_monthly_cost() == 1.0
+    assert ledger.offset == offset
+    with open(ledger.LEDGER_FILE_PATH, "a") as f:
+        f.write("2.0,0,0\n")
+    assert ledger.get_monthly_cost() == 3.0
+
+
+def test_rollups_are_saved_and_reloaded(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0, model="m")
+    ledger.update_rollups()
+    reloaded = make_ledger(tmp_path)
+    assert reloaded.offset == ledger.offset
+    assert reloaded.get_totals("model", "m")["cost_usd"] == 1.0
+
+
+def test_truncated_ledger_is_recounted(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0)
+    ledger.record(2.0)
+    ledger.update_rollups()
+    with open(ledger.LEDGER_FILE_PATH, "w") as f:
+        f.write(",".join(FIELDS) + "\n")
+    assert ledger.get_monthly_cost() == 0
+
+
+def test_rebuild_after_editing_by_hand(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0)
+    ledger.update_rollups()
+    with open(ledger.LEDGER_FILE_PATH) as f:
+        edited = f.read().replace(",1.0,", ",4.0,")
+    with open(ledger.LEDGER_FILE_PATH, "w") as f:
+        f.write(edited)
+    ledger.rebuild_rollups()
+    assert ledger.get_monthly_cost() == 4.0
+    with open(ledger.rollups_file_path) as f:
+        assert json.load(f)["offset"] == ledger.offset
+
+
+def test_legacy_log_and_rows_are_imported(tmp_path):
+    ledger = make_ledger(tmp_path, legacy_lines=["2024-01-05T10:00:00,0.25", "broken line"])
+    # A row written before the cache columns existed
+    with open(ledger.LEDGER_FILE_PATH, "a") as f:
+        f.write("2024-01-06T10:00:00,c,m,1,2,0,0.5\n")
+    totals = ledger.get_totals("month", "2024-01")
+    assert totals["calls"] == 2
+    assert totals["cost_usd"] == 0.75
+    assert totals["cache_write_tokens"] == 0
+
+
+def test_rollups_of_other_fields_are_recounted(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.record(1.0)
+    with open(ledger.rollups_file_path, "w") as f:
+        json.dump({"offset": 10 ** 6, "rollups": UsageLedger.new_rollups()}, f)
+    assert make_ledger(tmp_path).get_monthly_cost() == 1.0
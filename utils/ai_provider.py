@@ -1,21 +1,96 @@
+import time
+
 import anthropic
 
-from config import SYSTEM_PROMPT
-from utils.cost_manager import CostManager, calculate_api_call_cost
+from config import SYSTEM_PROMPT, MOCK_STREAM_DELAY_SECONDS, PROMPT_CACHING7
+from utils.cost_manager import get_cost_manager, calculate_api_call_cost
 
 
 CLIENT = anthropic.Anthropic()
 MODEL = "claude-3-5-sonnet-latest"
 
-COST_MANAGER = CostManager() 
+COST_MANAGER = get_cost_manager()  # Shared with the cost indicator
+
+
+def get_mock_response(conversation):
+    """Build a fake reply for offline testing"""
+    user_message = conversation[-1]["content"][0]["text"]
+    return f"User said: {user_message}"
+
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def get_system_prompt():
+    """Returns the system prompt, as a cacheable block if prompt caching is enabled."""
+    if not PROMPT_CACHING7:
+        return SYSTEM_PROMPT
+    return [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+
+
+def add_cache_breakpoints(conversation):
+    """
+    Returns the conversation with cache breakpoints on the first message (which has the context texts)
+    and on the last one (so the next call reads everything up to it from the cache).
+    The marked messages are copied, the given conversation isn't modified.
+    """
+    if not PROMPT_CACHING7 or not conversation:
+        return conversation
+    cached_conversation = list(conversation)
+    for i in sorted({0, len(conversation) - 1}):
+        message = conversation[i]
+        content = message["content"]
+        if not isinstance(content, list) or not content:
+            continue
+        last_element = dict(content[-1])
+        last_element["cache_control"] = CACHE_CONTROL
+        cached_conversation[i] = {**message, "content": content[:-1] + [last_element]}
+    return cached_conversation
+
+
+def get_usage(response):
+    """Returns the token counts reported by the API for the response, or None if there are none."""
+    usage = getattr(response, "usage", None)
+    if usage is None or usage.input_tokens is None or usage.output_tokens is None:
+        return None
+    return {
+        "input_tokens": usage.input_tokens,  # Without the tokens written to or read from the cache
+        "output_tokens": usage.output_tokens,
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+    }
+
+
+def log_api_call_cost(conversation_with_metadata, res, conversation_id=None, usage=None):
+    """Calculate the cost of the call and log it"""
+    cost_info = calculate_api_call_cost(conversation_with_metadata, res, usage=usage)
+    total_cost = cost_info["total_cost_usd"]
+    #print(f"API Cost: ${total_cost:.6f}")
+    #print(f" - Input Text Tokens: {cost_info['input_text_tokens']}")
+    #print(f" - Input Image Tokens: {cost_info['input_image_tokens']}")
+    #print(f" - Output Text Tokens: {cost_info['output_text_tokens']}")
+
+    # Log the cost using CostManager
+    COST_MANAGER.log_call(
+        total_cost, cost_info=cost_info, conversation_id=conversation_id, model=MODEL
+    )
 
+    # Optionally, display the total cost since the start of the month (kept in memory, no I/O)
+    monthly_cost = COST_MANAGER.get_total_cost()
+    #print(f"Total cost since the start of the month: ${monthly_cost:.6f}")
+    return cost_info
 
-def get_claude_response(conversation, conversation_with_metadata, mock7=False):
-    """Get response from Claude API"""
+
+def get_claude_response(conversation, conversation_with_metadata, mock7=False, cost_info=None, conversation_id=None):
+    """
+    Get response from Claude API
+
+    If cost_info (dict) is given, it's filled with the cost breakdown of the call.
+    The conversation_id is recorded in the usage ledger with the cost.
+    """
 
     if mock7:
-        user_message = conversation[-1]["content"][0]["text"]
-        res = f"User said: {user_message}"
+        res = get_mock_response(conversation)
     else:
         try:
             # print("Sending message to Claude")
@@ -23,26 +98,63 @@ def get_claude_response(conversation, conversation_with_metadata, mock7=False):
                 model=MODEL,
                 max_tokens=1000,
                 temperature=0.8,
-                system=SYSTEM_PROMPT,
-                messages=conversation,
+                system=get_system_prompt(),
+                messages=add_cache_breakpoints(conversation),
             )
             res = response.content[0].text
 
-            # Calculate the API cost
-            cost_info = calculate_api_call_cost(conversation_with_metadata, res)
-            total_cost = cost_info["total_cost_usd"]
-            #print(f"API Cost: ${total_cost:.6f}")
-            #print(f" - Input Text Tokens: {cost_info['input_text_tokens']}")
-            #print(f" - Input Image Tokens: {cost_info['input_image_tokens']}")
-            #print(f" - Output Text Tokens: {cost_info['output_text_tokens']}")
-
-            # Log the cost using CostManager
-            COST_MANAGER.log_call(total_cost)
-
-            # Optionally, display the total cost since the start of the month
-            monthly_cost = COST_MANAGER.get_monthly_cost()
-            #print(f"Total cost since the start of the month: ${monthly_cost:.6f}")
+            # Calculate and log the API cost
+            call_cost_info = log_api_call_cost(
+                conversation_with_metadata, res, conversation_id=conversation_id,
+                usage=get_usage(response),
+            )
+            if cost_info is not None:
+                cost_info.update(call_cost_info)
 
         except Exception as e:
             res = f"Error: {e}"
     return res
+
+
+def stream_claude_response(conversation, conversation_with_metadata, mock7=False, cost_info=None, conversation_id=None):
+    """
+    Stream the response from Claude API, yielding the text deltas as they arrive.
+
+    The mock mode yields the fake reply word by word, to test the streaming path offline.
+    If cost_info (dict) is given, it's filled with the cost breakdown of the call once the stream ends.
+    """
+
+    if mock7:
+        res = get_mock_response(conversation)
+        for i, word in enumerate(res.split(" ")):
+            time.sleep(MOCK_STREAM_DELAY_SECONDS)
+            yield word if i == 0 else f" {word}"
+        return
+
+    # The input, without the reply that is appended to the conversation while streaming
+    input_conversation = list(conversation_with_metadata)
+    parts = []
+    try:
+        with CLIENT.messages.stream(
+            model=MODEL,
+            max_tokens=1000,
+            temperature=0.8,
+            system=get_system_prompt(),
+            messages=add_cache_breakpoints(conversation),
+        ) as stream:
+            for text in stream.text_stream:
+                parts.append(text)
+                yield text
+            final_message = stream.get_final_message()
+
+        # Calculate and log the API cost once the whole reply is known
+        call_cost_info = log_api_call_cost(
+            input_conversation, "".join(parts), conversation_id=conversation_id,
+            usage=get_usage(final_message),
+        )
+        if cost_info is not None:
+            cost_info.update(call_cost_info)
+
+    except Exception as e:
+        prefix = "\n\n" if parts else ""
+        yield f"{prefix}Error: {e}"
@@ -1,3 +1,4 @@
+import json
 import os
 import time
 
@@ -20,7 +21,7 @@ def save_conversation_to_text_file(conversation, directory, filename="conversati
     file_path = os.path.join(directory, filename)
 
     # Build the conversation text
-    conversation_text = ""
+    conversation_text = []
     for message in conversation:
         role = message["role"].capitalize()
         content = message.get("content", [])
@@ -28,17 +29,166 @@ def save_conversation_to_text_file(conversation, directory, filename="conversati
 
         message_text = extract_message_text(content, shorten7=False)
         # Add the message to the conversation text
-        conversation_text += f"{role} [{timestamp}]:\n{message_text}\n\n"
+        conversation_text.append(f"{role} [{timestamp}]:\n{message_text}\n\n")
         # Add a highly visible divider
-        conversation_text += "############################################################\n\n"
-
-    already_exist = os.path.exists(file_path)
-    if not already_exist:
-        print(f"Saving the new conversation to {file_path}")
+        conversation_text.append("############################################################\n\n")
 
     with open(file_path, "w", encoding="utf-8") as file:
-        file.write(conversation_text)
+        file.write("".join(conversation_text))
+
+
+"""
+The conversation journal.
+
+An append-only JSON Lines file, with one record per line:
+    {"op": "put", "index": 3, "message": {...}}  - the message at this index (appended or replaced)
+    {"op": "truncate", "length": 3}               - the messages from this index on are removed
+Each save only appends the records of the new or changed messages, so its cost doesn't grow with the history.
+Replaying the records from the start gives the conversation (see read_journal).
+"""
+
+
+def get_persistent_form(message):
+    """
+    Returns the message without its runtime-only keys (the ones starting with "_", e.g. memoized token counts).
+    The message is copied first, as another thread may add such keys to it meanwhile.
+    """
+    return {key: value for key, value in dict(message).items() if not key.startswith("_")}
 
 
+def serialize_message(message):
+    return json.dumps(get_persistent_form(message), ensure_ascii=False)
+
+
+def count_unchanged_messages(saved, conversation):
+    """
+    Returns the number of leading messages that are already saved as is.
+
+    Args:
+        saved (list): (message, serialized message) for each saved message.
+
+    The messages are matched by identity, and only the last one is compared by value,
+    as it's the only one that is modified in place (e.g. a streamed reply).
+    """
+    kept_count = 0
+    for (saved_message, _), message in zip(saved, conversation):
+        if saved_message is not message:
+            break
+        kept_count += 1
+    if kept_count > 0:
+        message, serialized = saved[kept_count - 1]
+        if serialize_message(message) != serialized:
+            kept_count -= 1
+    return kept_count
+
 
-    
\ No newline at end of file
+class ConversationJournal:
+    def __init__(self, directory, filename, fsync_batch=1, compact_ratio=4):
+        """
+        Args:
+            fsync_batch (int): The file is fsynced after this many syncs (and on close and compaction).
+            compact_ratio (int): The journal is compacted when it has this many times more records than messages.
+        """
+        self.directory = directory
+        self.filename = filename
+        self.file_path = os.path.join(directory, filename)
+        self.fsync_batch = max(fsync_batch, 1)
+        self.compact_ratio = compact_ratio
+
+        self.file = None
+        self.records_count = 0  # Records in the file
+        self.unsynced_count = 0  # Syncs since the last fsync
+        # What the journal holds: one (message, serialized message) per index
+        self.journaled = []
+
+    def open(self):
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            if not os.path.exists(self.file_path):
+                print(f"Saving the new conversation to {self.file_path}")
+            self.file = open(self.file_path, "a", encoding="utf-8")
+
+    def sync(self, conversation):
+        """Appends the records that bring the journal in sync with the conversation."""
+        start = self.count_unchanged_messages(conversation)
+        lines = []
+        if start < len(self.journaled):
+            lines.append(json.dumps({"op": "truncate", "length": start}))
+            del self.journaled[start:]
+        for index in range(start, len(conversation)):
+            message = conversation[index]
+            serialized = serialize_message(message)
+            lines.append(f'{{"op": "put", "index": {index}, "message": {serialized}}}')
+            self.journaled.append((message, serialized))
+
+        if not lines:
+            return
+        self.open()
+        self.file.write("\n".join(lines) + "\n")
+        self.records_count += len(lines)
+
+        if self.records_count > self.compact_ratio * max(len(self.journaled), 4):
+            self.compact()
+            return
+
+        self.unsynced_count += 1
+        if self.unsynced_count >= self.fsync_batch:
+            self.flush(fsync7=True)
+        else:
+            self.file.flush()
+
+    def count_unchanged_messages(self, conversation):
+        return count_unchanged_messages(self.journaled, conversation)
+
+    def flush(self, fsync7=False):
+        if self.file is None:
+            return
+        self.file.flush()
+        if fsync7:
+            os.fsync(self.file.fileno())
+            self.unsynced_count = 0
+
+    def compact(self):
+        """Rewrites the journal with only one record per message."""
+        self.close()
+        if not self.journaled:
+            return
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for index, (_, serialized) in enumerate(self.journaled):
+                file.write(f'{{"op": "put", "index": {index}, "message": {serialized}}}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.file_path)
+        self.records_count = len(self.journaled)
+
+    def close(self):
+        if self.file is not None:
+            self.flush(fsync7=True)
+            self.file.close()
+            self.file = None
+
+    def get_conversation(self):
+        return [message for message, _ in self.journaled]
+
+
+def read_journal(file_path):
+    """
+    Reconstructs the conversation from a journal file.
+    A partly written last line (e.g. after a crash) is ignored.
+    """
+    conversation = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping a broken record in {file_path}")
+                continue
+            if record["op"] == "put":
+                index = record["index"]
+                del conversation[index:]
+                conversation.append(record["message"])
+            elif record["op"] == "truncate":
+                del conversation[record["length"]:]
+    return conversation
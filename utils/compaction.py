@@ -0,0 +1,115 @@
+import threading
+
+from config import COMPACTION_THRESHOLD_TOKENS, COMPACTION_KEEP_RECENT_MESSAGES, COMPACTION_PROMPT
+from utils.ai_provider import get_claude_response
+from utils.cost_manager import count_message_tokens, estimate_message_tokens
+from utils.messages import extract_message_text
+
+# The messages estimated under this part of the threshold aren't tokenized
+ESTIMATE_SAFE_RATIO = 0.5
+
+
+def build_summary_request(messages, previous_summary=None):
+    """Returns the conversation of the request that summarizes the messages (and the summary of the ones before)."""
+    parts = [COMPACTION_PROMPT]
+    if previous_summary:
+        parts.append(f"<summary_so_far>\n{previous_summary}\n</summary_so_far>")
+    transcript = []
+    for message in messages:
+        role = "User" if message["role"] == "user" else "Assistant"
+        transcript.append(f"{role}: {extract_message_text(message['content'])}")
+    parts.append("<conversation>\n" + "\n\n".join(transcript) + "\n</conversation>")
+    return [{"role": "user", "content": [{"type": "text", "text": "\n\n".join(parts)}]}]
+
+
+class ConversationCompactor:
+    """
+    Summarizes the older turns of a long conversation in a background request.
+
+    The summary replaces those turns in the requests that follow (see apply_summary),
+    while the conversation itself (shown in the GUI and saved) keeps them in full.
+    Each new summary covers the previous one and the turns after it.
+    """
+
+    def __init__(self, threshold_tokens=COMPACTION_THRESHOLD_TOKENS, keep_recent=COMPACTION_KEEP_RECENT_MESSAGES,
+                 mock7=False):
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent = keep_recent
+        self.mock7 = mock7  # Use the fake AI provider instead of the API
+        self.lock = threading.Lock()
+        self.summary = None  # {"upto": index of the first message not summarized, "text": ...}
+        self.thread = None
+        self.generation = 0  # Changes with the conversation, so a late summary of the old one is dropped
+
+    def reset(self):
+        """Starts over for a new conversation."""
+        with self.lock:
+            self.generation += 1
+            self.summary = None
+
+    def get_summary(self):
+        with self.lock:
+            return self.summary
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def maybe_start(self, conversation, conversation_id=None):
+        """
+        Starts summarizing in the background if the messages after the summary (without the recent ones)
+        are over the threshold. Returns True if it was started.
+
+        Args:
+            conversation (list): A snapshot of the conversation, without the thinking placeholder.
+        """
+        with self.lock:
+            if self.is_running():
+                return False
+            start = self.summary["upto"] if self.summary else 1
+            previous_summary = self.summary["text"] if self.summary else None
+            generation = self.generation
+
+        # The messages after the summary start with a user message, so the roles keep alternating
+        upto = len(conversation) - self.keep_recent
+        if upto % 2 == 1:
+            upto -= 1
+        if upto <= start:
+            return False
+        messages = conversation[start:upto]
+        if sum(estimate_message_tokens(message) for message in messages) < self.threshold_tokens * ESTIMATE_SAFE_RATIO:
+            return False
+        try:
+            tokens = sum(sum(count_message_tokens(message)) for message in messages)
+        except Exception as e:
+            # E.g. the tokenizer couldn't be downloaded (offline): the conversation just isn't compacted
+            print(f"Couldn't count the tokens of the conversation, it won't be compacted: {e}")
+            return False
+        if tokens < self.threshold_tokens:
+            return False
+
+        with self.lock:
+            self.thread = threading.Thread(
+                target=self._run,
+                args=(messages, upto, previous_summary, generation, conversation_id),
+                daemon=True,
+            )
+            self.thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Waits for the running summarization, if any (e.g. in tests)."""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, messages, upto, previous_summary, generation, conversation_id):
+        request = build_summary_request(messages, previous_summary)
+        text = get_claude_response(request, request, mock7=self.mock7, conversation_id=conversation_id)
+        if text.startswith("Error:"):
+            print(f"Couldn't summarize the conversation: {text}")
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.summary = {"upto": upto, "text": text}
+        print(f"{upto - 1} older messages of the conversation were summarized for the next requests")
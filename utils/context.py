@@ -1,26 +1,73 @@
-from config import CONTEXT_TEXTS_DIR_PATH
-from utils.files import find_txt_files, is_valid_path
+import threading
+from config import CONTEXT_TEXTS_DIR_PATH, RETRIEVE_CONTEXT7
+from utils.files import scan_txt_files, is_valid_path
 from os.path import basename
 
-def build_context_data():
+
+class ContextCache:
+    """
+    Keeps the context built from the .txt files of a dir, and the text of each file.
+
+    Each get() only lists the dir and stats the files (a cheap sweep). The files whose
+    modification time or size changed, and the new ones, are read again; the context
+    is assembled again only if something changed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}  # path -> (mtime_ns, size, formatted text)
+        self.context_data = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            stats = scan_txt_files(self.directory)
+            changed7 = list(stats) != list(self.files)
+            files = {}
+            for txt_file, stat in stats.items():
+                cached = self.files.get(txt_file)
+                if cached is not None and cached[:2] == stat:
+                    files[txt_file] = cached
+                    continue
+                files[txt_file] = stat + (self.read_file(txt_file),)
+                changed7 = True
+            self.files = files
+
+            if changed7 or self.context_data is None:
+                self.context_data = "".join(text for _, _, text in files.values()).strip()
+            return self.context_data
+
+    @staticmethod
+    def read_file(txt_file):
+        filename = basename(txt_file)
+        with open(txt_file, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        return f"<{filename}>\n{content}\n</{filename}>\n\n"
+
+
+CONTEXT_CACHE = ContextCache(CONTEXT_TEXTS_DIR_PATH) if CONTEXT_TEXTS_DIR_PATH is not None else None
+
+
+def build_context_data(query=None):
+    """
+    Returns the context texts to add to a message.
+    With RETRIEVE_CONTEXT7, only the parts relevant to the query (the user's input) are returned.
+    """
     if CONTEXT_TEXTS_DIR_PATH is None:
         return None
     
     if not is_valid_path(CONTEXT_TEXTS_DIR_PATH):
         raise ValueError(f"Can't access the dir path {CONTEXT_TEXTS_DIR_PATH}")
     
-    txt_files_list = find_txt_files(CONTEXT_TEXTS_DIR_PATH)
-    if len(txt_files_list) == 0:
+    if RETRIEVE_CONTEXT7 and query is not None:
+        # Imported here, so the index module is only loaded when it's used
+        from utils.retrieval import get_context_index
+        return get_context_index().get_context(query)
+    
+    context_data = CONTEXT_CACHE.get()
+    if not context_data:
         print(f"No .txt files found in the dir path {CONTEXT_TEXTS_DIR_PATH}")
         return None
     
-    context_data = ""
-    for txt_file in txt_files_list:
-        filename = basename(txt_file)
-        with open(txt_file, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            context_data += f"<{filename}>\n{content}\n</{filename}>\n\n"
-    
-    return context_data.strip()
+    return context_data
     
-    
\ No newline at end of file
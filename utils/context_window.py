@@ -0,0 +1,150 @@
+from config import (
+    CONTEXT_WINDOW_TOKEN_BUDGET,
+    CONTEXT_WINDOW_TARGET_RATIO,
+    CONTEXT_WINDOW_KEEP_RECENT_MESSAGES,
+    IMAGE_OMITTED_PLACEHOLDER,
+)
+from utils.cost_manager import (
+    count_message_tokens, count_message_images_tokens, count_tokens, estimate_message_tokens, CHARS_PER_TOKEN,
+)
+
+# The conversations estimated under this part of the budget aren't tokenized
+ESTIMATE_SAFE_RATIO = 0.5
+
+
+def elide_images(message):
+    """Returns a copy of the message with its images replaced by a placeholder text (or the message, if it has none)."""
+    content = message["content"]
+    if not isinstance(content, list) or not any(item["type"] == "image" for item in content):
+        return message
+    elided_content = [
+        {"type": "text", "text": IMAGE_OMITTED_PLACEHOLDER} if item["type"] == "image" else item
+        for item in content
+    ]
+    return {**message, "content": elided_content}
+
+
+class ContextWindowManager:
+    """
+    Fits the conversation sent to the API into a token budget.
+
+    The first message (with the context texts) and the recent messages are always sent.
+    When the conversation is over the budget, the images of the older messages are replaced
+    with a placeholder, and then the oldest turns are dropped, until it's under the target
+    (a part of the budget). What was dropped stays dropped for the next calls, so the beginning
+    of the request stays the same for several turns, and the prompt cache keeps working.
+
+    The token weights of the messages are memoized on them (see count_message_tokens).
+    While the conversation is clearly under the budget by a rough estimate, nothing is tokenized.
+    If the tokenizer can't be loaded (e.g. offline), the estimates are used instead.
+    """
+
+    def __init__(self, token_budget=CONTEXT_WINDOW_TOKEN_BUDGET, keep_recent=CONTEXT_WINDOW_KEEP_RECENT_MESSAGES,
+                 target_ratio=CONTEXT_WINDOW_TARGET_RATIO):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.target_ratio = target_ratio
+        self.placeholder_tokens = None  # Tokenized on the first use, as loading the tokenizer takes a while
+        self.tokenizer_failed7 = False  # Not tried again for each message once it failed
+        self.reset()
+
+    def reset(self):
+        """Starts over for a new conversation."""
+        self.start = 1  # The first message sent after the first one
+        self.images_until = 1  # The images of the messages before this one are replaced
+
+    @staticmethod
+    def estimate_tokens(conversation):
+        """Returns a rough estimate of the tokens of the conversation, without tokenizing it."""
+        return sum(estimate_message_tokens(message) for message in conversation)
+
+    def count_message_tokens(self, message):
+        """Returns the (text tokens, image tokens) of the message, estimated if the tokenizer can't be loaded."""
+        if not self.tokenizer_failed7:
+            try:
+                return count_message_tokens(message)
+            except Exception as e:
+                print(f"Couldn't load the tokenizer, the token counts are estimated: {e}")
+                self.tokenizer_failed7 = True
+        image_tokens = count_message_images_tokens(message)
+        return estimate_message_tokens(message) - image_tokens, image_tokens
+
+    def get_placeholder_tokens(self):
+        if self.placeholder_tokens is None:
+            if self.tokenizer_failed7:
+                return len(IMAGE_OMITTED_PLACEHOLDER) / CHARS_PER_TOKEN
+            try:
+                self.placeholder_tokens = count_tokens(IMAGE_OMITTED_PLACEHOLDER)
+            except Exception:
+                self.tokenizer_failed7 = True
+                return len(IMAGE_OMITTED_PLACEHOLDER) / CHARS_PER_TOKEN
+        return self.placeholder_tokens
+
+    def get_weights(self, conversation):
+        """Returns (tokens, tokens with the images replaced) of each message."""
+        weights = []
+        for message in conversation:
+            text_tokens, image_tokens = self.count_message_tokens(message)
+            image_count = sum(1 for item in message.get("content", []) if item["type"] == "image")
+            placeholders_tokens = image_count * self.get_placeholder_tokens() if image_count else 0
+            weights.append((text_tokens + image_tokens, text_tokens + placeholders_tokens))
+        return weights
+
+    def get_total(self, weights):
+        total = weights[0][0]
+        for i in range(self.start, len(weights)):
+            total += weights[i][1] if i < self.images_until else weights[i][0]
+        return total
+
+    def fit(self, conversation_with_metadata, sanitized_conversation):
+        """
+        Returns the part of the sanitized conversation to send, and the report of the truncation
+        (None if the whole conversation is sent).
+
+        Args:
+            conversation_with_metadata (list): The messages with their metadata (e.g. the image sizes), to weigh them.
+            sanitized_conversation (list): The same messages, as they are sent.
+        """
+        count = len(sanitized_conversation)
+        if count == 0:
+            return sanitized_conversation, None
+        if self.start > count:
+            self.reset()  # The conversation was replaced with a shorter one
+        if (
+            self.start == 1 and self.images_until == 1
+            and self.estimate_tokens(conversation_with_metadata) < self.token_budget * ESTIMATE_SAFE_RATIO
+        ):
+            return sanitized_conversation, None
+
+        weights = self.get_weights(conversation_with_metadata)
+        recent_start = max(1, count - self.keep_recent)
+        if self.get_total(weights) > self.token_budget:
+            target = self.token_budget * self.target_ratio
+            self.images_until = max(self.images_until, recent_start)
+            # Drop whole turns (an assistant reply and the next user message), so the roles still alternate
+            while self.get_total(weights) > target and self.start + 2 <= recent_start:
+                self.start += 2
+
+        if self.start == 1 and self.images_until == 1:
+            return sanitized_conversation, None
+
+        window = [sanitized_conversation[0]]
+        elided_images = 0
+        for i in range(self.start, count):
+            message = sanitized_conversation[i]
+            if i < self.images_until:
+                elided_message = elide_images(message)
+                if elided_message is not message:
+                    elided_images += sum(1 for item in message["content"] if item["type"] == "image")
+                message = elided_message
+            window.append(message)
+
+        report = {
+            "dropped_messages": self.start - 1,
+            "elided_images": elided_images,
+            "estimated_tokens": int(self.get_total(weights)),
+            "token_budget": self.token_budget,
+        }
+        if report["dropped_messages"] == 0 and elided_images == 0:
+            return window, None
+        return window, report
@@ -1,18 +1,34 @@
+import os
 import threading
 from datetime import datetime
 
-from config import THINKING_PLACEHOLDER
-from utils.chat_logs import save_conversation_to_text_file
+from config import (
+    THINKING_PLACEHOLDER, JOURNAL_FSYNC_BATCH, STORE_CONVERSATIONS_IN_DB7, CONVERSATIONS_DB_FILENAME, RETRIEVE_CONTEXT7,
+    COMPACT_CONVERSATIONS7,
+)
+from utils.chat_logs import ConversationJournal
+from utils.conversation_store import get_store, StoredConversation
+from utils.persistence_writer import PersistenceWriter
+from utils.context_window import ContextWindowManager
+from utils.compaction import ConversationCompactor
 from utils.messages import prepare_user_message
 from utils.messages import extract_message_text, process_assistant_response
 
 
 class ConversationManager:
-    def __init__(self, save_directory="conversations", save_filename=None):
+    def __init__(self, save_directory="conversations", save_filename=None, mock7=False):
         self.conversation = []
+        self.mock7 = mock7  # Use the fake AI provider instead of the API
         self.conversation_lock = threading.Lock()
         self.save_directory = save_directory
         self.first_message7 = True
+        self.context_window = ContextWindowManager()  # Fits the requests into the token budget
+        self.compactor = ConversationCompactor(mock7=mock7)  # Summarizes the older messages
+        self.sent_summary = None  # The summary sent with the last request
+        self.writer = PersistenceWriter()  # Writes the journal in a background thread
+        self.store = None
+        if STORE_CONVERSATIONS_IN_DB7:
+            self.store = get_store(os.path.join(save_directory, CONVERSATIONS_DB_FILENAME))
 
         # Generate a unique filename if not provided
         if save_filename is None:
@@ -20,10 +36,64 @@ class ConversationManager:
             self.save_filename = f"conversation_{timestamp}.txt"
         else:
             self.save_filename = save_filename
+        self.journal = self.create_journal()
+
+    def create_journal(self):
+        """
+        The conversation is saved to the SQLite store (or to a .jsonl journal),
+        and rendered to the .txt file on demand.
+        """
+        name = os.path.splitext(self.save_filename)[0]
+        if self.store is not None:
+            return StoredConversation(self.store, name)
+        return ConversationJournal(
+            self.save_directory, name + ".jsonl", fsync_batch=JOURNAL_FSYNC_BATCH
+        )
+
+    def get_conversation_id(self):
+        """The name of the conversation in the store, its log files and the usage ledger."""
+        with self.conversation_lock:
+            return os.path.splitext(self.save_filename)[0]
+
+    def list_conversations(self, limit=100, offset=0):
+        """Returns the saved conversations, the most recently updated first (empty without the store)."""
+        if self.store is None:
+            return []
+        return self.store.list_conversations(limit=limit, offset=offset)
+
+    def search_conversations(self, query, limit=20):
+        """Full-text search over the messages of all the saved conversations (see ConversationStore.search)."""
+        if self.store is None:
+            return []
+        return self.store.search(query, limit=limit)
+
+    def open_conversation(self, name):
+        """
+        Continues a conversation from the store. The current one is finished first.
+
+        Returns:
+            bool: False if there is no such conversation.
+        """
+        if self.store is None:
+            return False
+        conversation = self.store.load_conversation(name)
+        if not conversation:
+            return False
+        self.finish_conversation()
+        with self.conversation_lock:
+            self.conversation[:] = conversation
+            self.save_filename = f"{name}.txt"
+            self.journal = self.create_journal()
+            self.journal.prime(self.conversation)
+            self.first_message7 = False
+            self.context_window.reset()
+            self.compactor.reset()
+        return True
 
     def add_user_message(self, user_input):
         # Prepare the user's message
-        include_context7 = self.first_message7
+        # The retrieved context is relevant to a single message, so each one gets its own
+        include_context7 = self.first_message7 or RETRIEVE_CONTEXT7
         user_message = prepare_user_message(
             user_input, include_additional_context7=include_context7
         )
@@ -31,9 +101,9 @@ class ConversationManager:
             self.conversation.append(user_message)
             thinking_content = [{"type": "text", "text": THINKING_PLACEHOLDER}]
             self.conversation.append({"role": "assistant", "content": thinking_content})
-            # Save the conversation after adding the user's message
-            self.save_conversation(self.save_directory, self.save_filename)
             self.first_message7 = False
+        # Save the conversation after adding the user's message
+        self.save_conversation()
 
     def remove_thinking_placeholder(self):
         with self.conversation_lock:
@@ -44,11 +114,29 @@ class ConversationManager:
             ):
                 self.conversation.pop()
 
-    def process_assistant_response(self):
+    def process_assistant_response(self, on_text_delta=None):
+        """
+        Args:
+            on_text_delta (callable, optional): If given, the response is streamed,
+                and the callback is called with the growing assistant message after each delta.
+        """
+        summary = self.compactor.get_summary() if COMPACT_CONVERSATIONS7 else None
+        if summary is not self.sent_summary:
+            # The messages are indexed differently with the new summary
+            self.context_window.reset()
+            self.sent_summary = summary
+
         # Process the assistant's response (this modifies self.conversation in place)
-        process_assistant_response(self.conversation)
+        conversation_id = self.get_conversation_id()
+        process_assistant_response(
+            self.conversation, on_text_delta=on_text_delta, mock7=self.mock7,
+            conversation_id=conversation_id, context_window=self.context_window, summary=summary,
+        )
         # Save the conversation after the assistant's response
-        self.save_conversation(self.save_directory, self.save_filename)
+        self.save_conversation()
+
+        if COMPACT_CONVERSATIONS7:
+            self.compactor.maybe_start(self.get_snapshot(), conversation_id=conversation_id)
 
     """
     def add_image_message(self, image_path, input_text):
@@ -60,20 +148,44 @@ class ConversationManager:
             print(f"Error attaching image: {e}")
     """
 
-    def save_conversation(self, directory, filename):
-        """
-        Save the current conversation to a text file.
+    def get_snapshot(self):
+        """Returns a new list of the messages, safe to hand to another thread."""
+        with self.conversation_lock:
+            return list(self.conversation)
 
-        Args:
-            directory (str): The path to the directory where the file will be saved.
-            filename (str): The name of the file.
+    def save_conversation(self):
         """
-        save_conversation_to_text_file(self.conversation, directory, filename)
+        Queues the save of the conversation. The new or changed messages are appended
+        to the journal in the background (see PersistenceWriter), so the caller never waits for the disk.
+        """
+        self.writer.save(self.journal, self.get_snapshot())
+
+    def finish_conversation(self):
+        """Queues the last save of the current conversation: the journal is compacted and the .txt is written."""
+        with self.conversation_lock:
+            snapshot = list(self.conversation)
+            journal = self.journal
+            filename = self.save_filename
+        self.writer.finish(journal, snapshot, self.save_directory, filename)
+
+    def flush(self, timeout=None):
+        """Waits until the queued saves are written."""
+        return self.writer.flush(timeout)
+
+    def close(self):
+        """Writes the pending saves and the .txt export, and stops the writer (e.g. on exit)."""
+        self.finish_conversation()
+        self.writer.close()
 
     def reset_conversation(self):
+        # The old conversation is finished in the background, the new one starts at once
+        self.finish_conversation()
         with self.conversation_lock:
             self.conversation.clear()
             # Generate a new unique filename for the new conversation
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             self.save_filename = f"conversation_{timestamp}.txt"
+            self.journal = self.create_journal()
             self.first_message7 = True
+            self.context_window.reset()
+            self.compactor.reset()
@@ -0,0 +1,464 @@
+"""
+The SQLite store of the conversations.
+
+Each conversation is a row of the conversations table, with the totals needed to list it
+(title, number of messages, tokens, cost), so listing doesn't touch the messages.
+The messages are saved incrementally: only the new or changed ones are written on each save.
+
+Migrating the old logs:
+    python -m utils.conversation_store conversations
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from utils.chat_logs import count_unchanged_messages, read_journal, get_persistent_form, serialize_message
+from utils.messages import extract_message_text_without_context
+
+TITLE_LENGTH = 80
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    total_cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at);
+"""
+
+MESSAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cost_usd REAL,
+    UNIQUE (conversation_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+"""
+
+# The full-text index of the messages. Kept in sync with the messages table by the triggers.
+# Its rows are matched to the messages by their id: the implicit rowid may change on VACUUM
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='4'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+# The version of the schema in PRAGMA user_version:
+# 1 - the full-text index, 2 - the id of the messages (the index is rebuilt on it)
+SEARCH_SCHEMA_VERSION = 2
+
+# Adds the id to the messages table of the stores created before it had one.
+# The full-text index is dropped with the old table, and rebuilt by create_search_index
+MESSAGE_IDS_MIGRATION = """
+BEGIN;
+DROP TRIGGER IF EXISTS messages_fts_insert;
+DROP TRIGGER IF EXISTS messages_fts_delete;
+DROP TABLE IF EXISTS messages_fts;
+ALTER TABLE messages RENAME TO messages_old;
+DROP INDEX IF EXISTS idx_messages_timestamp;
+""" + MESSAGES_SCHEMA + """
+INSERT INTO messages (conversation_id, position, role, content, metadata, text, timestamp,
+                      input_tokens, output_tokens, cost_usd)
+    SELECT conversation_id, position, role, content, metadata, text, timestamp, input_tokens, output_tokens, cost_usd
+    FROM messages_old ORDER BY conversation_id, position;
+DROP TABLE messages_old;
+COMMIT;
+"""
+
+MIN_PREFIX_LENGTH = 4  # The prefix index of the messages_fts table
+SNIPPET_TOKENS = 12
+SNIPPET_MARKERS = ("[", "]")
+
+# The keys of the input token counts in the cost_info of a message (see calculate_api_call_cost)
+INPUT_TOKEN_KEYS = ("input_text_tokens", "input_image_tokens", "cache_write_tokens", "cache_read_tokens")
+
+
+def get_message_usage(message):
+    """
+    Returns (input tokens, output tokens, cost in USD) of the API call that produced the message, if known.
+    The input tokens include the ones written to and read from the prompt cache.
+    """
+    cost_info = message.get("cost_info")
+    if not cost_info:
+        return None, None, None
+    input_tokens = int(sum(cost_info.get(key, 0) for key in INPUT_TOKEN_KEYS))
+    return input_tokens, cost_info.get("output_text_tokens"), cost_info.get("total_cost_usd")
+
+
+class ConversationStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Used by the persistence writer and the GUI thread, so every access takes the lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA foreign_keys=ON")
+            self.connection.executescript(SCHEMA)
+            self.add_message_ids()
+            self.connection.executescript(MESSAGES_SCHEMA)
+        self.search7 = self.create_search_index()
+
+    def add_message_ids(self):
+        """Migrates the messages table of a store created before the messages had an id (see SEARCH_SCHEMA)."""
+        columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(messages)")]
+        if not columns or "id" in columns:
+            return  # A new store, or an up-to-date one
+        self.connection.executescript(MESSAGE_IDS_MIGRATION)
+
+    def create_search_index(self):
+        """Creates the full-text index (indexing the existing messages once). False if FTS5 is not available."""
+        with self.lock:
+            try:
+                version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+                self.connection.executescript(SEARCH_SCHEMA)
+                if version < SEARCH_SCHEMA_VERSION:
+                    with self.connection:
+                        self.connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+                        self.connection.execute(f"PRAGMA user_version = {SEARCH_SCHEMA_VERSION}")
+            except sqlite3.OperationalError as e:
+                print(f"Full-text search is not available, falling back to substring search: {e}")
+                return False
+        return True
+
+    def get_conversation_id(self, name, created_at=None):
+        """Returns the id of the conversation, and creates it if needed."""
+        with self.lock, self.connection:
+            return self._get_conversation_id(name, created_at)
+
+    def _get_conversation_id(self, name, created_at=None):
+        row = self.connection.execute("SELECT id FROM conversations WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return row["id"]
+        now = created_at or time.time()
+        cursor = self.connection.execute(
+            "INSERT INTO conversations (name, created_at, updated_at) VALUES (?, ?, ?)", (name, now, now)
+        )
+        return cursor.lastrowid
+
+    def save_messages(self, name, start, messages, timestamp=None):
+        """
+        Replaces the messages of the conversation from the start position on with the given ones,
+        and updates the totals of the conversation. Done in one transaction.
+        """
+        now = timestamp or time.time()
+        rows = []
+        for position, message in enumerate(messages, start=start):
+            message = get_persistent_form(message)
+            metadata = {key: value for key, value in message.items() if key not in ["role", "content"]}
+            rows.append((
+                position,
+                message["role"],
+                json.dumps(message["content"], ensure_ascii=False),
+                json.dumps(metadata, ensure_ascii=False) if metadata else None,
+                # Only the text typed by the user is searched and used as the title, not the context texts
+                extract_message_text_without_context(message),
+                message.get("timestamp", now),
+                *get_message_usage(message),
+            ))
+
+        with self.lock, self.connection:
+            conversation_id = self._get_conversation_id(name)
+            self.connection.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND position >= ?", (conversation_id, start)
+            )
+            self.connection.executemany(
+                "INSERT INTO messages (conversation_id, position, role, content, metadata, text, timestamp,"
+                " input_tokens, output_tokens, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(conversation_id, *row) for row in rows],
+            )
+            self.connection.execute(
+                """
+                UPDATE conversations SET
+                    updated_at = :now,
+                    title = COALESCE((SELECT substr(text, 1, :title_length) FROM messages
+                                      WHERE conversation_id = :id AND role = 'user' ORDER BY position LIMIT 1), ''),
+                    message_count = (SELECT COUNT(*) FROM messages WHERE conversation_id = :id),
+                    total_tokens = (SELECT COALESCE(SUM(COALESCE(input_tokens, 0) + COALESCE(output_tokens, 0)), 0)
+                                    FROM messages WHERE conversation_id = :id),
+                    total_cost_usd = (SELECT COALESCE(SUM(cost_usd), 0) FROM messages WHERE conversation_id = :id)
+                WHERE id = :id
+                """,
+                {"now": now, "title_length": TITLE_LENGTH, "id": conversation_id},
+            )
+            return conversation_id
+
+    def list_conversations(self, limit=100, offset=0):
+        """Returns the conversations (without their messages), the most recently updated first."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM conversations WHERE message_count > 0 ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load_conversation(self, name):
+        """Returns the messages of the conversation, as they were saved (None if there is no such conversation)."""
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM conversations WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            rows = self.connection.execute(
+                "SELECT role, content, metadata FROM messages WHERE conversation_id = ? ORDER BY position",
+                (row["id"],),
+            ).fetchall()
+
+        conversation = []
+        for row in rows:
+            message = {"role": row["role"], "content": json.loads(row["content"])}
+            if row["metadata"]:
+                message.update(json.loads(row["metadata"]))
+            conversation.append(message)
+        return conversation
+
+    def search(self, query, limit=20):
+        """
+        Searches the messages of all the conversations, the best matches first.
+
+        Args:
+            query (str): Keywords (all must match, the last one can be incomplete)
+                and "quoted phrases".
+
+        Returns:
+            list: dicts with the name and the title of the conversation, and the position, the role,
+                the timestamp and a snippet of the message (the matches are in SNIPPET_MARKERS).
+        """
+        if not self.search7:
+            return self.search_substring(query, limit)
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT c.name, c.title, m.position, m.role, m.timestamp,
+                       snippet(messages_fts, 0, ?, ?, '...', ?) AS snippet
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE messages_fts MATCH ?
+                ORDER BY bm25(messages_fts)
+                LIMIT ?
+                """,
+                (*SNIPPET_MARKERS, SNIPPET_TOKENS, fts_query, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search_substring(self, query, limit=20):
+        """The search without FTS5: the messages that contain the query, the most recent first."""
+        query = query.strip()
+        if not query:
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT c.name, c.title, m.position, m.role, m.timestamp, m.text
+                FROM messages m JOIN conversations c ON c.id = m.conversation_id
+                WHERE instr(lower(m.text), lower(?)) > 0
+                ORDER BY m.timestamp DESC
+                LIMIT ?
+                """,
+                (query, limit),
+            ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            text = result.pop("text")
+            start = text.lower().find(query.lower())
+            result["snippet"] = "..." + text[max(start - 40, 0):start + len(query) + 40] + "..."
+            results.append(result)
+        return results
+
+    def has_conversation(self, name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT message_count FROM conversations WHERE name = ?", (name,)
+            ).fetchone()
+        return row is not None and row["message_count"] > 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def build_fts_query(query):
+    """
+    Turns the text typed by the user into an FTS5 query: every keyword and "phrase" is quoted,
+    so the FTS5 operators and punctuation are taken literally.
+    The last keyword is matched as a prefix (if it's long enough for the prefix index).
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        text = (phrase or word).replace('"', "")
+        if text.strip():
+            terms.append((f'"{text}"', bool(word)))
+    if not terms:
+        return ""
+    last_term, last_is_word7 = terms[-1]
+    if last_is_word7 and not query.endswith(" ") and len(last_term) - 2 >= MIN_PREFIX_LENGTH:
+        terms[-1] = (last_term + "*", True)
+    return " ".join(term for term, _ in terms)
+
+
+class StoredConversation:
+    """
+    One conversation in the store. Has the interface of ConversationJournal,
+    so the PersistenceWriter can save to either.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.saved = []  # (message, serialized message) for each saved message
+
+    def prime(self, conversation):
+        """Marks the messages as saved (e.g. after loading the conversation from the store)."""
+        self.saved = [(message, serialize_message(message)) for message in conversation]
+
+    def sync(self, conversation):
+        """Writes the new or changed messages of the conversation."""
+        start = count_unchanged_messages(self.saved, conversation)
+        if start == len(self.saved) == len(conversation):
+            return
+        del self.saved[start:]
+        new_messages = conversation[start:]
+        self.store.save_messages(self.name, start, new_messages)
+        self.saved.extend((message, serialize_message(message)) for message in new_messages)
+
+    def compact(self):
+        pass  # Nothing to compact, the rows are replaced in place
+
+    def flush(self, fsync7=False):
+        pass  # Every sync is a committed transaction
+
+    def close(self):
+        pass  # The connection is shared by all the conversations of the store
+
+    def get_conversation(self):
+        return [message for message, _ in self.saved]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path):
+    """Returns the store of the database file, shared by the whole app."""
+    db_path = os.path.abspath(db_path)
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = ConversationStore(db_path)
+            _stores[db_path] = store
+    return store
+
+
+"""
+Migration of the logs written before the store existed.
+"""
+
+TEXT_LOG_DIVIDER = "\n\n############################################################\n\n"
+TEXT_LOG_HEADER = re.compile(r"^(User|Assistant) \[(\d+(?:\.\d+)?)\]:\n")
+
+
+def parse_text_log(file_path):
+    """
+    Reads a .txt log (see save_conversation_to_text_file) back into messages.
+    Only the text survives: the images and the metadata were not written to the logs.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        log_text = file.read()
+
+    conversation = []
+    for chunk in log_text.split(TEXT_LOG_DIVIDER):
+        match = TEXT_LOG_HEADER.match(chunk)
+        if match is None:
+            if conversation and chunk.strip():
+                # A divider inside a message, so this is still its text
+                conversation[-1]["content"][0]["text"] += TEXT_LOG_DIVIDER + chunk
+            continue
+        conversation.append({
+            "role": match.group(1).lower(),
+            "content": [{"type": "text", "text": chunk[match.end():]}],
+            "timestamp": float(match.group(2)),
+        })
+    return conversation
+
+
+def migrate_logs(directory, store):
+    """
+    Imports the .jsonl journals and the .txt logs of the directory that are not in the store yet.
+    A journal is preferred over the .txt log of the same conversation, as it keeps the whole messages.
+
+    Returns:
+        int: The number of imported conversations.
+    """
+    names = {}
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension == ".jsonl" or (extension == ".txt" and name not in names):
+            names[name] = os.path.join(directory, filename)
+
+    imported_count = 0
+    for name, file_path in names.items():
+        if store.has_conversation(name):
+            continue
+        try:
+            if file_path.endswith(".jsonl"):
+                conversation = read_journal(file_path)
+            else:
+                conversation = parse_text_log(file_path)
+        except (OSError, UnicodeDecodeError, ValueError, KeyError) as e:
+            print(f"Skipping {file_path}: {e}")
+            continue
+        if not conversation:
+            continue
+        created_at = conversation[0].get("timestamp") or os.path.getmtime(file_path)
+        store.get_conversation_id(name, created_at=created_at)
+        store.save_messages(name, 0, conversation, timestamp=os.path.getmtime(file_path))
+        imported_count += 1
+    return imported_count
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Imports the old conversation logs into the SQLite store.")
+    argparser.add_argument("directory", nargs="?", default="conversations")
+    argparser.add_argument("--db", default=None, help="defaults to conversations.db in the directory")
+    args = argparser.parse_args()
+
+    db_path = args.db or os.path.join(args.directory, "conversations.db")
+    store = get_store(db_path)
+    imported_count = migrate_logs(args.directory, store)
+    print(f"Imported {imported_count} conversations into {db_path}")
+
+
+if __name__ == "__main__":
+    main()
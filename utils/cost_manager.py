@@ -3,39 +3,129 @@ from config import (
     input_text_cost_mtok_usd,
     output_text_cost_mtok_usd,
     image_cost_denominator,
+    cache_write_cost_multiplier,
+    cache_read_cost_multiplier,
 )
+import argparse
+import json
 import os
+import threading
 from datetime import datetime
 
+from utils.usage_ledger import UsageLedger
+
 
 class CostManager:
     """
     A class to manage and track the costs of API calls.
-    It logs each call's cost with a timestamp to a text file and can compute
-    the total cost since the start of the current month.
+    It records each call to the usage ledger (see UsageLedger), and keeps
+    the total cost of the current month in memory. The totals shown by the app come from the ledger.
+
+    Each call's cost is also still logged with a timestamp to a text file, for the tools that read it.
+    The totals per month of that log are kept in an aggregate file next to it, together with
+    the byte offset of the log up to which they are counted. So each update only parses
+    the lines appended since the last one. If the log is edited by hand, rebuild the aggregate:
+        python -m utils.cost_manager --rebuild
     """
 
-    LOG_FILE_PATH = 'api_costs.log'  # You can change this path as needed
+    LOG_FILE_PATH = 'api_costs.log'  # You can change this path as needed. The ledger is created next to it
+    AGGREGATE_SUFFIX = '.aggregate.json'
 
     def __init__(self, log_file_path=None):
         if log_file_path:
             self.LOG_FILE_PATH = log_file_path
+        self.aggregate_file_path = self.LOG_FILE_PATH + self.AGGREGATE_SUFFIX
         # Ensure the log file exists
         if not os.path.exists(self.LOG_FILE_PATH):
             with open(self.LOG_FILE_PATH, 'w') as f:
                 pass  # Create the file if it doesn't exist
+        self.lock = threading.Lock()
+        self.offset = 0  # The bytes of the log counted in monthly_costs
+        self.monthly_costs = {}  # "YYYY-MM" -> total cost in USD
+        self.load_aggregate()
+
+        # The structured log of the calls, next to this one (see UsageLedger)
+        ledger_file_path = os.path.join(os.path.dirname(self.LOG_FILE_PATH), UsageLedger.LEDGER_FILE_PATH)
+        self.ledger = UsageLedger(ledger_file_path, legacy_log_file_path=self.LOG_FILE_PATH)
+
+        # The running total of the current month, kept in memory (see get_total_cost)
+        self.total_month = None
+        self.total_cost = 0.0
+        self.subscribers = []
 
-    def log_call(self, cost):
+    def subscribe(self, callback):
         """
-        Logs the cost of an API call to the log file with the current timestamp.
+        Registers a callback, called with the new total cost of the month after each logged call.
+        It's called from the thread that logged the call, so GUI callbacks must pass the update to the main thread.
+        """
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def get_total_cost(self):
+        """
+        Returns the total cost of the current month in USD, from memory.
+        Only the first call (and the first one of each month) reads the rollups of the ledger.
+        """
+        month = datetime.utcnow().strftime("%Y-%m")
+        if self.total_month != month:
+            total_cost = self.ledger.get_monthly_cost(month)
+            with self.lock:
+                self.total_month = month
+                self.total_cost = total_cost
+        return self.total_cost
+
+    def add_to_total_cost(self, cost):
+        """
+        Adds the cost of a logged call to the running total, and notifies the subscribers.
+        The month must be started (see get_total_cost) before the call is recorded in the ledger,
+        otherwise the loaded total would already include it.
+        """
+        with self.lock:
+            self.total_cost += cost
+            total_cost = self.total_cost
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(total_cost)
+            except Exception as e:
+                print(f"Exception in a CostManager subscriber: {e}")
+
+    def log_call(self, cost, cost_info=None, conversation_id=None, model=None):
+        """
+        Logs the cost of an API call to the log file with the current timestamp,
+        records its usage to the ledger, and adds it to the total of the month.
 
         Args:
             cost (float): The cost of the API call in USD.
+            cost_info (dict, optional): The breakdown from calculate_api_call_cost, for the token counts.
+            conversation_id (str, optional): The conversation the call was made for.
+            model (str, optional): The model that was called.
         """
+        # Starts the month (loads its total) before the call is in the ledger, so it's counted once
+        self.get_total_cost()
+
         timestamp = datetime.utcnow().isoformat()
         with open(self.LOG_FILE_PATH, 'a') as f:
             f.write(f"{timestamp},{cost}\n")
 
+        cost_info = cost_info or {}
+        self.ledger.record(
+            cost,
+            conversation_id=conversation_id,
+            model=model,
+            input_tokens=cost_info.get("input_text_tokens", 0),
+            output_tokens=cost_info.get("output_text_tokens", 0),
+            image_tokens=cost_info.get("input_image_tokens", 0),
+            cache_write_tokens=cost_info.get("cache_write_tokens", 0),
+            cache_read_tokens=cost_info.get("cache_read_tokens", 0),
+        )
+        self.add_to_total_cost(cost)
+
     def get_monthly_cost(self):
         """
         Calculates the total cost of API calls since the start of the current month.
@@ -43,29 +133,153 @@ class CostManager:
         Returns:
             float: Total cost in USD since the start of the month.
         """
-        total_cost = 0.0
-        now = datetime.utcnow()
-        month_start = datetime(now.year, now.month, 1)
-        with open(self.LOG_FILE_PATH, 'r') as f:
-            for line in f:
+        self.update_aggregate()
+        month_key = datetime.utcnow().strftime("%Y-%m")
+        return self.monthly_costs.get(month_key, 0.0)
+
+    def load_aggregate(self):
+        try:
+            with open(self.aggregate_file_path, 'r') as f:
+                aggregate = json.load(f)
+            self.offset = int(aggregate["offset"])
+            self.monthly_costs = {month: float(cost) for month, cost in aggregate["monthly_costs"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # No aggregate yet, or a broken one: count the whole log
+            self.offset = 0
+            self.monthly_costs = {}
+
+    def save_aggregate(self):
+        aggregate = {"offset": self.offset, "monthly_costs": self.monthly_costs}
+        temp_path = self.aggregate_file_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(aggregate, f)
+        os.replace(temp_path, self.aggregate_file_path)
+
+    def update_aggregate(self):
+        """Adds the lines appended to the log since the last update to the monthly totals."""
+        with self.lock:
+            log_size = os.path.getsize(self.LOG_FILE_PATH)
+            if log_size < self.offset:
+                # The log was truncated or replaced
+                self.offset = 0
+                self.monthly_costs = {}
+            if log_size == self.offset:
+                return
+
+            with open(self.LOG_FILE_PATH, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+            # A line that is still being written is left for the next update
+            complete_size = data.rfind(b'\n') + 1
+            if complete_size == 0:
+                return
+            for line in data[:complete_size].decode('utf-8', errors='replace').splitlines():
                 try:
                     timestamp_str, cost_str = line.strip().split(',')
                     timestamp = datetime.fromisoformat(timestamp_str)
                     cost = float(cost_str)
-                    if timestamp >= month_start:
-                        total_cost += cost
                 except ValueError:
                     # Skip lines that don't have the correct format
                     continue
-        return total_cost
+                month_key = timestamp.strftime("%Y-%m")
+                self.monthly_costs[month_key] = self.monthly_costs.get(month_key, 0.0) + cost
+            self.offset += complete_size
+            self.save_aggregate()
+
+    def rebuild_aggregate(self):
+        """Recounts the monthly totals from the whole log (e.g. after editing it by hand)."""
+        with self.lock:
+            self.offset = 0
+            self.monthly_costs = {}
+        self.update_aggregate()
+
+
+# Created on the first use, as loading the encoding takes a while
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+# The key of the memoized token count of a message. Keys starting with "_" are never sent or saved
+TOKEN_COUNT_KEY = "_token_count"
+
+CHARS_PER_TOKEN = 4  # A rough estimate, to weigh the messages without tokenizing them
 
 
-def calculate_api_call_cost(conversation, assistant_message):
+def get_tokenizer():
+    """Returns the tokenizer used to estimate the token counts ('cl100k_base', an approximation for Claude models)."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return _tokenizer
+
+
+def count_tokens(text):
+    return len(get_tokenizer().encode(text))
+
+
+def count_message_images_tokens(message):
+    """Returns the estimated tokens of the images of the message (no tokenizing)."""
+    image_tokens = 0
+    for item in message.get("content", []):
+        if item["type"] == "image":
+            # Calculate image tokens
+            width = item.get("width", 0)
+            height = item.get("height", 0)
+            if width > 0 and height > 0:
+                image_tokens += (width * height) / image_cost_denominator
+    return image_tokens
+
+
+def estimate_message_tokens(message):
+    """Returns a rough estimate of the tokens of the message (texts and images), without tokenizing it."""
+    text_chars = sum(len(item["text"]) for item in message.get("content", []) if item["type"] == "text")
+    return text_chars / CHARS_PER_TOKEN + count_message_images_tokens(message)
+
+
+def count_message_tokens(message):
+    """
+    Returns the estimated (text tokens, image tokens) of the message.
+
+    The text token count is memoized on the message, with a key of its texts,
+    so each message is tokenized only once (and again only if its text changes).
+    """
+    texts = [item["text"] for item in message.get("content", []) if item["type"] == "text"]
+    image_tokens = count_message_images_tokens(message)
+
+    key = hash(tuple(texts))
+    memo = message.get(TOKEN_COUNT_KEY)
+    if memo is not None and memo[0] == key:
+        text_tokens = memo[1]
+    else:
+        text_tokens = sum(count_tokens(text) for text in texts)
+        message[TOKEN_COUNT_KEY] = (key, text_tokens)
+    return text_tokens, image_tokens
+
+
+_cost_manager = None
+_cost_manager_lock = threading.Lock()
+
+
+def get_cost_manager():
+    """Returns the CostManager shared by the whole app, so the costs are counted once, in one place."""
+    global _cost_manager
+    if _cost_manager is None:
+        with _cost_manager_lock:
+            if _cost_manager is None:
+                _cost_manager = CostManager()
+    return _cost_manager
+
+
+def calculate_api_call_cost(conversation, assistant_message, usage=None):
     """
     Calculate the cost of the API request given the conversation and assistant's reply.
 
-    The cost is calculated based on the number of tokens in the input and output text,
-    and the dimensions of any images in the input.
+    If the usage reported by the API is given (a dict with "input_tokens" and "output_tokens",
+    and optionally "cache_write_tokens" and "cache_read_tokens" of prompt caching),
+    the cost is calculated from it (its input tokens are all reported as text, images included).
+    Otherwise, it's estimated from the number of tokens
+    in the input and output text, and the dimensions of any images in the input.
 
     Returns a dictionary with the cost breakdown and total cost in USD.
     """
@@ -74,46 +288,66 @@ def calculate_api_call_cost(conversation, assistant_message):
     input_text_tokens = 0
     input_image_tokens = 0
     output_text_tokens = 0
+    cache_write_tokens = 0
+    cache_read_tokens = 0
 
-    # Create tokenizer (assuming 'cl100k_base' for Claude models)
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-
-    # Helper function to count tokens in text
-    def count_tokens(text):
-        tokens = tokenizer.encode(text)
-        return len(tokens)
-
-    # Process input messages
-    for message in conversation:
-        content = message.get("content", [])
-        for item in content:
-            if item["type"] == "text":
-                text = item["text"]
-                input_text_tokens += count_tokens(text)
-            elif item["type"] == "image":
-                # Calculate image tokens
-                width = item.get("width", 0)
-                height = item.get("height", 0)
-                if width > 0 and height > 0:
-                    tokens = (width * height) / image_cost_denominator
-                    input_image_tokens += tokens
-
-    # Process assistant's reply
-    output_text_tokens += count_tokens(assistant_message)
+    if usage is not None:
+        # The reported input tokens include the images, and the API doesn't tell them apart.
+        # The conversation may hold images that weren't sent (elided, summarized or missing),
+        # so they aren't estimated from it: all the input is counted as text, which is priced the same
+        input_text_tokens = usage["input_tokens"]
+        output_text_tokens = usage["output_tokens"]
+        cache_write_tokens = usage.get("cache_write_tokens", 0)
+        cache_read_tokens = usage.get("cache_read_tokens", 0)
+    else:
+        # Process input messages
+        for message in conversation:
+            text_tokens, image_tokens = count_message_tokens(message)
+            input_text_tokens += text_tokens
+            input_image_tokens += image_tokens
+
+        # Process assistant's reply
+        output_text_tokens += count_tokens(assistant_message)
 
     # Calculate costs in USD
     input_text_cost = (input_text_tokens / 1e6) * input_text_cost_mtok_usd
     input_image_cost = (input_image_tokens / 1e6) * input_text_cost_mtok_usd
     output_text_cost = (output_text_tokens / 1e6) * output_text_cost_mtok_usd
-    total_cost = input_text_cost + input_image_cost + output_text_cost
+    cache_write_cost = (cache_write_tokens / 1e6) * input_text_cost_mtok_usd * cache_write_cost_multiplier
+    cache_read_cost = (cache_read_tokens / 1e6) * input_text_cost_mtok_usd * cache_read_cost_multiplier
+    total_cost = input_text_cost + input_image_cost + output_text_cost + cache_write_cost + cache_read_cost
 
     # Return the cost breakdown
     return {
         "input_text_tokens": input_text_tokens,
         "input_image_tokens": input_image_tokens,
         "output_text_tokens": output_text_tokens,
+        "cache_write_tokens": cache_write_tokens,
+        "cache_read_tokens": cache_read_tokens,
         "input_text_cost_usd": input_text_cost,
         "input_image_cost_usd": input_image_cost,
         "output_text_cost_usd": output_text_cost,
+        "cache_write_cost_usd": cache_write_cost,
+        "cache_read_cost_usd": cache_read_cost,
         "total_cost_usd": total_cost,
-    }
\ No newline at end of file
+        "reported7": usage is not None,  # False if the token counts are estimated
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Maintenance of the API costs log.")
+    argparser.add_argument("--rebuild", action="store_true", help="recount the monthly totals from the whole log")
+    argparser.add_argument("--log", default=None, help=f"defaults to {CostManager.LOG_FILE_PATH}")
+    args = argparser.parse_args()
+
+    cost_manager = CostManager(args.log)
+    if args.rebuild:
+        cost_manager.rebuild_aggregate()
+    else:
+        cost_manager.update_aggregate()
+    for month, cost in sorted(cost_manager.monthly_costs.items()):
+        print(f"{month}: ${cost:.5f}")
+
+
+if __name__ == "__main__":
+    main()
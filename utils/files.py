@@ -21,6 +21,45 @@ def find_txt_files(directory):
     return txt_files
 
 
+def has_txt_files(directory):
+    """Returns True if the directory or its subdirectories contain a .txt file. Stops at the first one."""
+    for _, _, files in os.walk(directory):
+        if any(file.endswith('.txt') for file in files):
+            return True
+    return False
+
+
+def scan_txt_files(directory):
+    """
+    Recursively lists the .txt files with their modification time and size, without reading them.
+
+    Returns:
+        dict: path -> (mtime_ns, size), in the order of find_txt_files
+    """
+    txt_files = {}
+    directories = [directory]
+    while directories:
+        root = directories.pop(0)
+        subdirectories = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        # Like os.walk, the symlinks to dirs aren't followed (a link loop would never end)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.name.endswith('.txt'):
+                            stat = entry.stat()
+                            txt_files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError as e:
+                        # E.g. a broken symlink: only this entry is skipped
+                        print(f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            print(f"Error listing the dir {root}: {e}")
+        directories = subdirectories + directories
+    return txt_files
+
+
 def is_valid_path(path):
     try:
         res = os.path.exists(path)
@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import mmap
+import os
+import threading
+from functools import lru_cache
+
+from config import IMAGE_STORE_DIR_PATH, IMAGE_BASE64_CACHE_SIZE
+
+
+class ImageStore:
+    """
+    The encoded images, stored once on disk and addressed by the SHA-256 of their bytes.
+
+    The messages keep only the digest of an image (see make_image_element). The base64 string
+    sent to the API is made from the file only when a request is built, so the images don't stay
+    in memory for the whole session. Adding the same image again stores nothing new.
+    """
+
+    EXTENSION = ".jpg"
+
+    def __init__(self, directory=IMAGE_STORE_DIR_PATH):
+        self.directory = directory
+
+    def get_path(self, digest):
+        # Grouped by the first two hex digits, so no dir gets too many files
+        return os.path.join(self.directory, digest[:2], digest + self.EXTENSION)
+
+    def has_image(self, digest):
+        return os.path.exists(self.get_path(digest))
+
+    def put(self, data):
+        """Stores the encoded image (bytes) if it isn't stored yet. Returns its digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.get_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return digest
+
+    def get_base64(self, digest):
+        """Returns the image as a base64 string. The last few are cached, as each request sends them again."""
+        return read_base64(self.get_path(digest))
+
+
+@lru_cache(maxsize=IMAGE_BASE64_CACHE_SIZE)
+def read_base64(path):
+    # The file is memory-mapped, so it's encoded without reading it into a bytes object first
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return base64.standard_b64encode(mapped).decode('ascii')
+
+
+def make_image_element(digest, path, width, height, media_type="image/jpeg"):
+    """Returns the content element of a stored image. It's turned into the API form by get_wire_form."""
+    return {
+        "type": "image",
+        "path": path,  # The original file, opened when the thumbnail is clicked
+        "width": width,
+        "height": height,
+        "sha256": digest,
+        "media_type": media_type,
+    }
+
+
+_image_store = None
+_image_store_lock = threading.Lock()
+
+
+def get_image_store():
+    """Returns the image store shared by the whole app."""
+    global _image_store
+    if _image_store is None:
+        with _image_store_lock:
+            if _image_store is None:
+                _image_store = ImageStore()
+    return _image_store
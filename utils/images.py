@@ -90,16 +90,26 @@ def resize_to_fit_size(img, max_size_bytes):
     return img.resize(new_size, Image.Resampling.LANCZOS), new_size
 
 
-def convert_to_base64(img):
-    """Convert the image to a base64 encoded string."""
+def convert_to_jpeg(img):
+    """Convert the image to JPEG bytes."""
     buffer = io.BytesIO()
     img.save(buffer, format="JPEG")
-    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def convert_to_base64(img):
+    """Convert the image to a base64 encoded string."""
     # Use standard_b64encode and omit any prefix
-    return base64.standard_b64encode(buffer.read()).decode("utf-8")
+    return base64.standard_b64encode(convert_to_jpeg(img)).decode("utf-8")
 
 
 def encode_image(image_path, max_long_edge=1568):
+    """Returns the image as a base64 encoded JPEG, and its size (see encode_image_to_jpeg)."""
+    jpeg_bytes, new_size = encode_image_to_jpeg(image_path, max_long_edge)
+    return base64.standard_b64encode(jpeg_bytes).decode("utf-8"), new_size
+
+
+def encode_image_to_jpeg(image_path, max_long_edge=1568):
     """
     Note: according to Anthropic, the max long edge for images is 1568 pixels.
     https://docs.anthropic.com/en/docs/build-with-claude/vision
@@ -124,10 +134,7 @@ def encode_image(image_path, max_long_edge=1568):
     # Resize if necessary to reduce file size
     img, new_size = resize_to_fit_size(img, MAX_SIZE)
 
-    # Convert to base64 (will be saved as JPEG)
-    base64_str = convert_to_base64(img)
-
-    return base64_str, new_size
+    return convert_to_jpeg(img), new_size
 
 
 def load_image_for_gui(image_path):
@@ -1,7 +1,11 @@
+import bisect
+import copy
+import hashlib
 import threading
 import time
 import traceback
-from typing import List, Any, Callable, Union, Tuple
+from collections import OrderedDict
+from typing import List, Any, Callable, Iterator, Union, Tuple
 
 import dearpygui.dearpygui as dpg
 
@@ -29,10 +33,19 @@ class CallInNextFrame:
         cls.now_frame_queue.append([func, args, kwargs])
 
     @staticmethod
-    def execute():
+    def execute(budget_seconds: float | None = None):
+        '''
+        :param budget_seconds: if given, the calls left when it is spent are carried over to the next frame
+        (at least one call is made per frame)
+        '''
         next_frame_queue = CallInNextFrame.now_frame_queue.copy()
         CallInNextFrame.now_frame_queue.clear()
-        for func, args, kwargs in next_frame_queue:
+        start = time.perf_counter()
+        for i, (func, args, kwargs) in enumerate(next_frame_queue):
+            if budget_seconds is not None and i > 0 and time.perf_counter() - start >= budget_seconds:
+                # Ahead of the calls appended in this frame
+                CallInNextFrame.now_frame_queue[:0] = next_frame_queue[i:]
+                break
             try:
                 func(*args, **kwargs)
             except Exception:
@@ -74,6 +87,7 @@ class CallWhenDPGStarted:
         cls.functions_queue.clear()
 
 
+from . import glyph_widths
 from . import font_attributes
 from . import line_atributes
 from . import parser
@@ -82,29 +96,101 @@ from . import text_entities
 from .font_attributes import set_font_registry, set_add_font_function, set_font
 
 
-def wrap_text_entity(text: text_entities.StrEntity | text_entities.TextEntity, width: int | float = -1) -> text_entities.LineEntity:
-    def get_width(str_entity: text_entities.StrEntity | text_entities.TextEntity) -> int | float:
-        return text_entities.LineEntity.get_width(str_entity)
-
-    def to_words(str_entity: text_entities.StrEntity | text_entities.TextEntity) -> list[text_entities.StrEntity | text_entities.TextEntity]:
-        words_list = []
-        word = None
-        chars = str_entity.chars()
-        for char in chars:
-            if str(char) == " ":
-                if word is not None:
-                    words_list.append(word)
-                words_list.append(char)
-                word = None
+def _flatten_entity(entity: text_entities.StrEntity | text_entities.TextEntity) -> list[text_entities.StrEntity]:
+    if isinstance(entity, text_entities.StrEntity):
+        return [entity]
+    pieces = []
+    for item in entity:
+        pieces.extend(_flatten_entity(item))
+    return pieces
+
+
+def _slice_pieces(pieces: list[text_entities.StrEntity], offsets: list[int],
+                  start: int, end: int) -> text_entities.StrEntity | text_entities.TextEntity:
+    """Cuts the chars [start, end) out of the pieces of a paragraph, keeping their attributes."""
+    parts = []
+    i = bisect.bisect_right(offsets, start) - 1
+    while i < len(pieces) and offsets[i] < end:
+        piece = pieces[i]
+        piece_start = max(start - offsets[i], 0)
+        piece_end = min(end - offsets[i], len(piece))
+        i += 1
+        if piece_end <= piece_start:
+            continue
+        if len(parts) > 0 and parts[-1].attributes == piece.attributes:
+            text = str(parts[-1]) + str(piece)[piece_start:piece_end]
+        else:
+            text = str(piece)[piece_start:piece_end]
+            parts.append(None)
+        part = text_entities.StrEntity(text)
+        part.attributes = piece.attributes
+        parts[-1] = part
+
+    if len(parts) == 0:
+        return text_entities.StrEntity('')
+    if len(parts) == 1:
+        return parts[0]
+    return text_entities.TextEntity(parts)
+
+
+def _get_line_breaks(text: str) -> list[int]:
+    """Returns the positions where a line can end: around every space, and at the end of the text."""
+    breaks = []
+    for i in range(1, len(text)):
+        if text[i] == ' ' or text[i - 1] == ' ':
+            breaks.append(i)
+    breaks.append(len(text))
+    return breaks
+
+
+def _break_paragraph(paragraph: text_entities.StrEntity | text_entities.TextEntity,
+                     width: int | float) -> Iterator[text_entities.StrEntity | text_entities.TextEntity]:
+    """
+    Greedy line breaking over the prefix widths of the paragraph chars.
+
+    The furthest break that fits into the line is found with a binary search,
+    and only the final lines are turned into entities.
+    A word wider than the line is broken between chars.
+    """
+    pieces = _flatten_entity(paragraph)
+
+    # prefix[i] is the width of the first i chars of the paragraph
+    offsets = []
+    prefix = [0]
+    for piece in pieces:
+        offsets.append(len(prefix) - 1)
+        base = prefix[-1]
+        prefix.extend(base + char_width for char_width in piece.prefix_widths()[1:])
+    text = ''.join(str(piece) for piece in pieces)
+    length = len(text)
+
+    breaks = _get_line_breaks(text)
+    break_widths = [prefix[position] for position in breaks]
+
+    start = 0
+    first_break = 0
+    while start < length:
+        extra_width = text_entities.LineEntity.get_extra_width(paragraph.get_all_attributes())
+        if extra_width is None:
+            # Separators are never wrapped
+            end = length
+        else:
+            limit = prefix[start] + width - extra_width
+            while breaks[first_break] <= start:
+                first_break += 1
+            last_fit = bisect.bisect_right(break_widths, limit, lo=first_break) - 1
+            if last_fit >= first_break:
+                end = breaks[last_fit]
             else:
-                if word is None:
-                    word = char
-                else:
-                    word = word + char
-        if word is not None:
-            words_list.append(word)
-        return words_list
+                # Even the next word doesn't fit, so break it between chars
+                end = bisect.bisect_right(prefix, limit, lo=start + 1, hi=length + 1) - 1
+                end = max(end, start + 1)
 
+        yield _slice_pieces(pieces, offsets, start, end)
+        start = end
+
+
+def wrap_text_entity(text: text_entities.StrEntity | text_entities.TextEntity, width: int | float = -1) -> text_entities.LineEntity:
     print_text = text_entities.LineEntity()
     paragraphs_list = text.split('\n')
     if width < 0:
@@ -113,33 +199,13 @@ def wrap_text_entity(text: text_entities.StrEntity | text_entities.TextEntity, w
         return print_text
 
     for paragraph in paragraphs_list:
-        sentence = text_entities.StrEntity('')
         if len(paragraph) == 0:
             print_text.append(paragraph)
             continue
 
-        words_list = to_words(paragraph)
-        for word in words_list:
-            sentence_with_next_word = sentence + word
-            if get_width(sentence_with_next_word) <= width:
-                sentence = sentence_with_next_word
-                continue
-            if len(sentence) != 0:
-                print_text.append(sentence)
-                if get_width(word) <= width:
-                    sentence = word
-                    continue
-
-            sentence = text_entities.StrEntity('')
-            for i, char in enumerate(word.chars()):
-                sentence_with_next_char = sentence + char
-                if get_width(sentence_with_next_char) <= width:
-                    sentence = sentence_with_next_char
-                else:
-                    if len(sentence) > 0:
-                        print_text.append(sentence)
-                    sentence = char
-        print_text.append(sentence)
+        # Lazy on purpose: appending the first line of a task list item changes the width of the next lines
+        for line in _break_paragraph(paragraph, width):
+            print_text.append(line)
 
     return print_text
 
@@ -222,35 +288,106 @@ class _ConvertedMessageEntity:
         return self.offset < index <= self.end
 
 
+class _ParseCache:
+    """
+    Bounded LRU cache of the parsed markdown, keyed by a hash of the source text.
+
+    Stores the clear text, the parser entities and the attribute segments
+    (start, end, indices of the entities applied to the slice), so building
+    a MarkdownText for an already seen text skips both the parsing and the attribute sweep.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(markdown_text: str) -> bytes:
+        return hashlib.blake2b(markdown_text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    def get(self, key: bytes):
+        with self._lock:
+            value = self._items.get(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._items), 'max_size': self.max_size}
+
+
+parse_cache = _ParseCache()
+
+
+def _parse_markdown(markdown_text: str) -> tuple[str, list[parser.MessageEntity], list[tuple[int, int, list[int]]]]:
+    clear_text, entities = parser.parse(markdown_text)
+    attributes = [_ConvertedMessageEntity(entity) for entity in entities]
+
+    attribute_points = []
+    for entity in attributes:
+        attribute_points.append(entity.offset)
+        attribute_points.append(entity.end)
+
+    attribute_points.append(len(clear_text))
+    attribute_points = list(set(attribute_points))
+    attribute_points.sort()
+
+    segments = []
+    for i, point in enumerate(attribute_points):
+        entity_indices = [j for j, entity in enumerate(attributes) if point == entity]
+        past_point = attribute_points[i - 1] if i != 0 else 0
+        segments.append((past_point, point, entity_indices))
+    return clear_text, entities, segments
+
+
+def _fresh_entity(entity: parser.MessageEntity) -> parser.MessageEntity:
+    # The attribute connectors are filled during rendering, so every MarkdownText needs its own
+    entity = copy.copy(entity)
+    entity._attribute_connector = None
+    return entity
+
+
 class MarkdownText:
     text_entity: text_entities.TextEntity | text_entities.StrEntity
 
     def __init__(self, markdown_text: str):
-        clear_text, attributes = parser.parse(markdown_text)
-        for i in range(len(attributes)):
-            attributes[i] = _ConvertedMessageEntity(attributes[i])
-
-        attribute_points = []
-        for entity in attributes:
-            attribute_points.append(entity.offset)
-            attribute_points.append(entity.end)
+        key = parse_cache.make_key(markdown_text)
+        parsed = parse_cache.get(key)
+        if parsed is None:
+            parsed = _parse_markdown(markdown_text)
+            parse_cache.put(key, parsed)
+        clear_text, entities, segments = parsed
 
-        attribute_points.append(len(clear_text))
-        attribute_points = list(set(attribute_points))
-        attribute_points.sort()
+        attributes = [_ConvertedMessageEntity(_fresh_entity(entity)) for entity in entities]
 
-        if len(attribute_points) == 0:
+        if len(segments) == 0:
             self.text_entity = text_entities.StrEntity(clear_text)
         else:
             self.text_entity = text_entities.TextEntity()
 
-        for i, point in enumerate(attribute_points):
-            str_attributes = []
-            for entity in attributes:
-                if point == entity:
-                    str_attributes.append(entity.object)
-
-            past_point = attribute_points[i - 1] if i != 0 else 0
+        for past_point, point, entity_indices in segments:
+            str_attributes = [attributes[j].object for j in entity_indices]
 
             str_entity = text_entities.StrEntity(clear_text[past_point:point:])
             if line_atributes.Separator in str_attributes:
@@ -271,43 +408,65 @@ class MarkdownText:
                 str_entity.set_attributes(str_attributes)
                 self.text_entity.append(str_entity)
 
+    def layout(self, wrap: int | float = -1) -> text_entities.LineEntity:
+        '''
+        Breaks the text into lines. Creates no DPG items, so it can run outside the render thread.
+        :param wrap: Number of pixels from the start of the item until wrapping starts.
+        :return: the lines, made of runs of text with their attributes (see add_layout)
+        '''
+        return wrap_text_entity(self.text_entity, width=wrap)
+
     def add(self, wrap: int | float = -1, parent=0):
         '''
         :param wrap: Number of pixels from the start of the item until wrapping starts.
         :param parent: Parent to add this item to. (runtime adding)
         :return: group with rendered text
         '''
-        # Wrap the text entity
-        print_text: text_entities.LineEntity = wrap_text_entity(self.text_entity, width=wrap)
-
-        if not dpg.does_item_exist(parent):
-            print(f"Warning: Parent item {parent} does not exist.")
-            # Handle the case where parent is invalid
-            # For example, you can set 'parent' to 0 or another valid item
-            parent = 0
-
-        # Create the group immediately without using 'with' context manager
-        group = dpg.add_group(parent=parent, horizontal=True)
-        text_group = dpg.add_group(parent=group)
-        attributes_group = dpg.add_group(parent=group)
-
-        # Define the function to perform deferred operations
-        def create_gui_elements():
-            # Bind the item theme
-            dpg.bind_item_theme(group, text_entities.AttributeController.dpg_group_theme)
-
-            # Render the text
-            print_text.render(parent=text_group, attributes_group=attributes_group)
-
-        if not CallWhenDPGStarted.STARTUP_DONE:
-            # Schedule the function to run after Dear PyGui has started
-            CallWhenDPGStarted.append(create_gui_elements)
-        else:
-            # Execute immediately if Dear PyGui has already started
-            create_gui_elements()
+        return add_layout(self.layout(wrap=wrap), parent=parent)
+
+
+def layout_text(markdown_text: str, wrap: float | int = -1) -> text_entities.LineEntity:
+    ''' Parses and wraps Markdown text without creating DPG items (see add_layout).
+    :param wrap: Number of pixels from the start of the item until wrapping starts.
+    :return: the wrapped lines
+    '''
+    return MarkdownText(markdown_text=markdown_text).layout(wrap=wrap)
+
 
-        # Return the group ID
-        return group
+def add_layout(print_text: text_entities.LineEntity, parent: int | str = 0) -> int:
+    ''' Creates the DPG items of text wrapped with layout_text or MarkdownText.layout.
+    Must be called from the render thread. A layout can only be added once.
+    :param parent: Parent to add this item to. (runtime adding)
+    :return: group with rendered text
+    '''
+    if not dpg.does_item_exist(parent):
+        print(f"Warning: Parent item {parent} does not exist.")
+        # Handle the case where parent is invalid
+        # For example, you can set 'parent' to 0 or another valid item
+        parent = 0
+
+    # Create the group immediately without using 'with' context manager
+    group = dpg.add_group(parent=parent, horizontal=True)
+    text_group = dpg.add_group(parent=group)
+    attributes_group = dpg.add_group(parent=group)
+
+    # Define the function to perform deferred operations
+    def create_gui_elements():
+        # Bind the item theme
+        dpg.bind_item_theme(group, text_entities.AttributeController.dpg_group_theme)
+
+        # Render the text
+        print_text.render(parent=text_group, attributes_group=attributes_group)
+
+    if not CallWhenDPGStarted.STARTUP_DONE:
+        # Schedule the function to run after Dear PyGui has started
+        CallWhenDPGStarted.append(create_gui_elements)
+    else:
+        # Execute immediately if Dear PyGui has already started
+        create_gui_elements()
+
+    # Return the group ID
+    return group
 
 
 def add_text(markdown_text: str,
@@ -0,0 +1,184 @@
+'''
+Microbenchmark of wrap_text_entity.
+
+Wraps a ~20 KB assistant answer at several widths with the old line breaker
+(which re-measured the whole candidate line with dpg.get_text_size at every word)
+and with the current one (prefix widths + binary search), and prints the speedup.
+
+Run from the root of the app:
+    python -m utils.markdown.benchmark_wrap
+    python -m utils.markdown.benchmark_wrap --fake-measure  # without a display, DPG text measuring is emulated
+'''
+import argparse
+import time
+
+import dearpygui.dearpygui as dpg
+
+import utils.markdown as dpg_markdown
+from utils.markdown import text_entities
+
+WIDTHS = [300, 600, 1200]
+ANSWER_SIZE = 20 * 1024
+FONT_PATH = 'assets/fonts/EBGaramond-Regular.ttf'
+FONT_SIZE = 32
+
+ANSWER_PARTS = [
+    "Here is an overview of how the **render loop** works, and why *long replies* were slow to appear.\n\n",
+    "1. The reply is parsed from markdown into text entities with attributes such as `Bold` or `Code`.\n"
+    "2. Every paragraph is broken into lines that fit into the wrap width of the chat history.\n"
+    "3. The lines are turned into DPG text items, grouped per line.\n\n",
+    "> Measuring text is the expensive part: each call goes through the DPG context, "
+    "and the old breaker measured the whole line again after every word.\n\n",
+    "```python\ndef wrap(words, width):\n    line = []\n    for word in words:\n        line.append(word)\n    return line\n```\n\n",
+    "A very long identifier like averyveryveryverylongidentifierthatcannotbebrokenatspacesatallbecauseithasnone "
+    "has to be broken between its characters, which used to measure every prefix of it.\n\n",
+    "- first point with a [link](https://example.com) in it\n- second point, a bit longer than the first one, to wrap\n\n",
+    "---\n\n",
+]
+
+
+def build_answer(size: int = ANSWER_SIZE) -> str:
+    parts = []
+    total = 0
+    while total < size:
+        for part in ANSWER_PARTS:
+            parts.append(part)
+            total += len(part)
+    return ''.join(parts)
+
+
+def _legacy_get_width(str_entity) -> float | int:
+    # Like the old StrEntity.get_width: one get_text_size call per entity
+    width = 0
+    for piece in dpg_markdown._flatten_entity(str_entity):
+        width += dpg_markdown.get_text_size(str(piece), font=piece.attributes.get_font())[0]
+    extra_width = text_entities.LineEntity.get_extra_width(str_entity.get_all_attributes())
+    if extra_width is None:
+        return -1
+    return width + extra_width
+
+
+def legacy_wrap_text_entity(text, width=-1):
+    '''The line breaker this module replaced, kept here for comparison.'''
+    get_width = _legacy_get_width
+
+    def to_words(str_entity):
+        words_list = []
+        word = None
+        chars = str_entity.chars()
+        for char in chars:
+            if str(char) == " ":
+                if word is not None:
+                    words_list.append(word)
+                words_list.append(char)
+                word = None
+            else:
+                if word is None:
+                    word = char
+                else:
+                    word = word + char
+        if word is not None:
+            words_list.append(word)
+        return words_list
+
+    print_text = text_entities.LineEntity()
+    paragraphs_list = text.split('\n')
+    if width < 0:
+        for paragraph in paragraphs_list:
+            print_text.append(paragraph)
+        return print_text
+
+    for paragraph in paragraphs_list:
+        sentence = text_entities.StrEntity('')
+        if len(paragraph) == 0:
+            print_text.append(paragraph)
+            continue
+
+        words_list = to_words(paragraph)
+        for word in words_list:
+            sentence_with_next_word = sentence + word
+            if get_width(sentence_with_next_word) <= width:
+                sentence = sentence_with_next_word
+                continue
+            if len(sentence) != 0:
+                print_text.append(sentence)
+                if get_width(word) <= width:
+                    sentence = word
+                    continue
+
+            sentence = text_entities.StrEntity('')
+            for i, char in enumerate(word.chars()):
+                sentence_with_next_char = sentence + char
+                if get_width(sentence_with_next_char) <= width:
+                    sentence = sentence_with_next_char
+                else:
+                    if len(sentence) > 0:
+                        print_text.append(sentence)
+                    sentence = char
+        print_text.append(sentence)
+
+    return print_text
+
+
+def _fake_get_text_size(text: str, *, wrap_width: float = -1.0, font: int | str = 0, **kwargs):
+    # Roughly what a proportional font gives, at the cost of a (cheap) call per measurement
+    line_widths = [sum(FONT_SIZE * (0.3 if char == ' ' else 0.5) for char in line) for line in text.split('\n')]
+    return [max(line_widths), FONT_SIZE]
+
+
+def setup_dpg(fake_measure7: bool) -> None:
+    dpg.create_context()
+    if fake_measure7:
+        dpg_markdown.get_text_size = _fake_get_text_size
+        dpg_markdown.glyph_widths.get_text_size = _fake_get_text_size
+        text_entities.get_text_size = _fake_get_text_size
+        return
+
+    with dpg.font_registry():
+        font = dpg.add_font(FONT_PATH, FONT_SIZE)
+    dpg.bind_font(font)
+    dpg_markdown.glyph_widths.set_default_font(font)
+    dpg.create_viewport(title='wrap benchmark', width=200, height=100)
+    dpg.setup_dearpygui()
+    dpg.show_viewport()
+    # Text can only be measured once the font atlas is built
+    for _ in range(3):
+        dpg.render_dearpygui_frame()
+
+
+def measure(function, text_entity, width: int, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text_entity, width=width)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--fake-measure', action='store_true', help="emulate DPG text measuring (no display needed)")
+    argparser.add_argument('--repeat', type=int, default=3)
+    args = argparser.parse_args()
+
+    setup_dpg(args.fake_measure)
+
+    answer = build_answer()
+    text_entity = dpg_markdown.MarkdownText(answer).text_entity
+    # Warm the glyph tables, so the first run is not charged for sampling the font
+    dpg_markdown.wrap_text_entity(text_entity, width=WIDTHS[0])
+
+    print(f"Wrapping a {len(answer) / 1024:.1f} KB answer (best of {args.repeat})")
+    print(f"{'width':>8} {'old, s':>10} {'new, s':>10} {'speedup':>9} {'lines':>7}")
+    for width in WIDTHS:
+        old_time = measure(legacy_wrap_text_entity, text_entity, width, args.repeat)
+        new_time = measure(dpg_markdown.wrap_text_entity, text_entity, width, args.repeat)
+        lines = len(dpg_markdown.wrap_text_entity(text_entity, width=width))
+        print(f"{width:>8} {old_time:>10.4f} {new_time:>10.4f} {old_time / new_time:>8.1f}x {lines:>7}")
+
+    if not args.fake_measure:
+        dpg.destroy_context()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Glyph advance tables, to measure text without calling dpg.get_text_size.
+
+Dear ImGui computes the width of a text line as the sum of the advances of its glyphs
+(there is no kerning), so once the advance of every glyph of a font is known,
+the width of any string is a plain sum. Each glyph is sampled from DPG only once per font.
+'''
+import threading
+from itertools import accumulate
+
+from . import get_text_size
+
+# DPG rounds text sizes up to whole pixels, so a glyph is measured as several copies of itself
+SAMPLE_REPEAT = 16
+# Measured between two bars, so zero-width glyphs don't look like "DPG is not ready yet" to get_text_size
+SAMPLE_BORDER = '|'
+PRELOADED_CHARS = ''.join(chr(i) for i in range(32, 127))
+
+_default_font: int | str = 0
+_tables: dict = {}
+_lock = threading.Lock()
+
+
+def set_default_font(font: int | str) -> None:
+    '''
+    Tells which font is used by the text items without a font of their own
+    (the font bound with dpg.bind_font or to the parent item).
+    '''
+    global _default_font
+    _default_font = font or 0
+
+
+class GlyphAdvanceTable:
+    def __init__(self, font: int | str):
+        self.font = font
+        self.advances: dict[str, float] = {}
+        self._border_width = None
+        self.preload(PRELOADED_CHARS)
+
+    def preload(self, chars: str) -> None:
+        for char in chars:
+            self.advance(char)
+
+    def advance(self, char: str) -> float:
+        advance = self.advances.get(char, None)
+        if advance is None:
+            advance = self._sample(char)
+            self.advances[char] = advance
+        return advance
+
+    def _sample(self, char: str) -> float:
+        if char == '\n':
+            return 0
+        if self._border_width is None:
+            self._border_width = get_text_size(SAMPLE_BORDER * 2, font=self.font)[0]
+        text = SAMPLE_BORDER + char * SAMPLE_REPEAT + SAMPLE_BORDER
+        width = get_text_size(text, font=self.font)[0]
+        return max(width - self._border_width, 0) / SAMPLE_REPEAT
+
+    def prefix_widths(self, text: str) -> list[float]:
+        '''
+        :return: list where [i] is the width of text[:i]
+        '''
+        advances = self.advances
+        return list(accumulate((advances[char] if char in advances else self.advance(char) for char in text), initial=0))
+
+    def text_width(self, text: str) -> float:
+        if '\n' in text:
+            return max(self.text_width(line) for line in text.split('\n'))
+        advances = self.advances
+        return sum(advances[char] if char in advances else self.advance(char) for char in text)
+
+
+def get_table(font: int | str | None = None) -> GlyphAdvanceTable:
+    font = font or _default_font
+    table = _tables.get(font, None)
+    if table is not None:
+        return table
+    # Sampled outside the lock: it calls get_text_size for every preloaded glyph,
+    # and the render thread must not wait for that on the tables of the other fonts
+    table = GlyphAdvanceTable(font)
+    with _lock:
+        # Another thread may have built it meanwhile: its table is kept, so there is one per font
+        return _tables.setdefault(font, table)
+
+
+def text_width(text: str, font: int | str | None = None) -> float:
+    return get_table(font).text_width(text)
+
+
+def prefix_widths(text: str, font: int | str | None = None) -> list[float]:
+    return get_table(font).prefix_widths(text)
+
+
+def clear() -> None:
+    with _lock:
+        _tables.clear()
@@ -1,6 +1,7 @@
 import dearpygui.dearpygui as dpg
 
 from . import get_text_size
+from . import glyph_widths
 from .attribute_types import CallInNextFrame
 from .attribute_types import LineAttribute, AttributeConnector
 from .font_attributes import Default
@@ -116,7 +117,7 @@ class List(LineAttribute):
         return f"<List.{self.depth}, attr_id: {hex(id(self.attribute_connector))} id: {hex(id(self))}>"
 
     def get_width(self) -> int | float:
-        width = get_text_size(f"{'0' * self.max_index_symbols_length}.  ", font=Default.get_font())[0]
+        width = glyph_widths.text_width(f"{'0' * self.max_index_symbols_length}.  ", font=Default.get_font())
         width += self.get_task_width()
         return width
 
@@ -126,9 +127,9 @@ class List(LineAttribute):
             return width
         if self.attribute_connector.first_line_objects is not None:  # noqa
             if self in self.attribute_connector.first_line_objects:  # noqa
-                width += Default.get_now_font_size() + get_text_size(" " * 2, font=Default.get_font())[0]
+                width += Default.get_now_font_size() + glyph_widths.text_width(" " * 2, font=Default.get_font())
         else:
-            width += Default.get_now_font_size() + get_text_size(" " * 2, font=Default.get_font())[0]
+            width += Default.get_now_font_size() + glyph_widths.text_width(" " * 2, font=Default.get_font())
         return width
 
     def render(self, text_height: int | float, parent=0, attributes_group=0):
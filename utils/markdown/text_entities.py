@@ -3,6 +3,7 @@ from typing import TypeVar
 
 import dearpygui.dearpygui as dpg  # noqa
 
+from . import glyph_widths
 from .font_attributes import *
 from .line_atributes import *
 from .text_attributes import *
@@ -14,11 +15,16 @@ class AttributeController(list[Attribute]):
     font: None | int
 
     def __new__(cls, *args, **kwargs):
+        cls.create_theme()
+        return list.__new__(cls)
+
+    @classmethod
+    def create_theme(cls):
+        # Uses the DPG container stack, so must first be called from the render thread (see MarkdownText.layout)
         if cls.dpg_group_theme is None:
             with dpg.theme() as cls.dpg_group_theme:
                 with dpg.theme_component(dpg.mvAll):
                     dpg.add_theme_style(dpg.mvStyleVar_ItemSpacing, 0, 0, category=dpg.mvThemeCat_Core)
-        return list.__new__(cls)
 
     def __init__(self, attributes: list[Attribute]):
         super().__init__()
@@ -185,9 +191,19 @@ class StrEntity(str):
                 return TextEntity([self]) + __object
 
     def get_width(self) -> float | int:
+        return self.prefix_widths()[-1]
+
+    def prefix_widths(self) -> list[float]:
+        '''
+        :return: list where [i] is the width of the first i chars (cached while the font stays the same)
+        '''
         font = self.attributes.get_font()
-        text = str(self)
-        return get_text_size(text, font=font)[0]
+        cached = getattr(self, '_prefix_widths', None)
+        if cached is not None and cached[0] == font:
+            return cached[1]
+        widths = glyph_widths.prefix_widths(str(self), font=font)
+        self._prefix_widths = (font, widths)
+        return widths
 
     def get_height(self) -> float | int:
         return self.attributes.get_height()
@@ -202,7 +218,8 @@ class StrEntity(str):
         for i, attribute in enumerate(list_of_attributes):
             if not isinstance(attribute, type):
                 attribute_connector = attribute.attribute_connector
-                attribute = copy.deepcopy(attribute)
+                # The connector is shared between the copies, so it is kept out of the (slow) deep copy
+                attribute = copy.deepcopy(attribute, memo={id(attribute_connector): attribute_connector})
                 attribute.attribute_connector = attribute_connector
             self.attributes.append(attribute)
 
@@ -367,9 +384,17 @@ class LineEntity(TextEntity):
 
     @staticmethod
     def get_width(text_entity: TextEntity | StrEntity) -> float | int:  # noqa
-        width = text_entity.get_width()
-        attributes = text_entity.get_all_attributes()
+        extra_width = LineEntity.get_extra_width(text_entity.get_all_attributes())
+        if extra_width is None:
+            return -1
+        return text_entity.get_width() + extra_width
 
+    @staticmethod
+    def get_extra_width(attributes: list[Attribute]) -> float | int | None:
+        '''
+        :return: width taken by the line attributes (blockquotes, lists), None for separators
+        '''
+        width = 0
         blockquote_attributes: list[Blockquote] = LineEntity.get_attributes_by_type(attributes, Blockquote)  # noqa
         blockquote_attributes: list[Blockquote] = LineEntity.remove_duplicates_by_depth(blockquote_attributes)  # noqa
         for attribute in blockquote_attributes:
@@ -381,7 +406,7 @@ class LineEntity(TextEntity):
             width += attribute.get_width()
         separator_attributes: list[Separator] = LineEntity.get_attributes_by_type(attributes, Separator)  # noqa
         if len(separator_attributes) > 0:
-            width = -1
+            return None
 
         return width
 
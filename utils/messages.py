@@ -1,9 +1,12 @@
 from pathlib import Path
 
-from config import THINKING_PLACEHOLDER, SHORTENED_MESSAGE_PLACEHOLDER
-from utils.ai_provider import get_claude_response
+from config import (
+    THINKING_PLACEHOLDER, SHORTENED_MESSAGE_PLACEHOLDER, SUMMARY_MESSAGE_PREFIX, IMAGE_MISSING_PLACEHOLDER,
+)
+from utils.ai_provider import get_claude_response, stream_claude_response
 
 from utils.context import build_context_data  
+from utils.image_store import get_image_store
 
 from utils.plugins_manager import PluginManager
 
@@ -49,12 +52,13 @@ def prepare_message_content(user_input):
     return content
 
 
-def handle_assistant_response(conversation, assistant_message):
+def handle_assistant_response(conversation, assistant_message, cost_info=None):
     """Handle Claude's response and update conversation"""
     # print("\nClaude:", assistant_message)
-    conversation.append(
-        {"role": "assistant", "content": [{"type": "text", "text": assistant_message}]}
-    )
+    message = {"role": "assistant", "content": [{"type": "text", "text": assistant_message}]}
+    if cost_info:
+        message["cost_info"] = cost_info
+    conversation.append(message)
 
 
 def print_instructions():
@@ -132,46 +136,137 @@ def build_chat_history(conversation):
     return chat_history
 
 
+# The key of the index of the context texts element in the content of a user message (see prepare_user_message)
+CONTEXT_ELEMENT_KEY = "context_element"
+
+
 def prepare_user_message(user_input, include_additional_context7=False):
     """Prepare the user's message content."""
     content = prepare_message_content(user_input)
 
     if include_additional_context7:
-        context_data = build_context_data()
+        context_data = build_context_data(query=user_input)
         if context_data:
-            # Combine the user's input and context data into a single text element
-            combined_text = content[0]["text"] + "\n" + context_data
-            content = [{"type": "text", "text": combined_text}]
+            # The context data goes in its own text element, right after the user's input,
+            # so the typed text can be told apart (e.g. to index only that for the search).
+            # The other elements (e.g. the images added by the plugins) are kept
+            content = [content[0], {"type": "text", "text": context_data}] + content[1:]
+            return {"role": "user", "content": content, CONTEXT_ELEMENT_KEY: 1}
 
     return {"role": "user", "content": content}
 
 
+def extract_message_text_without_context(message):
+    """Returns the text of the message without the context texts added to it (see prepare_user_message)."""
+    content = message["content"]
+    context_index = message.get(CONTEXT_ELEMENT_KEY)
+    if context_index is not None and isinstance(content, list):
+        content = content[:context_index] + content[context_index + 1:]
+    return extract_message_text(content)
+
+
 """
 def prepare_image_message(image_path, input_text):
     content = process_image_input_gui(image_path, input_text)
     return {"role": "user", "content": content}
 """
 
+# The key of the memoized API form of a message. Keys starting with "_" are never sent or saved
+WIRE_FORM_KEY = "_wire_form"
+# The keys of the image elements that are only used by the app (e.g. to show the thumbnail)
+IMAGE_METADATA_KEYS = ("path", "width", "height")
+
+
+def has_stored_images(message):
+    content = message["content"]
+    return isinstance(content, list) and any("sha256" in element for element in content)
+
+
+def get_wire_image(element):
+    """Returns the API form of an image element."""
+    if "sha256" in element:
+        # A reference to the image store (see make_image_element): the base64 is made now
+        try:
+            data = get_image_store().get_base64(element["sha256"])
+        except (OSError, ValueError) as e:
+            # E.g. the file was deleted. The rest of the conversation can still be sent
+            print(f"Warning: the image {element['sha256']} is omitted, as it can't be read: {e}")
+            return {"type": "text", "text": IMAGE_MISSING_PLACEHOLDER}
+        return {
+            "type": "image",
+            "source": {"type": "base64", "media_type": element["media_type"], "data": data},
+        }
+    # The images of the conversations saved before the image store existed have their base64 inline
+    return {key: value for key, value in element.items() if key not in IMAGE_METADATA_KEYS}
+
+
+def get_wire_form(message):
+    """
+    Returns the message as it's sent to the API: its role and content, without the metadata of the images.
+    The elements and their strings are shared with the message, not copied:
+    only the dicts of the image elements are rebuilt. So the result must not be modified.
+    """
+    content = message["content"]
+    if isinstance(content, list):
+        content = [
+            get_wire_image(element) if element.get("type") == "image" else element
+            for element in content
+        ]
+    return {"role": message["role"], "content": content}
+
+
 def sanitize_conversation(conversation):
+    """
+    Returns the conversation as it's sent to the API. Only the role and the content are sent,
+    the other keys are metadata (e.g. "cost_info").
+
+    The messages are final once another one follows them, so their API form is memoized on them.
+    Each call then only builds the last message, whatever the length of the conversation.
+    The messages with stored images are the exception: they are built each time,
+    so the base64 of the images isn't kept in memory (see ImageStore).
+    """
     # TODO: define allowed elements, remove everything else
-    import copy
-
-    sanitized_conversation = copy.deepcopy(conversation)
-    for message in sanitized_conversation:
-        content = message.get("content", [])
-        for element in content:
-            if element.get("type") == "image":
-                if "path" in element:
-                    del element["path"]
-                if "width" in element:
-                    del element["width"]
-                if "height" in element:
-                    del element["height"]
+    sanitized_conversation = []
+    last_index = len(conversation) - 1
+    for i, message in enumerate(conversation):
+        wire_form = message.get(WIRE_FORM_KEY)
+        if wire_form is None:
+            wire_form = get_wire_form(message)
+            if i < last_index and not has_stored_images(message):
+                message[WIRE_FORM_KEY] = wire_form
+        sanitized_conversation.append(wire_form)
     return sanitized_conversation
 
 
-def process_assistant_response(conversation_with_metadata):
-    """Process the assistant's response based on the conversation."""
+def apply_summary(conversation, summary):
+    """
+    Returns the conversation to send with the summarized messages replaced by the summary:
+    the first message (with the context texts), the summary as an assistant message, and the messages after it.
+    """
+    if not summary or summary["upto"] > len(conversation):
+        return conversation
+    summary_message = {
+        "role": "assistant",
+        "content": [{"type": "text", "text": SUMMARY_MESSAGE_PREFIX + summary["text"]}],
+    }
+    return [conversation[0], summary_message] + conversation[summary["upto"]:]
+
+
+def process_assistant_response(conversation_with_metadata, on_text_delta=None, mock7=False, conversation_id=None,
+                               context_window=None, summary=None):
+    """
+    Process the assistant's response based on the conversation.
+    The conversation_id is recorded in the usage ledger with the cost of the call.
+
+    If a context_window (ContextWindowManager) is given, only the part of the conversation
+    that fits its token budget is sent. The report of the truncation is kept in the
+    "context_window" key of the assistant message.
+    If a summary (see ConversationCompactor) is given, it's sent instead of the messages it covers.
+
+    If on_text_delta is given, the response is streamed: the assistant message is appended
+    to the conversation on the first delta and then grows in place. The callback is called
+    with the message after each delta.
+    """
     # Remove the thinking indicator from the conversation in place
     conversation_with_metadata[:] = [
         msg
@@ -182,11 +277,65 @@ def process_assistant_response(conversation_with_metadata):
     # Sanitize the conversation before sending
     sanitized_conversation = sanitize_conversation(conversation_with_metadata)
 
-    # Get assistant response using the sanitized conversation
-    assistant_message = get_claude_response(sanitized_conversation, conversation_with_metadata)
+    window_report = None
+    if context_window is not None:
+        sanitized_conversation, window_report = context_window.fit(
+            apply_summary(conversation_with_metadata, summary), apply_summary(sanitized_conversation, summary)
+        )
+    else:
+        sanitized_conversation = apply_summary(sanitized_conversation, summary)
+    if window_report:
+        print(
+            f"The conversation was shortened to fit {window_report['token_budget']} tokens: "
+            f"{window_report['dropped_messages']} old messages and "
+            f"{window_report['elided_images']} old images were omitted"
+        )
+
+    if on_text_delta is not None:
+        stream_assistant_response(
+            conversation_with_metadata, sanitized_conversation, on_text_delta, mock7=mock7,
+            conversation_id=conversation_id,
+        )
+    else:
+        # Get assistant response using the sanitized conversation
+        cost_info = {}
+        assistant_message = get_claude_response(
+            sanitized_conversation, conversation_with_metadata, mock7=mock7, cost_info=cost_info,
+            conversation_id=conversation_id,
+        )
+
+        # Handle assistant response
+        handle_assistant_response(conversation_with_metadata, assistant_message, cost_info=cost_info)
 
-    # Handle assistant response
-    handle_assistant_response(conversation_with_metadata, assistant_message)
+    if window_report:
+        conversation_with_metadata[-1]["context_window"] = window_report
 
     return conversation_with_metadata
 
+
+def stream_assistant_response(conversation_with_metadata, sanitized_conversation, on_text_delta, mock7=False,
+                              conversation_id=None):
+    """Stream the assistant's response into a message that grows in place."""
+    text_element = {"type": "text", "text": ""}
+    assistant_message = {"role": "assistant", "content": [text_element]}
+    appended7 = False
+    cost_info = {}
+
+    for delta in stream_claude_response(
+        sanitized_conversation, conversation_with_metadata, mock7=mock7, cost_info=cost_info,
+        conversation_id=conversation_id,
+    ):
+        if not appended7:
+            conversation_with_metadata.append(assistant_message)
+            appended7 = True
+        text_element["text"] += delta
+        on_text_delta(assistant_message)
+
+    if cost_info:
+        assistant_message["cost_info"] = cost_info
+
+    if not appended7:
+        # Nothing was streamed, but the turn still needs an assistant message
+        conversation_with_metadata.append(assistant_message)
+        on_text_delta(assistant_message)
+
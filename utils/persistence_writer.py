@@ -0,0 +1,89 @@
+import queue
+import threading
+import traceback
+
+from utils.chat_logs import save_conversation_to_text_file
+
+
+class PersistenceWriter:
+    """
+    Saves the conversations in a background thread, so disk latency never blocks the GUI.
+
+    It receives snapshots of the conversations: new lists of the same message dicts.
+    The messages are replaced rather than modified once they are in a snapshot
+    (the streamed reply is only saved when it's complete), so the snapshots can be read without a lock.
+    When saves come in bursts, only the latest snapshot of each journal is written.
+    """
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def save(self, journal, snapshot):
+        """Queues the sync of the journal with the snapshot of the conversation."""
+        self.start()
+        self.requests.put(("save", journal, snapshot, None))
+
+    def finish(self, journal, snapshot, directory, filename):
+        """Queues the last save of a conversation: syncs and compacts its journal, and writes the .txt export."""
+        self.start()
+        self.requests.put(("finish", journal, snapshot, (directory, filename)))
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is written. Returns False on timeout."""
+        if self.thread is None:
+            return True
+        done = threading.Event()
+        self.requests.put(("flush", None, None, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Writes everything queued so far and stops the thread (e.g. on exit)."""
+        if self.thread is None:
+            return
+        self.flush(timeout)
+        self.requests.put(("stop", None, None, None))
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            # Take the whole burst, so only the last snapshot of each journal is written
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            for i, (action, journal, snapshot, data) in enumerate(batch):
+                if action == "save":
+                    next_action = batch[i + 1] if i + 1 < len(batch) else None
+                    if next_action is not None and next_action[0] in ["save", "finish"] and next_action[1] is journal:
+                        continue  # Superseded by the next snapshot of the same journal
+                    self._write(journal.sync, snapshot)
+                elif action == "finish":
+                    self._write(journal.sync, snapshot)
+                    self._write(journal.compact)
+                    if snapshot:
+                        directory, filename = data
+                        self._write(save_conversation_to_text_file, snapshot, directory, filename)
+                elif action == "flush":
+                    data.set()
+                elif action == "stop":
+                    return
+
+    @staticmethod
+    def _write(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            print(f"Exception in PersistenceWriter when calling {func.__name__}")
+            traceback.print_exc()
@@ -0,0 +1,212 @@
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from os.path import basename
+
+from config import (
+    CONTEXT_TEXTS_DIR_PATH,
+    CONTEXT_INDEX_FILE_PATH,
+    RETRIEVAL_CHUNK_TOKENS,
+    RETRIEVAL_TOP_K,
+    RETRIEVAL_TOKEN_BUDGET,
+)
+from utils.files import scan_txt_files
+
+CHARS_PER_TOKEN = 4  # A rough estimate, to size the chunks without tokenizing them
+INDEX_VERSION = 1
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def get_terms(text):
+    """Returns the terms of the text: its lowercase words, and the parts of the snake_case ones."""
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        terms.append(word)
+        if "_" in word:
+            terms.extend(part for part in word.split("_") if part)
+    return terms
+
+
+def split_into_chunks(text, chunk_chars):
+    """Splits the text into chunks of whole paragraphs, up to chunk_chars long (longer paragraphs are cut)."""
+    chunks = []
+    current = []
+    current_size = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > chunk_chars:
+            cut = paragraph.rfind(" ", 0, chunk_chars)
+            if cut <= 0:
+                cut = chunk_chars
+            pieces = [paragraph[:cut].strip(), paragraph[cut:].strip()]
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_size = [], 0
+            chunks.append(pieces[0])
+            paragraph = pieces[1]
+        if current and current_size + len(paragraph) > chunk_chars:
+            chunks.append("\n\n".join(current))
+            current, current_size = [], 0
+        current.append(paragraph)
+        current_size += len(paragraph) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class ContextIndex:
+    """
+    A BM25 index of the chunks of the .txt files of the context dir, to send only the chunks relevant to a message.
+
+    The chunks and their term counts are saved to a file, with the modification time and size of each
+    .txt file. On each query, the dir is swept with stat() only, and the files that changed are chunked again.
+    """
+
+    def __init__(self, directory, index_file_path, chunk_tokens=RETRIEVAL_CHUNK_TOKENS):
+        self.directory = directory
+        self.index_file_path = index_file_path
+        self.chunk_chars = chunk_tokens * CHARS_PER_TOKEN
+        self.lock = threading.Lock()
+        self.files = {}  # path -> {"stat": [mtime_ns, size], "chunks": [{"text": ..., "terms": {term: count}}]}
+        self.load()
+        self.build_postings()
+
+    def load(self):
+        try:
+            with open(self.index_file_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved["version"] != INDEX_VERSION or saved["chunk_chars"] != self.chunk_chars:
+                raise ValueError("outdated index")
+            self.files = saved["files"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # No index yet, or an outdated one: chunk all the files
+            self.files = {}
+
+    def save(self):
+        temp_path = self.index_file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "chunk_chars": self.chunk_chars, "files": self.files}, f)
+        os.replace(temp_path, self.index_file_path)
+
+    def index_file(self, txt_file):
+        with open(txt_file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        return [
+            {"text": chunk, "terms": dict(Counter(get_terms(chunk)))}
+            for chunk in split_into_chunks(text, self.chunk_chars)
+        ]
+
+    def refresh(self):
+        """Chunks the new and changed files again, and drops the deleted ones. Returns True if anything changed."""
+        stats = scan_txt_files(self.directory)
+        changed7 = list(stats) != list(self.files)
+        files = {}
+        for txt_file, stat in stats.items():
+            indexed = self.files.get(txt_file)
+            if indexed is not None and tuple(indexed["stat"]) == stat:
+                files[txt_file] = indexed
+                continue
+            files[txt_file] = {"stat": list(stat), "chunks": self.index_file(txt_file)}
+            changed7 = True
+        self.files = files
+        if changed7:
+            self.build_postings()
+            self.save()
+        return changed7
+
+    def build_postings(self):
+        self.chunks = []  # (path, position in the file, text, length in terms)
+        self.postings = {}  # term -> [(chunk index, count)]
+        for txt_file, indexed in self.files.items():
+            for position, chunk in enumerate(indexed["chunks"]):
+                chunk_index = len(self.chunks)
+                self.chunks.append((txt_file, position, chunk["text"], sum(chunk["terms"].values())))
+                for term, count in chunk["terms"].items():
+                    self.postings.setdefault(term, []).append((chunk_index, count))
+        total_length = sum(chunk[3] for chunk in self.chunks)
+        self.average_length = total_length / len(self.chunks) if self.chunks else 0
+
+    def search(self, query, top_k=RETRIEVAL_TOP_K):
+        """Returns the indexes of the top_k chunks for the query, the most relevant first."""
+        with self.lock:
+            self.refresh()
+            scores = {}
+            chunk_count = len(self.chunks)
+            for term in set(get_terms(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_index, count in postings:
+                    length = self.chunks[chunk_index][3]
+                    norm = K1 * (1 - B + B * length / self.average_length)
+                    scores[chunk_index] = scores.get(chunk_index, 0.0) + idf * count * (K1 + 1) / (count + norm)
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            return ranked[:top_k]
+
+    def get_context(self, query, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        """
+        Returns the most relevant chunks for the query, in the format of build_context_data,
+        or None if none is relevant. The chunks are added by rank until the token budget is spent,
+        then ordered as in the files.
+        """
+        selected = []
+        tokens = 0
+        for chunk_index in self.search(query, top_k):
+            chunk_tokens = len(self.chunks[chunk_index][2]) / CHARS_PER_TOKEN
+            if selected and tokens + chunk_tokens > token_budget:
+                break
+            selected.append(self.chunks[chunk_index])
+            tokens += chunk_tokens
+        if not selected:
+            return None
+
+        file_order = {txt_file: i for i, txt_file in enumerate(self.files)}
+        selected.sort(key=lambda chunk: (file_order[chunk[0]], chunk[1]))
+        parts = []
+        for txt_file, _, text, _ in selected:
+            filename = basename(txt_file)
+            parts.append(f"<{filename}>\n{text}\n</{filename}>")
+        return "\n\n".join(parts)
+
+
+_context_index = None
+_context_index_lock = threading.Lock()
+
+
+def get_context_index():
+    """Returns the index of the context dir, loaded on the first use."""
+    global _context_index
+    if _context_index is None:
+        with _context_index_lock:
+            if _context_index is None:
+                _context_index = ContextIndex(CONTEXT_TEXTS_DIR_PATH, CONTEXT_INDEX_FILE_PATH)
+    return _context_index
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Shows the context chunks retrieved for a query.")
+    argparser.add_argument("query")
+    argparser.add_argument("--dir", default=CONTEXT_TEXTS_DIR_PATH, help="defaults to CONTEXT_TEXTS_DIR_PATH")
+    argparser.add_argument("--index", default=CONTEXT_INDEX_FILE_PATH)
+    args = argparser.parse_args()
+
+    if args.dir is None:
+        argparser.error("no context dir (set CONTEXT_TEXTS_DIR_PATH or pass --dir)")
+    index = ContextIndex(args.dir, args.index)
+    print(index.get_context(args.query) or "Nothing relevant found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import csv
+import io
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+FIELDS = [
+    "timestamp", "conversation_id", "model", "input_tokens", "output_tokens", "image_tokens", "cost_usd",
+    "cache_write_tokens", "cache_read_tokens",
+]
+# The rows written before the cache fields were added have only the first ones
+LEGACY_FIELDS_COUNT = 7
+TOKEN_FIELDS = ["input_tokens", "output_tokens", "image_tokens", "cache_write_tokens", "cache_read_tokens"]
+TOTAL_FIELDS = [
+    "calls", "input_tokens", "output_tokens", "image_tokens", "cost_usd", "cache_write_tokens", "cache_read_tokens",
+]
+UNKNOWN = "unknown"  # The conversation or the model of the calls logged before the ledger existed
+
+
+def new_totals():
+    return {field: 0 for field in TOTAL_FIELDS}
+
+
+def add_to_totals(totals, record):
+    totals["calls"] += 1
+    for field in TOTAL_FIELDS[1:]:
+        totals[field] += record[field]
+
+
+class UsageLedger:
+    """
+    The log of the API calls, one CSV row per call: the conversation, the model, the token counts and the cost.
+
+    The rollups (totals by day, month, model and conversation, and by conversation for each day)
+    are kept in a file next to the ledger, together with the byte offset of the ledger up to which
+    they are counted. So each update only parses the rows appended since the last one, and the queries
+    only read the rollups. If the ledger is edited by hand, rebuild them:
+        python -m utils.usage_ledger --rebuild
+    """
+
+    LEDGER_FILE_PATH = 'api_usage.csv'
+    ROLLUPS_SUFFIX = '.rollups.json'
+
+    def __init__(self, ledger_file_path=None, legacy_log_file_path=None):
+        """
+        Args:
+            legacy_log_file_path (str, optional): The "timestamp,cost" log of CostManager.
+                Its calls are imported when the ledger is created, so the totals include them.
+        """
+        if ledger_file_path:
+            self.LEDGER_FILE_PATH = ledger_file_path
+        self.rollups_file_path = self.LEDGER_FILE_PATH + self.ROLLUPS_SUFFIX
+        self.lock = threading.Lock()
+        if not os.path.exists(self.LEDGER_FILE_PATH):
+            self.create_ledger(legacy_log_file_path)
+        self.offset = 0  # The bytes of the ledger counted in the rollups
+        self.rollups = self.new_rollups()
+        self.load_rollups()
+
+    def create_ledger(self, legacy_log_file_path=None):
+        rows = []
+        if legacy_log_file_path and os.path.exists(legacy_log_file_path):
+            with open(legacy_log_file_path, 'r') as f:
+                for line in f:
+                    try:
+                        timestamp_str, cost_str = line.strip().split(',')
+                        datetime.fromisoformat(timestamp_str)
+                        rows.append([timestamp_str, UNKNOWN, UNKNOWN, 0, 0, 0, float(cost_str), 0, 0])
+                    except ValueError:
+                        continue
+        with open(self.LEDGER_FILE_PATH, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            writer.writerows(rows)
+
+    @staticmethod
+    def new_rollups():
+        return {"day": {}, "month": {}, "model": {}, "conversation": {}, "day_conversation": {}}
+
+    def record(self, cost_usd, conversation_id=None, model=None,
+               input_tokens=0, output_tokens=0, image_tokens=0, cache_write_tokens=0, cache_read_tokens=0):
+        """Appends the usage of an API call to the ledger."""
+        timestamp = datetime.utcnow().isoformat()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([
+            timestamp,
+            conversation_id or UNKNOWN,
+            model or UNKNOWN,
+            int(input_tokens),
+            int(output_tokens),
+            int(round(image_tokens)),
+            cost_usd,
+            int(cache_write_tokens),
+            int(cache_read_tokens),
+        ])
+        # One write per row, so a reader never sees a row of two calls mixed
+        with self.lock, open(self.LEDGER_FILE_PATH, 'a', newline='') as f:
+            f.write(buffer.getvalue())
+
+    def load_rollups(self):
+        try:
+            with open(self.rollups_file_path, 'r') as f:
+                saved = json.load(f)
+            rollups = saved["rollups"]
+            if set(rollups) != set(self.new_rollups()) or saved.get("fields") != TOTAL_FIELDS:
+                raise ValueError("unexpected rollups")
+            self.offset = int(saved["offset"])
+            self.rollups = rollups
+        except (OSError, ValueError, KeyError, TypeError):
+            # No rollups yet, or broken ones: count the whole ledger
+            self.offset = 0
+            self.rollups = self.new_rollups()
+
+    def save_rollups(self):
+        temp_path = self.rollups_file_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({"offset": self.offset, "fields": TOTAL_FIELDS, "rollups": self.rollups}, f)
+        os.replace(temp_path, self.rollups_file_path)
+
+    def update_rollups(self):
+        """Adds the rows appended to the ledger since the last update to the rollups."""
+        with self.lock:
+            ledger_size = os.path.getsize(self.LEDGER_FILE_PATH)
+            if ledger_size < self.offset:
+                # The ledger was truncated or replaced
+                self.offset = 0
+                self.rollups = self.new_rollups()
+            if ledger_size == self.offset:
+                return
+
+            with open(self.LEDGER_FILE_PATH, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+            # A row that is still being written is left for the next update
+            complete_size = data.rfind(b'\n') + 1
+            if complete_size == 0:
+                return
+            lines = data[:complete_size].decode('utf-8', errors='replace').splitlines()
+            for row in csv.reader(lines):
+                record = self.parse_row(row)
+                if record is not None:
+                    self.add_record(record)
+            self.offset += complete_size
+            self.save_rollups()
+
+    @staticmethod
+    def parse_row(row):
+        """Returns the row as a dict, or None for the header and broken rows."""
+        if len(row) == LEGACY_FIELDS_COUNT:
+            row = row + ["0"] * (len(FIELDS) - LEGACY_FIELDS_COUNT)
+        if len(row) != len(FIELDS):
+            return None
+        try:
+            record = dict(zip(FIELDS, row))
+            record["day"] = datetime.fromisoformat(record["timestamp"]).strftime("%Y-%m-%d")
+            for field in TOKEN_FIELDS:
+                record[field] = int(record[field])
+            record["cost_usd"] = float(record["cost_usd"])
+        except ValueError:
+            return None
+        return record
+
+    def add_record(self, record):
+        day = record["day"]
+        keys = {
+            "day": day,
+            "month": day[:7],
+            "model": record["model"],
+            "conversation": record["conversation_id"],
+        }
+        for rollup_name, key in keys.items():
+            add_to_totals(self.rollups[rollup_name].setdefault(key, new_totals()), record)
+        day_conversations = self.rollups["day_conversation"].setdefault(day, {})
+        add_to_totals(day_conversations.setdefault(record["conversation_id"], new_totals()), record)
+
+    def rebuild_rollups(self):
+        """Recounts the rollups from the whole ledger (e.g. after editing it by hand)."""
+        with self.lock:
+            self.offset = 0
+            self.rollups = self.new_rollups()
+        self.update_rollups()
+
+    # The queries read only the rollups, so their cost doesn't depend on the number of calls
+
+    def get_totals(self, rollup_name, key):
+        """Returns the totals of e.g. ("month", "2024-11"), ("model", ...) or ("conversation", ...)."""
+        self.update_rollups()
+        return dict(self.rollups[rollup_name].get(key, new_totals()))
+
+    def get_monthly_cost(self, month=None):
+        """Returns the cost of the month ("YYYY-MM", the current one by default) in USD."""
+        month = month or datetime.utcnow().strftime("%Y-%m")
+        return self.get_totals("month", month)["cost_usd"]
+
+    def get_daily_totals(self, days=30):
+        """Returns (day, totals) for the last days, the oldest first."""
+        self.update_rollups()
+        today = datetime.utcnow().date()
+        result = []
+        for i in reversed(range(days)):
+            day = (today - timedelta(days=i)).strftime("%Y-%m-%d")
+            result.append((day, dict(self.rollups["day"].get(day, new_totals()))))
+        return result
+
+    def get_top_conversations(self, days=7, limit=10):
+        """Returns (conversation id, totals) of the most expensive conversations of the last days."""
+        self.update_rollups()
+        today = datetime.utcnow().date()
+        conversations = {}
+        for i in range(days):
+            day = (today - timedelta(days=i)).strftime("%Y-%m-%d")
+            for conversation_id, totals in self.rollups["day_conversation"].get(day, {}).items():
+                conversation_totals = conversations.setdefault(conversation_id, new_totals())
+                for field in TOTAL_FIELDS:
+                    conversation_totals[field] += totals[field]
+        ranked = sorted(conversations.items(), key=lambda item: item[1]["cost_usd"], reverse=True)
+        return ranked[:limit]
+
+    def get_model_totals(self):
+        """Returns the totals of each model, the most expensive first."""
+        self.update_rollups()
+        totals = [(model, dict(model_totals)) for model, model_totals in self.rollups["model"].items()]
+        return sorted(totals, key=lambda item: item[1]["cost_usd"], reverse=True)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Reports of the API usage ledger.")
+    argparser.add_argument("--rebuild", action="store_true", help="recount the rollups from the whole ledger")
+    argparser.add_argument("--ledger", default=None, help=f"defaults to {UsageLedger.LEDGER_FILE_PATH}")
+    argparser.add_argument("--days", type=int, default=7, help="the period of the top conversations")
+    args = argparser.parse_args()
+
+    ledger = UsageLedger(args.ledger)
+    if args.rebuild:
+        ledger.rebuild_rollups()
+
+    print(f"This month: ${ledger.get_monthly_cost():.5f}")
+    print(f"\nThe most expensive conversations of the last {args.days} days:")
+    for conversation_id, totals in ledger.get_top_conversations(days=args.days):
+        print(f"  {conversation_id}: ${totals['cost_usd']:.5f} in {totals['calls']} calls")
+    print("\nBy model:")
+    for model, totals in ledger.get_model_totals():
+        print(f"  {model}: ${totals['cost_usd']:.5f} in {totals['calls']} calls, "
+              f"{totals['cache_read_tokens']} tokens read from the prompt cache")
+
+
+if __name__ == "__main__":
+    main()